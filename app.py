@@ -58,6 +58,38 @@ else:
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///employee_management.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
+# 'on_demand' lets dashboards fill in missing attendance rows on read;
+# 'background' leaves that entirely to the `flask materialize-attendance` job;
+# 'virtual' stores only real punches and computes absent/weekend/holiday/leave days on read
+app.config['ATTENDANCE_MATERIALIZATION'] = os.getenv('ATTENDANCE_MATERIALIZATION', 'on_demand')
+# Write-behind self check-ins: punches are journaled to local disk and flushed to the database in batches
+app.config['PUNCH_WRITE_BEHIND'] = os.getenv('PUNCH_WRITE_BEHIND', 'false').lower() == 'true'
+app.config['PUNCH_JOURNAL_DIR'] = os.getenv('PUNCH_JOURNAL_DIR')
+app.config['PUNCH_FLUSH_INTERVAL'] = float(os.getenv('PUNCH_FLUSH_INTERVAL', '2'))
+# Audit entries are written after commit; AUDIT_ASYNC hands them to a background writer thread
+# (a full queue of AUDIT_QUEUE_SIZE pending batches falls back to writing synchronously)
+app.config['AUDIT_ASYNC'] = os.getenv('AUDIT_ASYNC', 'false').lower() == 'true'
+app.config['AUDIT_QUEUE_SIZE'] = int(os.getenv('AUDIT_QUEUE_SIZE', '1000'))
+# `flask rotate-audit-logs` moves audit months older than AUDIT_RETENTION_MONTHS into gzipped NDJSON files
+# under AUDIT_ARCHIVE_DIR (default: instance/audit-archive), which the audit log page can still search
+app.config['AUDIT_RETENTION_MONTHS'] = int(os.getenv('AUDIT_RETENTION_MONTHS', '12'))
+app.config['AUDIT_ARCHIVE_DIR'] = os.getenv('AUDIT_ARCHIVE_DIR')
+# Rows per page of the audit log viewer (keyset-paginated, newest first)
+app.config['AUDIT_LOGS_PER_PAGE'] = int(os.getenv('AUDIT_LOGS_PER_PAGE', '50'))
+# Payroll for at least PAYROLL_PARALLEL_THRESHOLD active employees runs in the background,
+# split into shards of PAYROLL_SHARD_SIZE employees across PAYROLL_WORKERS processes (default: CPU count)
+app.config['PAYROLL_PARALLEL_THRESHOLD'] = int(os.getenv('PAYROLL_PARALLEL_THRESHOLD', '5000'))
+app.config['PAYROLL_SHARD_SIZE'] = int(os.getenv('PAYROLL_SHARD_SIZE', '2000'))
+app.config['PAYROLL_WORKERS'] = int(os.getenv('PAYROLL_WORKERS')) if os.getenv('PAYROLL_WORKERS') else None
+# A 'running' payroll run whose coordinator sent no heartbeat for this many seconds can be taken over
+app.config['PAYROLL_RUN_STALE_AFTER'] = int(os.getenv('PAYROLL_RUN_STALE_AFTER', '600'))
+# Payroll list pages show this many rows per page; month totals are cached for up to this many seconds
+app.config['PAYROLL_PER_PAGE'] = int(os.getenv('PAYROLL_PER_PAGE', '50'))
+app.config['PAYROLL_TOTALS_CACHE_TTL'] = int(os.getenv('PAYROLL_TOTALS_CACHE_TTL', '300'))
+# Rendered payslips are cached here by content hash (default: instance/payslip-cache)
+app.config['PAYSLIP_CACHE_DIR'] = os.getenv('PAYSLIP_CACHE_DIR')
+# Header notification / pending-leave counts are cached per user for up to this many seconds
+app.config['NAV_CACHE_TTL'] = int(os.getenv('NAV_CACHE_TTL', '30'))
 
 @app.context_processor
 def inject_now():
@@ -74,8 +106,27 @@ login_manager.login_view = 'auth.login'  # Route to the login page
 from models import User, Employee, Department, Designation, Schedule, Attendance, Leave, Payroll, Check, Salary, LateTime, OverTime, Role, WorkingDayConfig, Notification, Document, PerformanceReview
 from routes import auth, admin, employee, attendance, department, designation, user, schedule, payroll, leave, leave_type, hr, api, document, review
 
-from audit import register_audit_listeners
+from audit import init_audit_writer, register_audit_listeners
 register_audit_listeners()
+init_audit_writer(app)
+
+from utils.rollups import register_rollup_listeners
+register_rollup_listeners()
+
+from utils.payroll_stale import register_payroll_stale_listeners
+register_payroll_stale_listeners()
+
+from utils.payroll_totals import register_payroll_totals_listeners
+register_payroll_totals_listeners()
+
+from utils.nav_counts import nav_context, register_nav_counts_listeners
+register_nav_counts_listeners()
+
+from commands import register_commands
+register_commands(app)
+
+from utils.punch_journal import init_punch_journal
+init_punch_journal(app)
 
 # Register blueprints
 app.register_blueprint(auth.bp)
@@ -128,21 +179,14 @@ def index():
 @app.context_processor
 def inject_user():
     # Provide current_user plus pending leaves count for notifications
-    pending_leaves = 0
-    unread_notifications_count = 0
-    recent_notifications = []
+    # (memoized per request and cached per user, see utils.nav_counts)
+    context = dict(current_user=current_user, pending_leaves=0, unread_notifications_count=0, recent_notifications=[])
     try:
         if current_user.is_authenticated:
-            if getattr(current_user, 'role', None) and current_user.role.name in ['superadmin', 'hr']:
-                from models import Leave
-                pending_leaves = Leave.query.filter_by(status='pending').count()
-            
-            # Fetch unread notifications for current user
-            unread_notifications_count = Notification.query.filter_by(user_id=current_user.id, is_read=False).count()
-            recent_notifications = Notification.query.filter_by(user_id=current_user.id).order_by(Notification.created_at.desc()).limit(5).all()
+            context.update(nav_context(current_user))
     except Exception:
         pass
-    return dict(current_user=current_user, pending_leaves=pending_leaves, unread_notifications_count=unread_notifications_count, recent_notifications=recent_notifications)
+    return context
 
 # Error handlers
 @app.errorhandler(404)
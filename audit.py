@@ -1,11 +1,122 @@
+import atexit
+import base64
 import json
+import os
+import queue
+import threading
+import zlib
+from collections import defaultdict
 from datetime import datetime, date, time
 from decimal import Decimal
-from flask import request, has_request_context
+from functools import wraps
+from flask import current_app, request, has_request_context
 from flask_login import current_user
-from sqlalchemy import event, inspect
+from sqlalchemy import bindparam, event, inspect, select
+from sqlalchemy.orm import object_session
 from database import db
 from models import AuditLog
+from utils.db import chunked
+
+# session.info key holding the audit entries of the current transaction
+PENDING_KEY = 'audit_pending'
+# session.info key holding the AuditSummary that suppresses per-row entries
+SUMMARY_KEY = 'audit_summary'
+
+# Rows per multi-row INSERT (11 columns each keeps every backend under its bind limit)
+WRITE_BATCH_SIZE = 500
+
+# Longest search_text stored per entry; the viewer's text filter only sees this much
+SEARCH_TEXT_LENGTH = 2000
+
+class AuditPolicy:
+    """What the audit trail records for one model.
+
+    include: columns to capture (None means all), exclude: columns never
+    captured, mask: columns recorded only as '***', skip_noop: drop updates
+    whose captured values did not actually change, enabled: audit at all.
+    """
+
+    def __init__(self, include=None, exclude=(), mask=(), skip_noop=True, enabled=True):
+        self.include = set(include) if include is not None else None
+        self.exclude = set(exclude)
+        self.mask = set(mask)
+        self.skip_noop = skip_noop
+        self.enabled = enabled
+
+    def captures(self, column):
+        return column not in self.exclude and (self.include is None or column in self.include)
+
+# The audit row itself carries record_id and created_at; timestamps also change on every write
+NOISE_COLUMNS = ('id', 'created_at', 'updated_at')
+SECRET_COLUMNS = ('password', 'remember_token')
+
+DEFAULT_POLICY = AuditPolicy(exclude=NOISE_COLUMNS, mask=SECRET_COLUMNS)
+
+AUDIT_POLICIES = {
+    'Notification': AuditPolicy(include=('user_id', 'type', 'is_read')),
+    'PayrollRun': AuditPolicy(include=('month', 'year', 'status', 'created_count', 'created_by')),
+    # Shard progress is bookkeeping of a run that is audited itself
+    'PayrollRunShard': AuditPolicy(enabled=False),
+}
+
+def policy_for(target):
+    return AUDIT_POLICIES.get(target.__class__.__name__, DEFAULT_POLICY)
+
+# Payload encoding: 'z2:' + base85(raw deflate(compact JSON)) with a preset
+# dictionary of the keys and values audit payloads repeat. Never change a
+# released dictionary (stored rows depend on it); add a new prefix instead.
+# 'z1:' rows (base64, ZDICT_V1 alone) are still read.
+#
+# Typical ratios against the old full-row JSON dumps: Attendance about 9x,
+# Employee snapshots about 3x (names, email, phone and address are unique
+# text that no dictionary helps with). Updates only carry changed columns.
+LEGACY_ENCODING_PREFIX = 'z1:'
+ENCODING_PREFIX = 'z2:'
+ZDICT_V1 = ','.join(
+    [f'"{key}":' for key in (
+        'description', 'email', 'phone', 'address', 'firstname', 'lastname', 'unique_id', 'department_id',
+        'designation_id', 'schedule_id', 'user_id', 'role_id', 'leave_type', 'start_date', 'end_date', 'reason',
+        'house_rent', 'medical', 'transport', 'basic_salary', 'allowances', 'overtime_amount', 'deductions',
+        'net_salary', 'month', 'year', 'period', 'stale_at', 'name', 'type', 'is_read', 'amount', 'hours', 'rate',
+        'minutes', 'deduction', 'event_id', 'date', 'time_in', 'time_out', 'employee_id',
+    )] + [
+        '"status":"active"', '"status":"inactive"', '"status":"approved"', '"status":"rejected"',
+        '"status":"pending"', '"status":"leave"', '"status":"weekend"', '"status":"holiday"',
+        '"status":"absent"', '"time_in":"09:00:00"', '"time_out":"17:00:00"', '"status":"present"',
+        '"late_minutes":0', '"early_out_minutes":0', '"worked_minutes":0', '"date":"20',
+    ]
+).encode('utf-8')
+# Employee profile columns go first: deflate reaches the end of the dictionary
+# most cheaply, which is where the attendance keys stay
+ZDICT_V2 = ','.join([
+    '"dob":"19', '"gender":"Male"', '"gender":"Female"', '"religion":"Hindu"', '"religion":"',
+    '"marital":"Single"', '"marital":"Married"', '"image":"employee_', '"aadhar_file":"', '"resume_file":"',
+    '.jpg"', '.png"', '.pdf"', '@gmail.com"', '@example.com"', '"address":"', '"phone":"',
+]).encode('utf-8') + b',' + ZDICT_V1
+
+def encode_audit_data(data):
+    """Serialize an audit payload compactly; falls back to plain JSON when that is shorter."""
+    if data is None:
+        return None
+    text = json.dumps(data, cls=AuditJSONEncoder, separators=(',', ':'))
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=ZDICT_V2)
+    packed = compressor.compress(text.encode('utf-8')) + compressor.flush()
+    encoded = ENCODING_PREFIX + base64.b85encode(packed).decode('ascii')
+    return encoded if len(encoded) < len(text) else text
+
+def decode_audit_data(value):
+    """Inverse of encode_audit_data; also reads 'z1:' rows and rows written as plain JSON."""
+    if not value:
+        return {}
+    if value.startswith(ENCODING_PREFIX):
+        decompressor = zlib.decompressobj(-15, zdict=ZDICT_V2)
+        packed = base64.b85decode(value[len(ENCODING_PREFIX):])
+        value = (decompressor.decompress(packed) + decompressor.flush()).decode('utf-8')
+    elif value.startswith(LEGACY_ENCODING_PREFIX):
+        decompressor = zlib.decompressobj(-15, zdict=ZDICT_V1)
+        packed = base64.b64decode(value[len(LEGACY_ENCODING_PREFIX):])
+        value = (decompressor.decompress(packed) + decompressor.flush()).decode('utf-8')
+    return json.loads(value)
 
 class AuditJSONEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -18,15 +129,18 @@ class AuditJSONEncoder(json.JSONEncoder):
         except TypeError:
             return str(obj)
 
-def row_to_dict(obj, mask_password=True):
-    """Convert an SQLAlchemy object to dict, masking sensitive fields."""
+def row_to_dict(obj, policy=DEFAULT_POLICY):
+    """Convert an SQLAlchemy object to dict of the columns its policy captures, masking secrets."""
     result = {}
     try:
         for c in obj.__table__.columns:
+            if not policy.captures(c.name):
+                continue
             val = getattr(obj, c.name)
-            if mask_password and c.name == 'password':
+            if c.name in policy.mask:
                 result[c.name] = '***' if val else None
-            else:
+            elif val is not None:
+                # Unset columns are left out; decoding treats a missing key as None
                 result[c.name] = val
     except Exception:
         pass
@@ -42,94 +156,390 @@ def get_actor_and_ip():
         ip_address = request.remote_addr
     return actor_id, ip_address
 
+def _summarized(target, action):
+    """Count the change in the session's active AuditSummary, if any. Returns True when suppressed."""
+    session = object_session(target)
+    summary = session.info.get(SUMMARY_KEY) if session is not None else None
+    if summary is None:
+        return False
+    summary.record(target.__class__.__name__, action, ids=[getattr(target, 'id', None)])
+    return True
+
+def _collect(target, action, old_data, new_data):
+    """Queue an audit entry on the target's session; it is written after the transaction commits."""
+    session = object_session(target)
+    if session is None:
+        return
+    actor_id, ip_address = get_actor_and_ip()
+    session.info.setdefault(PENDING_KEY, []).append({
+        'actor_id': actor_id,
+        'action': action,
+        'model': target.__class__.__name__,
+        'record_id': getattr(target, 'id', None),
+        'old_data': old_data,
+        'new_data': new_data,
+        'ip_address': ip_address,
+        'created_at': datetime.utcnow()
+    })
+
 def after_insert_listener(mapper, connection, target):
     # Prevent infinite recursion when AuditLog itself is inserted
     if isinstance(target, AuditLog):
         return
 
-    actor_id, ip_address = get_actor_and_ip()
-    new_data = row_to_dict(target)
-    
-    # We use connection.execute directly to avoid infinite SQLAlchemy session loops
-    table = AuditLog.__table__
-    connection.execute(
-        table.insert().values(
-            actor_id=actor_id,
-            action='CREATE',
-            model=target.__class__.__name__,
-            record_id=getattr(target, 'id', None),
-            old_data=None,
-            new_data=json.dumps(new_data, cls=AuditJSONEncoder),
-            ip_address=ip_address,
-            created_at=datetime.utcnow()
-        )
-    )
+    policy = policy_for(target)
+    if policy.enabled and not _summarized(target, 'CREATE'):
+        _collect(target, 'CREATE', None, row_to_dict(target, policy))
 
 def after_update_listener(mapper, connection, target):
     if isinstance(target, AuditLog):
         return
+    policy = policy_for(target)
+    if not policy.enabled or _summarized(target, 'UPDATE'):
+        return
 
-    actor_id, ip_address = get_actor_and_ip()
-    
     # Using inspect to check which columns actually changed
     state = inspect(target)
     
     old_data = {}
     new_data = {}
-    changed = False
     
-    for attr in state.attrs:
-        hist = attr.history
+    for attr in state.mapper.column_attrs:
+        if not policy.captures(attr.key):
+            continue
+        hist = state.attrs[attr.key].history
         if hist.has_changes():
-            changed = True
-            
-            # Mask passwords if they were changed
-            if attr.key == 'password':
+            old_value = hist.deleted[0] if hist.deleted else None
+            new_value = hist.added[0] if hist.added else None
+            # Assigning the value a column already had is not a change
+            if policy.skip_noop and old_value == new_value:
+                continue
+
+            # Mask secrets if they were changed
+            if attr.key in policy.mask:
                 old_data[attr.key] = '***'
                 new_data[attr.key] = '***'
             else:
-                old_data[attr.key] = hist.deleted[0] if hist.deleted else None
-                new_data[attr.key] = hist.added[0] if hist.added else None
+                old_data[attr.key] = old_value
+                new_data[attr.key] = new_value
     
-    # Only insert if there are actual diffs
-    if changed:
-        table = AuditLog.__table__
-        connection.execute(
-            table.insert().values(
-                actor_id=actor_id,
-                action='UPDATE',
-                model=target.__class__.__name__,
-                record_id=getattr(target, 'id', None),
-                old_data=json.dumps(old_data, cls=AuditJSONEncoder),
-                new_data=json.dumps(new_data, cls=AuditJSONEncoder),
-                ip_address=ip_address,
-                created_at=datetime.utcnow()
-            )
-        )
+    # Only record if there are actual diffs
+    if new_data:
+        _collect(target, 'UPDATE', old_data, new_data)
 
 def after_delete_listener(mapper, connection, target):
     if isinstance(target, AuditLog):
         return
 
-    actor_id, ip_address = get_actor_and_ip()
-    old_data = row_to_dict(target)
-    
+    policy = policy_for(target)
+    if policy.enabled and not _summarized(target, 'DELETE'):
+        _collect(target, 'DELETE', row_to_dict(target, policy), None)
+
+def audit_digest(model, action, old_data, new_data):
+    """changed_keys and search_text of an entry, stored with it so the viewer never decodes payloads to filter.
+
+    changed_keys is the comma-joined sorted field names ('' when there are
+    none; NULL marks rows written before digests existed). search_text is
+    a lower-case 'model action key=value ...' line, masked values left out.
+    """
+    old_data = old_data or {}
+    new_data = new_data or {}
+    keys = sorted(set(old_data) | set(new_data))
+    tokens = [model or '', action or '']
+    for data in (new_data, old_data):
+        for key in keys:
+            value = data.get(key)
+            if value is None or value == '***':
+                continue
+            if not isinstance(value, str):
+                value = json.dumps(value, cls=AuditJSONEncoder, separators=(',', ':'))
+            tokens.append(f'{key}={value}')
+    return ','.join(keys), ' '.join(tokens).lower()[:SEARCH_TEXT_LENGTH]
+
+def _audit_row(entry):
+    changed_keys, search_text = audit_digest(entry['model'], entry['action'], entry['old_data'], entry['new_data'])
+    return dict(entry, old_data=encode_audit_data(entry['old_data']), new_data=encode_audit_data(entry['new_data']),
+                changed_keys=changed_keys, search_text=search_text)
+
+def write_audit_entries(entries):
+    """Insert collected audit entries with multi-row INSERTs in their own transaction."""
+    rows = [_audit_row(entry) for entry in entries]
     table = AuditLog.__table__
-    connection.execute(
-        table.insert().values(
-            actor_id=actor_id,
-            action='DELETE',
-            model=target.__class__.__name__,
-            record_id=getattr(target, 'id', None),
-            old_data=json.dumps(old_data, cls=AuditJSONEncoder),
-            new_data=None,
-            ip_address=ip_address,
-            created_at=datetime.utcnow()
-        )
+    with db.engine.begin() as connection:
+        for batch in chunked(rows, WRITE_BATCH_SIZE):
+            connection.execute(table.insert().values(batch))
+
+def backfill_audit_digests(batch_size=1000):
+    """Fill changed_keys / search_text of rows written before they existed. Returns the number of rows updated."""
+    table = AuditLog.__table__
+    update = table.update().where(table.c.id == bindparam('row_id')).values(
+        changed_keys=bindparam('keys'), search_text=bindparam('text')
     )
+    updated = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(table.c.id, table.c.model, table.c.action, table.c.old_data, table.c.new_data)
+            .where(table.c.changed_keys.is_(None), table.c.id > last_id)
+            .order_by(table.c.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        values = []
+        for row in rows:
+            keys, text = audit_digest(row.model, row.action, decode_audit_data(row.old_data),
+                                      decode_audit_data(row.new_data))
+            values.append({'row_id': row.id, 'keys': keys, 'text': text})
+        db.session.execute(update, values)
+        db.session.commit()
+        updated += len(rows)
+        last_id = rows[-1].id
+    return updated
+
+class AuditWriter:
+    """Background writer for committed audit entries.
+
+    Batches are handed over through a bounded queue so the request only pays
+    for an enqueue; the writer thread drains whatever has accumulated into
+    one insert. When the queue is full the batch is written synchronously by
+    the caller instead, and a failed write is kept and retried on the next
+    submit, so entries are never dropped in favour of latency. submit never
+    raises: it runs after the changes were committed.
+    """
+
+    def __init__(self, app, max_batches=1000):
+        self.app = app
+        self._queue = queue.Queue(maxsize=max_batches)
+        self._lock = threading.Lock()
+        self._failed = []
+        self._thread = None
+        self._pid = None
+
+    def submit(self, entries):
+        self._ensure_thread()
+        with self._lock:
+            failed, self._failed = self._failed, []
+        if failed:
+            self._write_now(failed)
+        try:
+            self._queue.put_nowait(entries)
+        except queue.Full:
+            self._write_now(entries)
+
+    def _write_now(self, entries):
+        try:
+            write_audit_entries(entries)
+        except Exception as e:
+            current_app.logger.error(f'Audit log write failed ({len(entries)} entries): {str(e)}')
+            with self._lock:
+                self._failed.extend(entries)
+
+    def _ensure_thread(self):
+        # Threads do not survive fork, so a forked worker starts its own writer
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+                    self._thread.start()
+
+    def _take(self):
+        entries = self._queue.get()
+        # Coalesce everything already waiting into the same insert
+        while True:
+            try:
+                entries = entries + self._queue.get_nowait()
+            except queue.Empty:
+                return entries
+
+    def _write(self, entries):
+        with self.app.app_context():
+            for attempt in range(2):
+                try:
+                    write_audit_entries(entries)
+                    return
+                except Exception as e:
+                    self.app.logger.error(f'Audit log write failed ({len(entries)} entries): {str(e)}')
+        with self._lock:
+            self._failed.extend(entries)
+
+    def _run(self):
+        while True:
+            self._write(self._take())
+
+    def flush(self):
+        """Write everything still queued (called at exit)."""
+        entries = []
+        while True:
+            try:
+                entries.extend(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        with self._lock:
+            entries, self._failed = self._failed + entries, []
+        if entries:
+            with self.app.app_context():
+                write_audit_entries(entries)
+
+def init_audit_writer(app):
+    """Move audit inserts off the request thread when AUDIT_ASYNC is enabled."""
+    if not app.config.get('AUDIT_ASYNC'):
+        return None
+    writer = AuditWriter(app, max_batches=app.config.get('AUDIT_QUEUE_SIZE', 1000))
+    app.extensions['audit_writer'] = writer
+    atexit.register(writer.flush)
+    return writer
+
+def submit_audit_entries(entries):
+    """Write committed entries (or hand them to the AuditWriter).
+
+    Never raises: this runs after the audited transaction has committed, and
+    its caller must not see an error for changes that were saved. Entries
+    that cannot be written synchronously are logged in full instead.
+    """
+    writer = current_app.extensions.get('audit_writer')
+    if writer is not None:
+        writer.submit(entries)
+        return
+    try:
+        write_audit_entries(entries)
+    except Exception as e:
+        current_app.logger.error(
+            f'Audit log write failed ({len(entries)} entries): {str(e)}; entries: '
+            f'{json.dumps(entries, cls=AuditJSONEncoder)}'
+        )
+
+class AuditSummary:
+    """Record one summary audit entry for a bulk job instead of one entry per row.
+
+    Use as a context manager or a decorator. Inside the block, per-row
+    auditing on the current session is suppressed and each change is only
+    counted. Core bulk writers, which never reach the ORM listeners, report
+    their rows with record_bulk_audit. On exit a single 'BULK' AuditLog entry
+    is recorded with the job name, actor, affected models and, per model and
+    action, the row count and id ranges. Only committed changes are counted.
+    When the block leaves its changes uncommitted, the summary is written
+    with them at commit. Nested summaries fold into the outermost one.
+    """
+
+    # Ranges beyond this are collapsed into the overall min / max id
+    MAX_RANGES = 20
+
+    def __init__(self, job, actor_id=None):
+        self.job = job
+        self.actor_id = actor_id
+        self._session = None
+        self._outer = None
+
+    def __call__(self, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with AuditSummary(self.job, self.actor_id):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def __enter__(self):
+        self._session = db.session()
+        self._outer = self._session.info.get(SUMMARY_KEY)
+        if self._outer is not None:
+            return self._outer
+        actor_id, self.ip_address = get_actor_and_ip()
+        self.actor_id = self.actor_id or actor_id
+        self.started_at = datetime.utcnow()
+        self.committed = defaultdict(lambda: {'count': 0, 'ids': set()})
+        self.pending = defaultdict(lambda: {'count': 0, 'ids': set()})
+        self._session.info[SUMMARY_KEY] = self
+        return self
+
+    def record(self, model, action, count=None, ids=()):
+        tally = self.pending[(model, action)]
+        ids = [record_id for record_id in ids if record_id is not None]
+        tally['count'] += count if count is not None else max(len(ids), 1)
+        tally['ids'].update(ids)
+
+    def commit(self):
+        for key, tally in self.pending.items():
+            self.committed[key]['count'] += tally['count']
+            self.committed[key]['ids'].update(tally['ids'])
+        self.pending.clear()
+
+    def rollback(self):
+        self.pending.clear()
+
+    def _ranges(self, ids):
+        ranges = []
+        for record_id in sorted(ids):
+            if ranges and record_id == ranges[-1][1] + 1:
+                ranges[-1][1] = record_id
+            else:
+                ranges.append([record_id, record_id])
+        if len(ranges) > self.MAX_RANGES:
+            return [[ranges[0][0], ranges[-1][1]]]
+        return ranges
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._outer is not None:
+            return False
+        self._session.info.pop(SUMMARY_KEY, None)
+        deferred = bool(self.pending) and self._session.in_transaction()
+        self.commit()
+        if not self.committed:
+            return False
+
+        models = {}
+        for (model, action), tally in sorted(self.committed.items()):
+            models.setdefault(model, {})[action] = {'count': tally['count'], 'id_ranges': self._ranges(tally['ids'])}
+        entry = {
+            'actor_id': self.actor_id,
+            'action': 'BULK',
+            'model': next(iter(models)) if len(models) == 1 else 'Multiple',
+            'record_id': None,
+            'old_data': None,
+            'new_data': {
+                'job': self.job,
+                'status': 'failed' if exc_type else 'completed',
+                'started_at': self.started_at,
+                'rows': sum(tally['count'] for tally in self.committed.values()),
+                'models': models
+            },
+            'ip_address': self.ip_address,
+            'created_at': datetime.utcnow()
+        }
+        if deferred:
+            # Written by after_commit together with the changes, or dropped on rollback
+            self._session.info.setdefault(PENDING_KEY, []).append(entry)
+        else:
+            submit_audit_entries([entry])
+        return False
+
+def record_bulk_audit(model, action, count, ids=()):
+    """Report rows written with Core bulk statements to the active AuditSummary (no-op without one)."""
+    summary = db.session().info.get(SUMMARY_KEY)
+    if summary is not None and count:
+        summary.record(model, action, count=count, ids=ids)
+
+def after_commit_listener(session):
+    summary = session.info.get(SUMMARY_KEY)
+    if summary is not None:
+        summary.commit()
+    entries = session.info.pop(PENDING_KEY, None)
+    if entries:
+        submit_audit_entries(entries)
+
+def after_rollback_listener(session, previous_transaction):
+    summary = session.info.get(SUMMARY_KEY)
+    if summary is not None:
+        summary.rollback()
+    session.info.pop(PENDING_KEY, None)
 
 def register_audit_listeners():
-    """Register hooks globally for all SQLAlchemy models"""
+    """Register hooks globally for all SQLAlchemy models.
+
+    Row changes are collected per transaction and written as one multi-row
+    insert after commit, so rolled-back changes are never audited.
+    """
     event.listen(db.Model, 'after_insert', after_insert_listener, propagate=True)
     event.listen(db.Model, 'after_update', after_update_listener, propagate=True)
     event.listen(db.Model, 'after_delete', after_delete_listener, propagate=True)
+    event.listen(db.session, 'after_commit', after_commit_listener)
+    event.listen(db.session, 'after_soft_rollback', after_rollback_listener)
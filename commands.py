@@ -0,0 +1,169 @@
+import click
+from calendar import monthrange
+from datetime import datetime
+
+
+def parse_month(value):
+    """Parse a YYYY-MM string into the first and last date of that month."""
+    month_start = datetime.strptime(value, '%Y-%m').date()
+    _, last_day = monthrange(month_start.year, month_start.month)
+    return month_start, month_start.replace(day=last_day)
+
+
+def register_commands(app):
+    """Register maintenance commands on the Flask CLI (`flask <command>`)"""
+
+    @app.cli.command('materialize-attendance')
+    @click.option('--date', 'date_str', help='Single day to materialize (YYYY-MM-DD). Defaults to today.')
+    @click.option('--month', 'month_str', help='Whole month to materialize (YYYY-MM).')
+    def materialize_attendance_command(date_str, month_str):
+        """Pre-create attendance rows so dashboards only have to read."""
+        from utils.attendance import materialize_attendance
+
+        if month_str:
+            start_date, end_date = parse_month(month_str)
+        else:
+            start_date = datetime.strptime(date_str, '%Y-%m-%d').date() if date_str else datetime.now().date()
+            end_date = start_date
+
+        created = materialize_attendance(start_date, end_date)
+        click.echo(f'Created {created} attendance record(s) for {start_date} to {end_date}.')
+
+    @app.cli.command('backfill-punctuality')
+    @click.option('--month', 'month_str', help='Only classify this month (YYYY-MM). Defaults to all history.')
+    @click.option('--batch-size', default=1000, show_default=True)
+    def backfill_punctuality_command(month_str, batch_size):
+        """Re-derive times and late / early-out / worked minutes on existing attendance rows."""
+        from sqlalchemy import select
+        from database import db
+        from models import Attendance
+        from utils.attendance import derive_from_punch_log
+
+        query = select(Attendance.id, Attendance.employee_id, Attendance.date).where(Attendance.time_in.isnot(None))
+        if month_str:
+            start_date, end_date = parse_month(month_str)
+            query = query.where(Attendance.date.between(start_date, end_date))
+
+        updated = 0
+        last_id = 0
+        while True:
+            batch = db.session.execute(query.where(Attendance.id > last_id).order_by(Attendance.id).limit(batch_size)).all()
+            if not batch:
+                break
+            # Days with punches in the checks log are summarised from it, others from their stored times
+            updated += derive_from_punch_log([(row.employee_id, row.date) for row in batch])
+            db.session.commit()
+            last_id = batch[-1].id
+
+        click.echo(f'Classified {updated} attendance record(s).')
+
+    @app.cli.command('rebuild-attendance-rollups')
+    @click.option('--month', 'month_str', help='Only rebuild this month (YYYY-MM). Defaults to all history.')
+    def rebuild_attendance_rollups_command(month_str):
+        """Recompute attendance_daily_rollups from the attendance table."""
+        from database import db
+        from models import Attendance
+        from utils.rollups import rebuild_rollups
+
+        if month_str:
+            start_date, end_date = parse_month(month_str)
+        else:
+            start_date, end_date = db.session.query(db.func.min(Attendance.date), db.func.max(Attendance.date)).one()
+            if start_date is None:
+                click.echo('No attendance records found.')
+                return
+
+        created = rebuild_rollups(start_date=start_date, end_date=end_date)
+        click.echo(f'Rebuilt {created} rollup row(s) for {start_date} to {end_date}.')
+
+    @app.cli.command('run-payroll')
+    @click.option('--month', 'month_str', required=True, help='Payroll month (YYYY-MM).')
+    @click.option('--dry-run', is_flag=True, help='Compute and print the payslips without saving them.')
+    @click.option('--parallel', is_flag=True, help='Shard by employee id range across a process pool.')
+    @click.option('--workers', type=int, help='Pool size for --parallel (default: CPU count).')
+    def run_payroll_command(month_str, dry_run, parallel, workers):
+        """Compute the month's payroll for all active employees in bulk."""
+        from utils.payroll import MONTH_NAMES, run_payroll
+
+        month_start, _ = parse_month(month_str)
+        month = MONTH_NAMES[month_start.month - 1]
+        if parallel and not dry_run:
+            from utils.payroll_runs import create_payroll_run, execute_payroll_run
+
+            run = create_payroll_run(month, month_start.year)
+            run = execute_payroll_run(run.id, max_workers=workers)
+            if run is None:
+                click.echo('The payroll run is already being executed by another process.')
+                return
+            for shard in run.shards:
+                if shard.status != 'completed':
+                    click.echo(f'Shard {shard.index + 1} ({shard.min_employee_id}-{shard.max_employee_id}) failed: {shard.error}')
+            click.echo(f'Payroll run #{run.id} {run.status}: created {run.created_count} payslip(s) '
+                       f'for {month} {month_start.year}.')
+            return
+
+        result = run_payroll(month, month_start.year, dry_run=dry_run)
+        for line in result['lines']:
+            click.echo(f"{line['employee_id']:>6}  {line['employee_name']:<30}  net {line['net_salary']:>12}  "
+                       f"unpaid days {line['unpaid_days']}")
+        skipped = result['skipped']
+        verb = 'Would create' if dry_run else 'Created'
+        click.echo(f"{verb} {len(result['lines'])} payslip(s) for {month} {month_start.year} "
+                   f"({skipped['existing']} existing, {skipped['no_salary']} without salary).")
+
+    @app.cli.command('recompute-payroll')
+    @click.option('--month', 'month_str', help='Only this month (YYYY-MM). Defaults to every stale payroll.')
+    def recompute_payroll_command(month_str):
+        """Re-derive pending payrolls whose salary or attendance inputs changed."""
+        from utils.payroll import MONTH_NAMES, recompute_stale_payroll
+
+        month, year = None, None
+        if month_str:
+            month_start, _ = parse_month(month_str)
+            month, year = MONTH_NAMES[month_start.month - 1], month_start.year
+        recomputed = recompute_stale_payroll(month, year)
+        click.echo(f'Recomputed {recomputed} stale payroll(s).')
+
+    @app.cli.command('rotate-audit-logs')
+    @click.option('--keep-months', type=int, help='Months kept in the database (default: AUDIT_RETENTION_MONTHS).')
+    def rotate_audit_logs_command(keep_months):
+        """Create upcoming audit log partitions and archive old months to compressed NDJSON."""
+        from utils.audit_archive import archive_audit_logs, ensure_partitions
+
+        for name in ensure_partitions():
+            click.echo(f'Created partition {name}.')
+        archived = archive_audit_logs(keep_months)
+        for month, count in archived.items():
+            click.echo(f'Archived {count} audit log(s) of {month}.')
+        click.echo(f'Archived {sum(archived.values())} audit log(s) in total.')
+
+    @app.cli.command('backfill-audit-digests')
+    @click.option('--batch-size', type=int, default=1000, show_default=True)
+    def backfill_audit_digests_command(batch_size):
+        """Fill the changed fields / search text of audit logs written before they were stored."""
+        from audit import backfill_audit_digests
+
+        click.echo(f'Backfilled {backfill_audit_digests(batch_size)} audit log(s).')
+
+    @app.cli.command('export-payslips')
+    @click.option('--month', 'month_str', required=True, help='Payroll month (YYYY-MM).')
+    @click.option('--format', 'fmt', type=click.Choice(['html', 'pdf']), default='html', show_default=True)
+    @click.option('--output', type=click.Path(dir_okay=False), help='ZIP file to write (default: payslips-YYYY-MM.zip).')
+    @click.option('--workers', type=int, help='Pool size for rendering (default: CPU count).')
+    def export_payslips_command(month_str, fmt, output, workers):
+        """Render every payslip of a month into one ZIP archive."""
+        from utils.payroll import MONTH_NAMES
+        from utils.payslips import pdf_available, plan_payslips, stream_payslip_archive
+
+        if fmt == 'pdf' and not pdf_available():
+            raise click.ClickException('PDF export requires weasyprint and its Pango system libraries (pip install weasyprint).')
+        month_start, _ = parse_month(month_str)
+        month = MONTH_NAMES[month_start.month - 1]
+        entries, missing = plan_payslips(month, month_start.year, fmt)
+        output = output or f'payslips-{month_str}.zip'
+        with open(output, 'wb') as f:
+            for chunk in stream_payslip_archive(entries, missing, fmt, max_workers=workers):
+                f.write(chunk)
+        click.echo(f'Wrote {len(entries)} payslip(s) to {output} ({len(missing)} rendered, '
+                   f'{len(entries) - len(missing)} from cache).')
+
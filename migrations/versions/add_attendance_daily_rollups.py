@@ -0,0 +1,36 @@
+"""Add attendance_daily_rollups table
+
+Revision ID: c27d5e90a1b3
+Revises: 8b4e1d6a2f07
+Create Date: 2026-10-18
+
+Run `flask rebuild-attendance-rollups` afterwards to fill it from history.
+"""
+
+revision = 'c27d5e90a1b3'
+down_revision = '8b4e1d6a2f07'
+branch_labels = None
+depends_on = None
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'attendance_daily_rollups',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('date', sa.Date(), nullable=False),
+        sa.Column('department_id', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('status', sa.String(20), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('late_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('late_minutes', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.text('CURRENT_TIMESTAMP')),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('uq_attendance_daily_rollups_key', 'attendance_daily_rollups', ['date', 'department_id', 'status'], unique=True)
+
+
+def downgrade():
+    op.drop_index('uq_attendance_daily_rollups_key', table_name='attendance_daily_rollups')
+    op.drop_table('attendance_daily_rollups')
@@ -0,0 +1,50 @@
+"""Add unique (employee_id, date) and date indexes to attendances
+
+Revision ID: 8b4e1d6a2f07
+Revises: 3f9a2c7d8e41
+Create Date: 2026-10-18
+
+Duplicate rows created by racing workers are removed first, keeping the
+row that has a check-in (or the oldest one).
+"""
+
+revision = '8b4e1d6a2f07'
+down_revision = '3f9a2c7d8e41'
+branch_labels = None
+depends_on = None
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    bind = op.get_bind()
+    attendances = sa.table('attendances',
+        sa.column('id', sa.Integer),
+        sa.column('employee_id', sa.Integer),
+        sa.column('date', sa.Date),
+        sa.column('time_in', sa.Time)
+    )
+
+    duplicates = bind.execute(
+        sa.select(attendances.c.employee_id, attendances.c.date)
+        .group_by(attendances.c.employee_id, attendances.c.date)
+        .having(sa.func.count(attendances.c.id) > 1)
+    ).all()
+    for employee_id, day in duplicates:
+        rows = bind.execute(
+            sa.select(attendances.c.id, attendances.c.time_in)
+            .where(attendances.c.employee_id == employee_id, attendances.c.date == day)
+            .order_by(attendances.c.id)
+        ).all()
+        keep = next((row.id for row in rows if row.time_in is not None), rows[0].id)
+        bind.execute(attendances.delete().where(
+            attendances.c.id.in_([row.id for row in rows if row.id != keep])
+        ))
+
+    op.create_index('uq_attendances_employee_date', 'attendances', ['employee_id', 'date'], unique=True)
+    op.create_index('ix_attendances_date', 'attendances', ['date'])
+
+
+def downgrade():
+    op.drop_index('ix_attendances_date', table_name='attendances')
+    op.drop_index('uq_attendances_employee_date', table_name='attendances')
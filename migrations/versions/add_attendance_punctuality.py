@@ -0,0 +1,29 @@
+"""Add punctuality columns to attendances
+
+Revision ID: 3f9a2c7d8e41
+Revises: 12345678901234
+Create Date: 2026-10-18
+
+Run `flask backfill-punctuality` afterwards to classify existing rows.
+"""
+
+revision = '3f9a2c7d8e41'
+down_revision = '12345678901234'
+branch_labels = None
+depends_on = None
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('attendances', sa.Column('late_minutes', sa.Integer(), server_default='0'))
+    op.add_column('attendances', sa.Column('early_out_minutes', sa.Integer(), server_default='0'))
+    op.add_column('attendances', sa.Column('worked_minutes', sa.Integer(), server_default='0'))
+    op.create_index('ix_attendances_late_minutes', 'attendances', ['late_minutes'])
+
+
+def downgrade():
+    op.drop_index('ix_attendances_late_minutes', table_name='attendances')
+    op.drop_column('attendances', 'worked_minutes')
+    op.drop_column('attendances', 'early_out_minutes')
+    op.drop_column('attendances', 'late_minutes')
@@ -0,0 +1,47 @@
+"""Add changed_keys / search_text to audit_logs and keyset indexes
+
+Revision ID: 9a4e2c7b5d31
+Revises: 6f3b8d1e4a97
+Create Date: 2026-10-18
+
+Existing rows keep NULL digests until `flask backfill-audit-digests` is
+run; the viewer still shows them but its text filter cannot match them.
+"""
+
+revision = '9a4e2c7b5d31'
+down_revision = '6f3b8d1e4a97'
+branch_labels = None
+depends_on = None
+from alembic import op
+import sqlalchemy as sa
+
+OLD_INDEXES = (
+    ('ix_audit_logs_created_at', ['created_at']),
+    ('ix_audit_logs_model_record', ['model', 'record_id']),
+    ('ix_audit_logs_actor_id', ['actor_id']),
+)
+
+NEW_INDEXES = (
+    ('ix_audit_logs_created_id', ['created_at', 'id']),
+    ('ix_audit_logs_model_record', ['model', 'record_id', 'created_at']),
+    ('ix_audit_logs_model_created', ['model', 'created_at']),
+    ('ix_audit_logs_actor_created', ['actor_id', 'created_at']),
+)
+
+
+def upgrade():
+    op.add_column('audit_logs', sa.Column('changed_keys', sa.Text(), nullable=True))
+    op.add_column('audit_logs', sa.Column('search_text', sa.Text(), nullable=True))
+    for name, columns in OLD_INDEXES:
+        op.drop_index(name, table_name='audit_logs')
+    for name, columns in NEW_INDEXES:
+        op.create_index(name, 'audit_logs', columns)
+
+
+def downgrade():
+    for name, columns in NEW_INDEXES:
+        op.drop_index(name, table_name='audit_logs')
+    for name, columns in OLD_INDEXES:
+        op.create_index(name, 'audit_logs', columns)
+    op.drop_column('audit_logs', 'search_text')
+    op.drop_column('audit_logs', 'changed_keys')
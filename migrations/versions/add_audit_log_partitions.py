@@ -0,0 +1,86 @@
+"""Index audit_logs and partition it by month on PostgreSQL
+
+Revision ID: 6f3b8d1e4a97
+Revises: 2d7a4f9c6b15
+Create Date: 2026-10-18
+
+On PostgreSQL audit_logs is rebuilt as a table range-partitioned by month
+on created_at (primary key (id, created_at)), with a partition per month of
+existing data, the next two months and a default partition; rows are copied
+over in one statement, so run this in a maintenance window on large
+tables. Other databases keep a single table and only get the indexes; there
+`flask rotate-audit-logs` keeps it bounded by archiving old months.
+"""
+
+revision = '6f3b8d1e4a97'
+down_revision = '2d7a4f9c6b15'
+branch_labels = None
+depends_on = None
+from datetime import date, datetime
+from alembic import op
+import sqlalchemy as sa
+
+INDEXES = (
+    ('ix_audit_logs_created_at', ['created_at']),
+    ('ix_audit_logs_model_record', ['model', 'record_id']),
+    ('ix_audit_logs_action', ['action']),
+    ('ix_audit_logs_actor_id', ['actor_id']),
+)
+
+
+def _month(day, offset=0):
+    months = day.year * 12 + day.month - 1 + offset
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        for name, columns in INDEXES:
+            op.create_index(name, 'audit_logs', columns)
+        return
+
+    op.execute("UPDATE audit_logs SET created_at = now() AT TIME ZONE 'utc' WHERE created_at IS NULL")
+    op.execute('ALTER TABLE audit_logs RENAME TO audit_logs_unpartitioned')
+    op.execute('ALTER TABLE audit_logs_unpartitioned RENAME CONSTRAINT audit_logs_pkey TO audit_logs_unpartitioned_pkey')
+    op.execute('CREATE TABLE audit_logs (LIKE audit_logs_unpartitioned INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)')
+    op.execute('ALTER TABLE audit_logs ALTER COLUMN created_at SET NOT NULL')
+    op.execute('ALTER TABLE audit_logs ADD PRIMARY KEY (id, created_at)')
+    op.execute('ALTER TABLE audit_logs ADD FOREIGN KEY (actor_id) REFERENCES users (id)')
+    # Keep the id sequence alive when the old table is dropped
+    op.execute('ALTER SEQUENCE audit_logs_id_seq OWNED BY audit_logs.id')
+
+    oldest = bind.execute(sa.text('SELECT min(created_at) FROM audit_logs_unpartitioned')).scalar()
+    start = _month(oldest or datetime.utcnow())
+    last = _month(date.today(), 2)
+    while start <= last:
+        end = _month(start, 1)
+        op.execute(
+            f"CREATE TABLE audit_logs_y{start.year}m{start.month:02d} PARTITION OF audit_logs "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        )
+        start = end
+    op.execute('CREATE TABLE audit_logs_default PARTITION OF audit_logs DEFAULT')
+
+    op.execute('INSERT INTO audit_logs SELECT * FROM audit_logs_unpartitioned')
+    op.execute('DROP TABLE audit_logs_unpartitioned')
+    for name, columns in INDEXES:
+        op.create_index(name, 'audit_logs', columns)
+
+
+def downgrade():
+    bind = op.get_bind()
+    for name, columns in INDEXES:
+        op.drop_index(name, table_name='audit_logs')
+    if bind.dialect.name != 'postgresql':
+        return
+
+    op.execute('ALTER TABLE audit_logs RENAME TO audit_logs_partitioned')
+    op.execute('CREATE TABLE audit_logs (LIKE audit_logs_partitioned INCLUDING DEFAULTS)')
+    op.execute('ALTER TABLE audit_logs ALTER COLUMN created_at DROP NOT NULL')
+    op.execute('ALTER TABLE audit_logs ADD PRIMARY KEY (id)')
+    op.execute('ALTER TABLE audit_logs ADD FOREIGN KEY (actor_id) REFERENCES users (id)')
+    op.execute('ALTER SEQUENCE audit_logs_id_seq OWNED BY audit_logs.id')
+    op.execute('INSERT INTO audit_logs SELECT * FROM audit_logs_partitioned')
+    # Dropping the parent drops its partitions
+    op.execute('DROP TABLE audit_logs_partitioned')
@@ -0,0 +1,23 @@
+"""Add event_id to checks for idempotent device punch ingestion
+
+Revision ID: 5e8f3a1c9d24
+Revises: c27d5e90a1b3
+Create Date: 2026-10-18
+"""
+
+revision = '5e8f3a1c9d24'
+down_revision = 'c27d5e90a1b3'
+branch_labels = None
+depends_on = None
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('checks', sa.Column('event_id', sa.String(64), nullable=True))
+    op.create_index('uq_checks_event_id', 'checks', ['event_id'], unique=True)
+
+
+def downgrade():
+    op.drop_index('uq_checks_event_id', table_name='checks')
+    op.drop_column('checks', 'event_id')
@@ -0,0 +1,23 @@
+"""Add (employee_id, date) index to checks
+
+Revision ID: 9a6c2e4f1b58
+Revises: 5e8f3a1c9d24
+Create Date: 2026-10-18
+
+Run `flask backfill-punctuality` afterwards to re-derive attendance
+summaries from punches already in the log.
+"""
+
+revision = '9a6c2e4f1b58'
+down_revision = '5e8f3a1c9d24'
+branch_labels = None
+depends_on = None
+from alembic import op
+
+
+def upgrade():
+    op.create_index('ix_checks_employee_date', 'checks', ['employee_id', 'date'])
+
+
+def downgrade():
+    op.drop_index('ix_checks_employee_date', table_name='checks')
@@ -0,0 +1,54 @@
+"""Add integer period (YYYYMM) to payrolls
+
+Revision ID: 2d7a4f9c6b15
+Revises: 7c1f9b3e2a60
+Create Date: 2026-10-18
+
+Existing rows are backfilled from their month name and year. The unique
+(employee_id, period) index fails if an employee already has two payrolls
+for the same month; resolve those duplicates before upgrading. Rows
+whose month cannot be read as a month name, abbreviation or number stop
+the upgrade with a list of their ids before anything is made NOT NULL.
+"""
+
+revision = '2d7a4f9c6b15'
+down_revision = '7c1f9b3e2a60'
+branch_labels = None
+depends_on = None
+import calendar
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('payrolls', sa.Column('period', sa.Integer(), nullable=True))
+
+    payrolls = sa.table('payrolls', sa.column('id', sa.Integer), sa.column('month', sa.String),
+                        sa.column('year', sa.Integer), sa.column('period', sa.Integer))
+    # Full month names as stored by the app, plus abbreviations entered by hand, in any case
+    numbers = dict((name.lower(), number) for number, name in enumerate(calendar.month_name) if name)
+    numbers.update((name.lower(), number) for number, name in enumerate(calendar.month_abbr) if name)
+    numbers.update((f'{number}', number) for number in range(1, 13))
+    numbers.update((f'{number:02d}', number) for number in range(1, 13))
+    month_number = sa.case(numbers, value=sa.func.lower(sa.func.trim(payrolls.c.month)))
+    op.execute(payrolls.update().values(period=payrolls.c.year * 100 + month_number))
+
+    unknown = op.get_bind().execute(
+        sa.select(payrolls.c.id, payrolls.c.month, payrolls.c.year).where(payrolls.c.period.is_(None))
+    ).all()
+    if unknown:
+        raise RuntimeError(
+            'Cannot derive the period of %d payroll(s); fix their month / year and upgrade again: %s'
+            % (len(unknown), ', '.join(f'#{row.id} ({row.month!r} {row.year!r})' for row in unknown))
+        )
+
+    with op.batch_alter_table('payrolls') as batch_op:
+        batch_op.alter_column('period', existing_type=sa.Integer(), nullable=False)
+    op.create_index('ix_payrolls_period', 'payrolls', ['period'])
+    op.create_index('uq_payrolls_employee_period', 'payrolls', ['employee_id', 'period'], unique=True)
+
+
+def downgrade():
+    op.drop_index('uq_payrolls_employee_period', table_name='payrolls')
+    op.drop_index('ix_payrolls_period', table_name='payrolls')
+    op.drop_column('payrolls', 'period')
@@ -0,0 +1,21 @@
+"""Add heartbeat_at to payroll_runs
+
+Revision ID: 3e8c5a1f7b24
+Revises: 9a4e2c7b5d31
+Create Date: 2026-10-18
+"""
+
+revision = '3e8c5a1f7b24'
+down_revision = '9a4e2c7b5d31'
+branch_labels = None
+depends_on = None
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('payroll_runs', sa.Column('heartbeat_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('payroll_runs', 'heartbeat_at')
@@ -0,0 +1,50 @@
+"""Add payroll_runs and payroll_run_shards tables
+
+Revision ID: e4b7a0c5d312
+Revises: 9a6c2e4f1b58
+Create Date: 2026-10-18
+"""
+
+revision = 'e4b7a0c5d312'
+down_revision = '9a6c2e4f1b58'
+branch_labels = None
+depends_on = None
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'payroll_runs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('month', sa.String(20), nullable=False),
+        sa.Column('year', sa.Integer(), nullable=False),
+        sa.Column('status', sa.String(20)),
+        sa.Column('created_count', sa.Integer()),
+        sa.Column('error', sa.Text()),
+        sa.Column('created_by', sa.Integer(), sa.ForeignKey('users.id'), nullable=True),
+        sa.Column('created_at', sa.DateTime()),
+        sa.Column('updated_at', sa.DateTime()),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table(
+        'payroll_run_shards',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('run_id', sa.Integer(), sa.ForeignKey('payroll_runs.id'), nullable=False),
+        sa.Column('index', sa.Integer(), nullable=False),
+        sa.Column('min_employee_id', sa.Integer(), nullable=False),
+        sa.Column('max_employee_id', sa.Integer(), nullable=False),
+        sa.Column('status', sa.String(20)),
+        sa.Column('attempts', sa.Integer()),
+        sa.Column('line_count', sa.Integer()),
+        sa.Column('error', sa.Text()),
+        sa.Column('updated_at', sa.DateTime()),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_payroll_run_shards_run_id', 'payroll_run_shards', ['run_id'])
+
+
+def downgrade():
+    op.drop_index('ix_payroll_run_shards_run_id', table_name='payroll_run_shards')
+    op.drop_table('payroll_run_shards')
+    op.drop_table('payroll_runs')
@@ -0,0 +1,23 @@
+"""Add stale_at to payrolls for incremental recomputation
+
+Revision ID: 7c1f9b3e2a60
+Revises: e4b7a0c5d312
+Create Date: 2026-10-18
+"""
+
+revision = '7c1f9b3e2a60'
+down_revision = 'e4b7a0c5d312'
+branch_labels = None
+depends_on = None
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('payrolls', sa.Column('stale_at', sa.DateTime(), nullable=True))
+    op.create_index('ix_payrolls_stale_at', 'payrolls', ['stale_at'])
+
+
+def downgrade():
+    op.drop_index('ix_payrolls_stale_at', table_name='payrolls')
+    op.drop_column('payrolls', 'stale_at')
@@ -1,3 +1,4 @@
+import calendar
 from flask_login import UserMixin
 from datetime import datetime, timedelta
 from database import db
@@ -127,60 +128,19 @@ class Employee(db.Model):
     reviews = db.relationship('PerformanceReview', backref='employee', lazy=True, cascade='all, delete-orphan', foreign_keys='PerformanceReview.employee_id')
 
     def generate_attendance(self, start_date, end_date):
-        """Generate attendance records for the employee between given dates."""
-        current_date = start_date
-        while current_date <= end_date:
-            # Skip if attendance record already exists
-            if Attendance.query.filter_by(employee_id=self.id, date=current_date).first():
-                current_date += timedelta(days=1)
-                continue
-
-            # Check if it's a holiday
-            holiday = Holiday.query.filter_by(date=current_date).first()
-            if holiday:
-                status = 'holiday'
-                description = holiday.name
-            # Check if it's a working day or weekend using WorkingDayConfig
-            else:
-                weekday = current_date.weekday()  # 0=Monday, 6=Sunday
-                config = WorkingDayConfig.query.filter_by(weekday=weekday).first()
-                
-                # Default: Mon-Fri (0-4) are working, Sat-Sun (5-6) are weekends
-                is_working = config.is_working_day if config else weekday < 5
-                
-                if not is_working:
-                    status = 'weekend'
-                    description = 'Weekend'
-                else:
-                    status = 'absent'  # Default to absent, will be updated when employee checks in
-                    description = None
-
-            # Check if employee is on approved leave
-            leave = Leave.query.filter_by(
-                employee_id=self.id,
-                status='approved'
-            ).filter(
-                Leave.start_date <= current_date,
-                Leave.end_date >= current_date
-            ).first()
-
-            if leave:
-                status = 'leave'
-                description = f"{leave.leave_type} leave"
-
-            # Create attendance record
-            attendance = Attendance(
-                employee_id=self.id,
-                date=current_date,
-                status=status,
-                description=description
-            )
-            db.session.add(attendance)
-            current_date += timedelta(days=1)
-        db.session.commit()
+        """Generate attendance records for the employee between given dates.
+
+        Returns the number of records created.
+        """
+        from utils.attendance import generate_attendance_bulk
+        return generate_attendance_bulk([self.id], start_date, end_date)
 
 class Attendance(db.Model):
     __tablename__ = 'attendances'
+    __table_args__ = (
+        db.Index('uq_attendances_employee_date', 'employee_id', 'date', unique=True),
+        db.Index('ix_attendances_date', 'date'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     employee_id = db.Column(db.Integer, db.ForeignKey('employees.id'), nullable=False)
@@ -189,17 +149,84 @@ class Attendance(db.Model):
     time_out = db.Column(db.Time)
     status = db.Column(db.String(20))  # present, absent, holiday, weekend
     description = db.Column(db.Text)  # For holiday name or other notes
+    late_minutes = db.Column(db.Integer, default=0, index=True)  # Minutes after schedule start, 0 if within grace period
+    early_out_minutes = db.Column(db.Integer, default=0)  # Minutes before schedule end (or short of working hours if flexible)
+    worked_minutes = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    def classify(self, schedule, worked_minutes=None):
+        """Compute late / early-out / worked minutes from the punches and the employee's schedule.
+
+        Called whenever a punch is recorded so reports can aggregate the
+        stored integers instead of recomputing them per row. worked_minutes
+        comes from the punch log when it has complete in/out pairs;
+        otherwise the span between time_in and time_out is used.
+        """
+        self.late_minutes = 0
+        self.early_out_minutes = 0
+        self.worked_minutes = 0
+
+        if worked_minutes is not None:
+            self.worked_minutes = worked_minutes
+        elif self.time_in and self.time_out:
+            worked = datetime.combine(self.date, self.time_out) - datetime.combine(self.date, self.time_in)
+            self.worked_minutes = max(0, int(worked.total_seconds() // 60))
+
+        if not schedule or not self.time_in:
+            return
+
+        if schedule.is_flexible:
+            # For flexible shifts, check if they met working hours instead of late time
+            if self.time_out:
+                required_minutes = int(float(schedule.working_hours or 0) * 60)
+                self.early_out_minutes = max(0, required_minutes - self.worked_minutes)
+            return
+
+        if schedule.time_in:
+            start = datetime.combine(self.date, schedule.time_in)
+            allowed = start + timedelta(minutes=schedule.grace_period_minutes or 0)
+            checked_in = datetime.combine(self.date, self.time_in)
+            if checked_in > allowed:
+                self.late_minutes = -(-int((checked_in - start).total_seconds()) // 60)
+
+        if schedule.time_out and self.time_out and self.time_out < schedule.time_out:
+            early = datetime.combine(self.date, schedule.time_out) - datetime.combine(self.date, self.time_out)
+            self.early_out_minutes = -(-int(early.total_seconds()) // 60)
+
+class AttendanceDailyRollup(db.Model):
+    """Pre-aggregated attendance counts per (date, department, status).
+
+    Maintained incrementally by utils.rollups and rebuildable with
+    `flask rebuild-attendance-rollups`. department_id 0 means no department.
+    """
+    __tablename__ = 'attendance_daily_rollups'
+    __table_args__ = (
+        db.Index('uq_attendance_daily_rollups_key', 'date', 'department_id', 'status', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, nullable=False)
+    department_id = db.Column(db.Integer, nullable=False, default=0)
+    status = db.Column(db.String(20), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    late_count = db.Column(db.Integer, nullable=False, default=0)
+    late_minutes = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 class Check(db.Model):
     __tablename__ = 'checks'
+    __table_args__ = (
+        db.Index('uq_checks_event_id', 'event_id', unique=True),
+        db.Index('ix_checks_employee_date', 'employee_id', 'date'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     employee_id = db.Column(db.Integer, db.ForeignKey('employees.id'), nullable=False)
     date = db.Column(db.Date, nullable=False)
-    time_in = db.Column(db.Time)
-    time_out = db.Column(db.Time)
+    time_in = db.Column(db.Time)  # Set for an 'in' punch
+    time_out = db.Column(db.Time)  # Set for an 'out' punch
+    event_id = db.Column(db.String(64))  # Device event id, makes punch ingestion idempotent
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -261,24 +288,108 @@ class OverTime(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+def month_number(month):
+    """1-12 for a month name, full or abbreviated and in any case ('October', 'oct', 'OCT').
+
+    Raises ValueError for anything else.
+    """
+    key = str(month or '').strip().lower()
+    for names in (calendar.month_name, calendar.month_abbr):
+        for number, name in enumerate(names):
+            if number and name.lower() == key:
+                return number
+    raise ValueError(f"Unknown month '{month}': use a month name such as 'October' or 'Oct'.")
+
+
+def normalize_month(month):
+    """Full month name ('oct' -> 'October'), as payroll months are stored; ValueError if unknown."""
+    return calendar.month_name[month_number(month)]
+
+
+def payroll_period(month, year):
+    """Sortable integer period (YYYYMM) of a payroll month given by name, e.g. ('October', 2026) -> 202610."""
+    return int(year) * 100 + month_number(month)
+
+
+def _period_default(context):
+    params = context.get_current_parameters()
+    return payroll_period(params['month'], params['year'])
+
+
 class Payroll(db.Model):
     __tablename__ = 'payrolls'
+    __table_args__ = (
+        db.Index('uq_payrolls_employee_period', 'employee_id', 'period', unique=True),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     employee_id = db.Column(db.Integer, db.ForeignKey('employees.id'), nullable=False)
     month = db.Column(db.String(20), nullable=False)
     year = db.Column(db.Integer, nullable=False)
+    period = db.Column(db.Integer, nullable=False, index=True, default=_period_default)  # YYYYMM, derived from month / year
     basic_salary = db.Column(db.Numeric(10, 2), nullable=False)
     allowances = db.Column(db.Numeric(10, 2), default=0)
     overtime_amount = db.Column(db.Numeric(10, 2), default=0)
     deductions = db.Column(db.Numeric(10, 2), default=0)
     net_salary = db.Column(db.Numeric(10, 2), nullable=False)
     status = db.Column(db.String(20), default='pending')
+    stale_at = db.Column(db.DateTime, index=True)  # Set when salary / attendance inputs change after calculation
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class PayrollRun(db.Model):
+    """A payroll month computed in id-range shards by a process pool (see utils.payroll_runs)."""
+    __tablename__ = 'payroll_runs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.String(20), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), default='queued')  # queued, running, completed, partial, failed
+    created_count = db.Column(db.Integer, default=0)
+    error = db.Column(db.Text)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    # Refreshed by the coordinator that claimed the run; a stale one lets another process take over
+    heartbeat_at = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    shards = db.relationship('PayrollRunShard', backref='run', lazy=True, order_by='PayrollRunShard.index',
+                             cascade='all, delete-orphan')
+
+    @property
+    def progress(self):
+        """Percentage of shards that have finished computing (successfully or not)."""
+        if not self.shards:
+            return 0
+        done = sum(1 for shard in self.shards if shard.status in ('computed', 'completed', 'failed'))
+        return int(done * 100 / len(self.shards))
+
+class PayrollRunShard(db.Model):
+    __tablename__ = 'payroll_run_shards'
+
+    id = db.Column(db.Integer, primary_key=True)
+    run_id = db.Column(db.Integer, db.ForeignKey('payroll_runs.id'), nullable=False, index=True)
+    index = db.Column(db.Integer, nullable=False)
+    min_employee_id = db.Column(db.Integer, nullable=False)
+    max_employee_id = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), default='queued')  # queued, running, computed, completed, failed
+    attempts = db.Column(db.Integer, default=0)
+    line_count = db.Column(db.Integer, default=0)
+    error = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 class AuditLog(db.Model):
+    """Audit trail entry. On PostgreSQL the table is range-partitioned by month on created_at
+    (see the add_audit_log_partitions migration and utils.audit_archive)."""
     __tablename__ = 'audit_logs'
+    # (created_at, id) is the viewer's keyset order; each filter has an index ending in created_at
+    __table_args__ = (
+        db.Index('ix_audit_logs_created_id', 'created_at', 'id'),
+        db.Index('ix_audit_logs_model_record', 'model', 'record_id', 'created_at'),
+        db.Index('ix_audit_logs_model_created', 'model', 'created_at'),
+        db.Index('ix_audit_logs_action', 'action'),
+        db.Index('ix_audit_logs_actor_created', 'actor_id', 'created_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     actor_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
@@ -289,6 +400,9 @@ class AuditLog(db.Model):
     new_data = db.Column(db.Text)
     ip_address = db.Column(db.String(45))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Written with the entry by audit.write_audit_entries (see audit.audit_digest)
+    changed_keys = db.Column(db.Text)
+    search_text = db.Column(db.Text)
 
     actor = db.relationship('User', backref='audit_logs', lazy=True)
 
@@ -1,8 +1,9 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import Blueprint, current_app, render_template, request, redirect, url_for, flash
 from flask_login import login_required, current_user
 from database import db
-from models import Employee, Department, Designation, User, Attendance, Leave, Payroll
-from sqlalchemy import func, extract
+from models import Employee, Department, Designation, User, Attendance, AttendanceDailyRollup, Leave, Payroll
+from sqlalchemy import and_, extract, func, or_
+from sqlalchemy.orm import joinedload
 from datetime import datetime, date, timedelta
 import json
 
@@ -10,13 +11,13 @@ def get_analytics_data():
     today = date.today()
     first_day_of_month = today.replace(day=1)
     
-    # 1. Monthly Attendance %
+    # 1. Monthly Attendance % (from the pre-aggregated daily rollups)
     attendance_stats = db.session.query(
-        Attendance.status, func.count(Attendance.id)
+        AttendanceDailyRollup.status, func.sum(AttendanceDailyRollup.count)
     ).filter(
-        Attendance.date >= first_day_of_month,
-        Attendance.date <= today
-    ).group_by(Attendance.status).all()
+        AttendanceDailyRollup.date >= first_day_of_month,
+        AttendanceDailyRollup.date <= today
+    ).group_by(AttendanceDailyRollup.status).having(func.sum(AttendanceDailyRollup.count) > 0).all()
     
     attendance_data = {
         'labels': [],
@@ -66,18 +67,15 @@ def get_analytics_data():
         ).count()
         leave_data['data'][i] = leave_count
         
-    # 3. Salary Cost (Last 6 months)
-    salary_data = {'labels': [m['label'] for m in last_6_months], 'data': [0] * 6}
-    for i, m in enumerate(last_6_months):
-        month_name = m['label'].split(' ')[0] # e.g. 'Oct' or 'October'
-        # In our system, payroll.month might be full name or abbreviation. Let's just sum by year and month.
-        # Actually Payroll model stores month as string 'January', 'February' etc.
-        full_month_name = date(m['year'], m['month'], 1).strftime('%B')
-        total_salary = db.session.query(func.sum(Payroll.net_salary)).filter(
-            Payroll.year == m['year'],
-            Payroll.month == full_month_name
-        ).scalar()
-        salary_data['data'][i] = float(total_salary or 0)
+    # 3. Salary Cost (Last 6 months), one grouped range query over the indexed YYYYMM period
+    periods = [m['year'] * 100 + m['month'] for m in last_6_months]
+    salary_totals = dict(db.session.query(Payroll.period, func.sum(Payroll.net_salary)).filter(
+        Payroll.period.between(periods[0], periods[-1])
+    ).group_by(Payroll.period).all())
+    salary_data = {
+        'labels': [m['label'] for m in last_6_months],
+        'data': [float(salary_totals.get(period) or 0) for period in periods]
+    }
 
     return {
         'attendance': json.dumps(attendance_data),
@@ -227,10 +225,44 @@ def delete_employee(id):
 
 
 
+def _audit_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+    except ValueError:
+        return None
+
+
+def _audit_cursor(value):
+    """Parse a '<created_at iso>_<id>' keyset cursor; None when missing or malformed."""
+    try:
+        created_at, log_id = value.rsplit('_', 1)
+        return datetime.fromisoformat(created_at), int(log_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _decode_audit_details(logs):
+    """Decode the payloads of the logs on display for the detail modals."""
+    from audit import decode_audit_data
+
+    for log in logs:
+        try:
+            log.parsed_old = decode_audit_data(log.old_data)
+            log.parsed_new = decode_audit_data(log.new_data)
+        except Exception:
+            log.parsed_old = {}
+            log.parsed_new = {}
+        if log.changed_keys is not None:
+            log.changed_fields = log.changed_keys.split(',') if log.changed_keys else []
+        else:
+            # Written before changed_keys was stored (see `flask backfill-audit-digests`)
+            log.changed_fields = sorted(set(log.parsed_old) | set(log.parsed_new))
+
+
 @bp.route('/audit-logs')
 @login_required
 def audit_logs():
-    """View system audit logs (superadmin only)."""
+    """View system audit logs (superadmin only), newest first, paginated by (created_at, id) keyset."""
     if current_user.role.name != 'superadmin':
         flash('Access denied. Only Super Admin can view audit logs.', 'danger')
         return redirect(url_for('auth.login'))
@@ -240,29 +272,93 @@ def audit_logs():
     # Optional filtering
     model_filter = request.args.get('model')
     action_filter = request.args.get('action')
+    actor_filter = request.args.get('actor', type=int)
+    record_filter = request.args.get('record_id', type=int)
+    start_date = _audit_date(request.args.get('start'))
+    end_date = _audit_date(request.args.get('end'))
+    text_query = (request.args.get('q') or '').strip()
+    search_archive = bool(request.args.get('archive'))
+    actor = db.session.get(User, actor_filter) if actor_filter else None
     
-    query = AuditLog.query
+    if search_archive:
+        # Months moved out by `flask rotate-audit-logs`: scanned from the archive files
+        from types import SimpleNamespace
+        from utils.audit_archive import search_audit_archive
+        records = search_audit_archive(model=model_filter, action=action_filter, actor_id=actor_filter,
+                                       record_id=record_filter, start_date=start_date, end_date=end_date,
+                                       text_query=text_query)
+        actor_ids = set(record['actor_id'] for record in records if record['actor_id'])
+        actors = dict((user.id, user) for user in User.query.filter(User.id.in_(actor_ids))) if actor_ids else {}
+        logs = [SimpleNamespace(
+            actor=actors.get(record['actor_id']),
+            actor_id=record['actor_id'],
+            parsed_old=record['old_data'] or {},
+            parsed_new=record['new_data'] or {},
+            changed_fields=sorted(set(record['old_data'] or {}) | set(record['new_data'] or {})),
+            **dict((key, record[key]) for key in ('id', 'action', 'model', 'record_id', 'ip_address', 'created_at'))
+        ) for record in records]
+        return render_template('admin/audit_logs.html', logs=logs, search_archive=True, actor=actor)
+
+    query = AuditLog.query.options(joinedload(AuditLog.actor))
     if model_filter:
-        query = query.filter_by(model=model_filter)
+        query = query.filter(AuditLog.model == model_filter)
     if action_filter:
-        query = query.filter_by(action=action_filter)
-        
-    logs = query.order_by(AuditLog.created_at.desc()).limit(200).all()
-    
-    # Parse JSON strings into dictionaries for the template
-    for log in logs:
-        try:
-            log.parsed_old = json.loads(log.old_data) if log.old_data else {}
-            log.parsed_new = json.loads(log.new_data) if log.new_data else {}
-            
-            # Combine keys for easy iteration in the template
-            keys = set()
-            keys.update(log.parsed_old.keys())
-            keys.update(log.parsed_new.keys())
-            log.changed_keys = sorted(list(keys))
-        except:
-            log.parsed_old = {}
-            log.parsed_new = {}
-            log.changed_keys = []
-    
-    return render_template('admin/audit_logs.html', logs=logs)
\ No newline at end of file
+        # Rows are written with upper-case actions by the audit listeners
+        query = query.filter(AuditLog.action.in_([action_filter, action_filter.upper()]))
+    if actor_filter:
+        query = query.filter(AuditLog.actor_id == actor_filter)
+    if record_filter:
+        query = query.filter(AuditLog.record_id == record_filter)
+    if start_date:
+        query = query.filter(AuditLog.created_at >= start_date)
+    if end_date:
+        query = query.filter(AuditLog.created_at < end_date + timedelta(days=1))
+    if text_query:
+        # search_text is already lower-case (see audit.audit_digest)
+        query = query.filter(AuditLog.search_text.contains(text_query.lower(), autoescape=True))
+
+    per_page = current_app.config['AUDIT_LOGS_PER_PAGE']
+    before = _audit_cursor(request.args.get('before'))
+    after = None if before else _audit_cursor(request.args.get('after'))
+    if after:
+        # Newer page: walk the index upwards from the cursor, then show it newest first
+        created_at, log_id = after
+        query = query.filter(or_(AuditLog.created_at > created_at,
+                                 and_(AuditLog.created_at == created_at, AuditLog.id > log_id)))
+        logs = query.order_by(AuditLog.created_at.asc(), AuditLog.id.asc()).limit(per_page + 1).all()
+        has_newer, has_older = len(logs) > per_page, True
+        logs = list(reversed(logs[:per_page]))
+    else:
+        if before:
+            created_at, log_id = before
+            query = query.filter(or_(AuditLog.created_at < created_at,
+                                     and_(AuditLog.created_at == created_at, AuditLog.id < log_id)))
+        logs = query.order_by(AuditLog.created_at.desc(), AuditLog.id.desc()).limit(per_page + 1).all()
+        has_newer, has_older = bool(before), len(logs) > per_page
+        logs = logs[:per_page]
+
+    _decode_audit_details(logs)
+    filters = dict((key, value) for key, value in request.args.items() if key not in ('before', 'after') and value)
+    newer_url = older_url = None
+    if logs and has_newer:
+        newer_url = url_for('admin.audit_logs', after=f'{logs[0].created_at.isoformat()}_{logs[0].id}', **filters)
+    if logs and has_older:
+        older_url = url_for('admin.audit_logs', before=f'{logs[-1].created_at.isoformat()}_{logs[-1].id}', **filters)
+    return render_template('admin/audit_logs.html', logs=logs, actor=actor, newer_url=newer_url, older_url=older_url)
+
+
+@bp.route('/audit-logs/<model>/<int:record_id>')
+@login_required
+def audit_history(model, record_id):
+    """Every audit entry of one record, oldest first (one query on ix_audit_logs_model_record)."""
+    if current_user.role.name != 'superadmin':
+        flash('Access denied. Only Super Admin can view audit logs.', 'danger')
+        return redirect(url_for('auth.login'))
+
+    from models import AuditLog
+
+    logs = AuditLog.query.options(joinedload(AuditLog.actor)).filter(
+        AuditLog.model == model, AuditLog.record_id == record_id
+    ).order_by(AuditLog.created_at.asc(), AuditLog.id.asc()).all()
+    _decode_audit_details(logs)
+    return render_template('admin/audit_history.html', logs=logs, model=model, record_id=record_id)
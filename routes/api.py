@@ -1,7 +1,9 @@
 from flask import Blueprint, jsonify, request
 from database import db
 from models import Employee, Department, Designation
+from utils.punches import ingest_punches
 from functools import wraps
+import json
 import os
 
 bp = Blueprint('api', __name__, url_prefix='/api')
@@ -79,3 +81,38 @@ def get_employee(id):
         'status': 'success',
         'data': data
     })
+
+
+# Upper bound on punches per request so one upload cannot hold a transaction open for too long
+MAX_PUNCH_BATCH = 50000
+
+
+@bp.route('/attendance/punches', methods=['POST'])
+@require_api_key
+def ingest_attendance_punches():
+    """Ingest a batch of device punches.
+
+    Accepts a JSON array (or {"punches": [...]}) or NDJSON with one punch
+    per line. Each punch has event_id, unique_id, timestamp (ISO-8601) and
+    direction ('in' or 'out'). Re-sent event ids are ignored.
+    """
+    try:
+        if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+            events = [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+        else:
+            events = json.loads(request.get_data(as_text=True) or 'null')
+            if isinstance(events, dict):
+                events = events.get('punches')
+    except ValueError:
+        return jsonify({"error": "Request body is not valid JSON / NDJSON"}), 400
+
+    if not isinstance(events, list):
+        return jsonify({"error": "Expected a list of punches"}), 400
+    if len(events) > MAX_PUNCH_BATCH:
+        return jsonify({"error": f"At most {MAX_PUNCH_BATCH} punches per request"}), 413
+
+    summary = ingest_punches(events)
+    return jsonify({
+        'status': 'success',
+        **summary
+    })
@@ -1,13 +1,26 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import Blueprint, render_template, request, redirect, url_for, flash, Response, stream_with_context
 from flask_login import login_required, current_user
 from database import db
-from models import Attendance, Employee, Check, Holiday, Leave, WorkingDayConfig
-from datetime import datetime, time, timedelta
+from models import Attendance, Department, Employee, Check, Holiday, Leave, WorkingDayConfig
+from datetime import datetime, time
 from calendar import monthrange
 from collections import defaultdict
+import csv
+import io
+import tempfile
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload
+from utils.attendance import (
+    CHECK_IN_PRESENT_FROM, add_attendance_to_stats, classify_attendance, daily_punctuality, daterange, department_day_stats, ensure_attendance, is_virtual_calendar,
+    empty_attendance_stats, iter_attendance_summaries, late_clause, load_attendance, record_punch, rederive_attendance,
+    replace_punches
+)
 
 bp = Blueprint('attendance', __name__, url_prefix='/attendance')
 
+REPORT_PAGE_SIZE = 50
+REPORT_COUNT_CAP = 10000
+
 
 @bp.route('/')
 @login_required
@@ -22,12 +35,10 @@ def index():
     else:
         date_obj = datetime.now().date()
 
-    # Auto-generate attendance records for all active employees if they don't exist
-    employees = Employee.query.filter_by(status='active').all()
-    for employee in employees:
-        employee.generate_attendance(date_obj, date_obj)
+    # Rows are normally pre-created by `flask materialize-attendance`; only fill gaps
+    ensure_attendance(date_obj, date_obj)
 
-    # 1. Chart Data (Current month till last day)
+    # 1. Chart Data (Current month till last day), aggregated in the database
     year = date_obj.year
     month = date_obj.month
     _, last_day = monthrange(year, month)
@@ -38,102 +49,72 @@ def index():
     
     start_date = datetime(year, month, 1).date()
     end_date = datetime(year, month, last_day).date()
-    month_attendances = Attendance.query.filter(Attendance.date.between(start_date, end_date)).all()
-    
-    day_stats = defaultdict(lambda: {'on_time': 0, 'late': 0})
-    for att in month_attendances:
-        if att.status == 'present' and att.time_in and att.employee.schedule:
-            schedule = att.employee.schedule
-            if schedule.is_flexible:
-                # Flexible shifts aren't late based on check-in time
-                day_stats[att.date.day]['on_time'] += 1
-            else:
-                allowed_time = (datetime.combine(att.date, schedule.time_in) + timedelta(minutes=schedule.grace_period_minutes)).time()
-                if att.time_in > allowed_time:
-                    day_stats[att.date.day]['late'] += 1
-                else:
-                    day_stats[att.date.day]['on_time'] += 1
+    day_stats = daily_punctuality(start_date, end_date)
 
     for d in range(1, last_day + 1):
         curr = datetime(year, month, d).date()
         day_str = f"{d}-{curr.strftime('%a')}"
         chart_labels.append(day_str)
-        chart_on_time.append(day_stats[d]['on_time'])
-        chart_late.append(day_stats[d]['late'])
+        chart_on_time.append(day_stats[curr]['on_time'])
+        chart_late.append(day_stats[curr]['late'])
 
     # 2. Daily stats (for `date_obj`) grouped by Department
-    from models import Department
-    departments = Department.query.all()
-    dept_stats = []
-    
-    todays_attendances = Attendance.query.filter_by(date=date_obj).all()
+    dept_stats = department_day_stats(date_obj)
+
+    # Employees who checked in on `date_obj`, with lateness decided in SQL
     emp_login_lists = {'logged_in': [], 'on_time': [], 'late': []}
-    
-    for dept in departments:
-        dept_info = {
-            'name': dept.name,
-            'total': len(dept.employees),
-            'on_time': 0,
-            'late': 0,
-            'leave': 0
-        }
-        dept_stats.append(dept_info)
-        
-    dept_map = {d['name']: d for d in dept_stats}
-    
-    for att in todays_attendances:
+    todays_checkins = db.session.query(Attendance, late_clause(), Employee.schedule_id.is_(None)).join(
+        Employee, Employee.id == Attendance.employee_id
+    ).options(
+        joinedload(Attendance.employee).joinedload(Employee.designation)
+    ).filter(
+        Attendance.date == date_obj,
+        Attendance.status == 'present'
+    ).all()
+
+    for att, is_late, unscheduled in todays_checkins:
         emp = att.employee
-        dept_name = emp.department.name if emp.department else None
-        
-        att_status_detail = "Absent"
-        if att.status == 'leave':
-            if dept_name in dept_map: dept_map[dept_name]['leave'] += 1
-        elif att.status == 'present':
-            is_late = False
-            if att.time_in and emp.schedule:
-                if emp.schedule.is_flexible:
-                    is_late = False
-                else:
-                    allowed_time = (datetime.combine(att.date, emp.schedule.time_in) + timedelta(minutes=emp.schedule.grace_period_minutes)).time()
-                    if att.time_in > allowed_time:
-                        is_late = True
-                
-            if is_late:
-                if dept_name in dept_map: dept_map[dept_name]['late'] += 1
-                att_status_detail = "Late"
-            else:
-                if dept_name in dept_map: dept_map[dept_name]['on_time'] += 1
-                att_status_detail = "On-time"
-
-            emp_data = {
-                'id': emp.id,
-                'name': f"{emp.firstname} {emp.lastname}",
-                'designation': emp.designation.name if emp.designation else "Regular",
-                'image': emp.image,
-                'initials': f"{emp.firstname[0]}{emp.lastname[0]}" if emp.firstname and emp.lastname else "E",
-                'status': att_status_detail,
-                'time_in': att.time_in.strftime('%I:%M %p') if att.time_in else "-",
-                'time_out': att.time_out.strftime('%I:%M %p') if att.time_out else "-"
-            }
-            emp_login_lists['logged_in'].append(emp_data)
-            if is_late:
-                emp_login_lists['late'].append(emp_data)
-            else:
-                emp_login_lists['on_time'].append(emp_data)
+        emp_data = {
+            'id': emp.id,
+            'name': f"{emp.firstname} {emp.lastname}",
+            'designation': emp.designation.name if emp.designation else "Regular",
+            'image': emp.image,
+            'initials': f"{emp.firstname[0]}{emp.lastname[0]}" if emp.firstname and emp.lastname else "E",
+            'status': "No schedule" if unscheduled else "Late" if is_late else "On-time",
+            'time_in': att.time_in.strftime('%I:%M %p') if att.time_in else "-",
+            'time_out': att.time_out.strftime('%I:%M %p') if att.time_out else "-"
+        }
+        emp_login_lists['logged_in'].append(emp_data)
+        if unscheduled:
+            # Neither on time nor late without a schedule
+            continue
+        if is_late:
+            emp_login_lists['late'].append(emp_data)
+        else:
+            emp_login_lists['on_time'].append(emp_data)
 
     # 3. Backlog calculation 
+    if is_virtual_calendar():
+        backlog_attendances = [att for att in load_attendance(date_obj, date_obj) if att.status in ['absent', 'leave']][:4]
+    else:
+        backlog_attendances = Attendance.query.options(
+            joinedload(Attendance.employee).joinedload(Employee.designation)
+        ).filter(
+            Attendance.date == date_obj,
+            Attendance.status.in_(['absent', 'leave'])
+        ).limit(4).all()
+
     backlog_list = []
-    for att in todays_attendances:
-        if att.status in ['absent', 'leave'] and len(backlog_list) < 4:
-            emp = att.employee
-            backlog_list.append({
-                'name': f"{emp.firstname} {emp.lastname}",
-                'designation': emp.designation.name if emp.designation else "Regular",
-                'image': emp.image,
-                'initials': f"{emp.firstname[0]}{emp.lastname[0]}" if emp.firstname and emp.lastname else "E",
-                'no_days': 1,
-                'pending_hrs': '8h 0m'
-            })
+    for att in backlog_attendances:
+        emp = att.employee
+        backlog_list.append({
+            'name': f"{emp.firstname} {emp.lastname}",
+            'designation': emp.designation.name if emp.designation else "Regular",
+            'image': emp.image,
+            'initials': f"{emp.firstname[0]}{emp.lastname[0]}" if emp.firstname and emp.lastname else "E",
+            'no_days': 1,
+            'pending_hrs': '8h 0m'
+        })
 
     return render_template(
         'admin/attendance/index.html', 
@@ -189,26 +170,12 @@ def check():
         flash('Access denied', 'danger')
         return redirect(url_for('auth.login'))
 
-    attendance = Attendance.query.filter_by(employee_id=employee_id, date=current_date).first()
-    
-    if action == 'in':
-        if not attendance:
-            attendance = Attendance(
-                employee_id=employee_id,
-                date=current_date,
-                time_in=current_time,
-                status='present'
-            )
-            db.session.add(attendance)
-        else:
-            attendance.time_in = current_time
-    elif action == 'out':
-        if attendance:
-            attendance.time_out = current_time
-        else:
+    if action in ('in', 'out'):
+        # Every punch is logged in checks; the day's first in / last out are derived from the log
+        attendance = record_punch(employee_id, current_date, current_time, action, present_from=CHECK_IN_PRESENT_FROM)
+        if attendance is None:
             flash('No check-in record found!', 'warning')
             return redirect(url_for('attendance.board'))
-    
     db.session.commit()
     flash(f'Check {action} recorded successfully!', 'success')
     return redirect(url_for('attendance.board'))
@@ -248,7 +215,14 @@ def create():
         except Exception:
             pass
 
+        # Only one record per employee and day (unique index)
+        existing = Attendance.query.filter_by(employee_id=employee_id, date=date_obj).first()
+        if existing:
+            flash('An attendance record already exists for this employee and date.', 'warning')
+            return redirect(url_for('attendance.edit', attendance_id=existing.id))
+
         attendance = Attendance(employee_id=employee_id, date=date_obj, time_in=time_in_obj, time_out=time_out_obj, status=status)
+        classify_attendance(attendance)
         db.session.add(attendance)
         db.session.commit()
         flash('Attendance record created.', 'success')
@@ -275,9 +249,24 @@ def edit(attendance_id):
         status = request.form.get('status')
 
         try:
-            attendance.date = datetime.fromisoformat(date_str).date()
+            date_obj = datetime.fromisoformat(date_str).date()
         except Exception:
-            pass
+            date_obj = attendance.date
+
+        previous = (attendance.date, attendance.time_in, attendance.time_out)
+
+        # Only one record per employee and day (unique index); check before
+        # assigning so autoflush cannot hit the constraint
+        if date_obj != attendance.date:
+            existing = Attendance.query.filter(
+                Attendance.employee_id == attendance.employee_id,
+                Attendance.date == date_obj,
+                Attendance.id != attendance.id
+            ).first()
+            if existing:
+                flash('An attendance record already exists for this employee and date.', 'warning')
+                return redirect(url_for('attendance.edit', attendance_id=existing.id))
+            attendance.date = date_obj
 
         from datetime import datetime as _dt
         try:
@@ -290,6 +279,10 @@ def edit(attendance_id):
             attendance.time_out = None
 
         attendance.status = status or attendance.status
+        if (attendance.date, attendance.time_in, attendance.time_out) != previous:
+            # Later punches re-derive the row from the log; keep the correction there too
+            replace_punches(attendance, previous_date=previous[0])
+        classify_attendance(attendance)
         db.session.commit()
         flash('Attendance updated.', 'success')
         return redirect(url_for('attendance.index', date=attendance.date.isoformat()))
@@ -338,72 +331,23 @@ def monthly_report():
     employees = Employee.query.order_by(Employee.firstname).all()
 
     # Ensure attendance records exist for all employees for the entire month
-    for emp in employees:
-        if not employee_id or str(emp.id) == str(employee_id):
-            emp.generate_attendance(start_date, end_date)
-    
-    # Base query
-    query = Attendance.query.filter(Attendance.date.between(start_date, end_date))
     if employee_id:
-        query = query.filter(Attendance.employee_id == employee_id)
+        ensure_attendance(start_date, end_date, [employee_id])
+    else:
+        ensure_attendance(start_date, end_date, [emp.id for emp in employees])
     
-    # Fetch attendance records
-    attendances = query.order_by(Attendance.employee_id, Attendance.date).all()
+    # Fetch attendance records (merged with the computed calendar in virtual mode)
+    attendances = load_attendance(start_date, end_date, [employee_id] if employee_id else None)
     
     # Calculate statistics per employee
-    stats = defaultdict(lambda: {
-        'present': 0,
-        'absent': 0,
-        'late': 0,
-        'early_out': 0,
-        'leave': 0,
-        'holiday': 0,
-        'working_hours': timedelta(),
-        'attendance_percentage': 0
-    })
+    stats = defaultdict(empty_attendance_stats)
     
     # Eagerly initialize all employees to prevent Jinja UndefinedErrors
     for emp in employees:
         _ = stats[emp.id]
     
     for attendance in attendances:
-        emp_stats = stats[attendance.employee_id]
-        
-        if attendance.status == 'present':
-            emp_stats['present'] += 1
-            
-            # Calculate working hours if both in/out times exist
-            if attendance.time_in and attendance.time_out:
-                time_in = datetime.combine(attendance.date, attendance.time_in)
-                time_out = datetime.combine(attendance.date, attendance.time_out)
-                working_hours = time_out - time_in
-                emp_stats['working_hours'] += working_hours
-                
-                # Check if employee's schedule exists and compare
-                if attendance.employee.schedule:
-                    schedule = attendance.employee.schedule
-                    if schedule.is_flexible:
-                        # For flexible shifts, check if they met working hours instead of late time
-                        if working_hours.total_seconds() / 3600 < float(schedule.working_hours):
-                            emp_stats['early_out'] += 1
-                    else:
-                        allowed_time = (datetime.combine(attendance.date, schedule.time_in) + timedelta(minutes=schedule.grace_period_minutes)).time()
-                        if attendance.time_in > allowed_time:
-                            emp_stats['late'] += 1
-                        if attendance.time_out < datetime.combine(attendance.date, schedule.time_out).time():
-                            emp_stats['early_out'] += 1
-        elif attendance.status == 'absent':
-            emp_stats['absent'] += 1
-        elif attendance.status == 'leave':
-            emp_stats['leave'] += 1
-        elif attendance.status == 'holiday':
-            emp_stats['holiday'] += 1
-        
-        # Calculate attendance percentage (Present / (Present + Absent))
-        # Usually leaves and holidays don't count against attendance rate
-        total_relevant_days = emp_stats['present'] + emp_stats['absent']
-        if total_relevant_days > 0:
-            emp_stats['attendance_percentage'] = (emp_stats['present'] / total_relevant_days) * 100
+        add_attendance_to_stats(stats[attendance.employee_id], attendance)
             
     import calendar
     cal_grid = calendar.monthcalendar(year, month)
@@ -441,6 +385,102 @@ def monthly_report():
                          summary=summary,
                          datetime=datetime)
 
+@bp.route('/monthly-report/export')
+@login_required
+def export_monthly_report():
+    """Stream the per-employee attendance statistics as CSV or XLSX.
+
+    Accepts any `start_date`/`end_date` range (defaults to the `year`/`month`
+    params, or the current month). Rows are produced one employee at a time
+    from a server-side cursor, so memory stays flat regardless of headcount.
+    """
+    if not current_user.is_authenticated or current_user.role.name not in ['superadmin', 'hr']:
+        flash('Access denied', 'danger')
+        return redirect(url_for('auth.login'))
+
+    try:
+        if request.args.get('start_date') and request.args.get('end_date'):
+            start_date = datetime.fromisoformat(request.args['start_date']).date()
+            end_date = datetime.fromisoformat(request.args['end_date']).date()
+        else:
+            year = int(request.args.get('year', datetime.now().year))
+            month = int(request.args.get('month', datetime.now().month))
+            start_date = datetime(year, month, 1).date()
+            end_date = datetime(year, month, monthrange(year, month)[1]).date()
+    except ValueError:
+        flash('Invalid date range', 'danger')
+        return redirect(url_for('attendance.monthly_report'))
+
+    if start_date > end_date:
+        flash('Start date cannot be after end date', 'danger')
+        return redirect(url_for('attendance.monthly_report'))
+
+    employee_id = request.args.get('employee_id')
+    export_format = request.args.get('format', 'csv')
+    filename = f"attendance_{start_date.isoformat()}_{end_date.isoformat()}.{export_format}"
+
+    header = ['Employee ID', 'Name', 'Department', 'Present', 'Absent', 'Late', 'Early Out',
+              'Leave', 'Holiday', 'Working Hours', 'Attendance %']
+
+    def export_rows():
+        for employee, emp_stats in iter_attendance_summaries(start_date, end_date, employee_id):
+            yield [
+                employee.unique_id,
+                f"{employee.firstname} {employee.lastname}",
+                employee.department or '',
+                emp_stats['present'],
+                emp_stats['absent'],
+                emp_stats['late'],
+                emp_stats['early_out'],
+                emp_stats['leave'],
+                emp_stats['holiday'],
+                round(emp_stats['working_hours'].total_seconds() / 3600, 2),
+                round(float(emp_stats['attendance_percentage']), 1)
+            ]
+
+    if export_format == 'xlsx':
+        try:
+            from openpyxl import Workbook
+        except ImportError:
+            flash('XLSX export requires openpyxl to be installed.', 'warning')
+            return redirect(url_for('attendance.monthly_report'))
+
+        def generate_xlsx():
+            # Write-only workbooks spool rows to disk; stream the finished file in chunks
+            workbook = Workbook(write_only=True)
+            sheet = workbook.create_sheet('Attendance')
+            sheet.append(header)
+            for row in export_rows():
+                sheet.append(row)
+            with tempfile.TemporaryFile() as spool:
+                workbook.save(spool)
+                spool.seek(0)
+                for chunk in iter(lambda: spool.read(64 * 1024), b''):
+                    yield chunk
+
+        return Response(
+            stream_with_context(generate_xlsx()),
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        )
+
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(header)
+        for row in export_rows():
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+        yield buffer.getvalue()
+
+    return Response(
+        stream_with_context(generate_csv()),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
 @bp.route('/report')
 @login_required
 def report():
@@ -449,15 +489,70 @@ def report():
         flash('Access denied', 'danger')
         return redirect(url_for('auth.login'))
 
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
-    
-    query = Attendance.query
-    if start_date and end_date:
-        query = query.filter(Attendance.date.between(start_date, end_date))
-    
-    attendances = query.all()
-    return render_template('admin/attendance/report.html', attendances=attendances)
+    # Date bounds are required; default to the current month
+    today = datetime.now().date()
+    try:
+        start_date = datetime.fromisoformat(request.args['start_date']).date() if request.args.get('start_date') else today.replace(day=1)
+        end_date = datetime.fromisoformat(request.args['end_date']).date() if request.args.get('end_date') else today.replace(day=monthrange(today.year, today.month)[1])
+    except ValueError:
+        flash('Invalid date range', 'danger')
+        start_date = today.replace(day=1)
+        end_date = today.replace(day=monthrange(today.year, today.month)[1])
+    employee_id = request.args.get('employee_id', type=int)
+    department_id = request.args.get('department_id', type=int)
+    per_page = max(1, min(request.args.get('per_page', REPORT_PAGE_SIZE, type=int), 200))
+
+    query = Attendance.query.filter(Attendance.date.between(start_date, end_date))
+    if employee_id:
+        query = query.filter(Attendance.employee_id == employee_id)
+    if department_id:
+        query = query.filter(Attendance.employee_id.in_(
+            db.session.query(Employee.id).filter(Employee.department_id == department_id)
+        ))
+
+    # Bounded count: never scans more than REPORT_COUNT_CAP index entries
+    capped = query.with_entities(Attendance.id).limit(REPORT_COUNT_CAP + 1).subquery()
+    total = db.session.query(db.func.count()).select_from(capped).scalar()
+
+    # Keyset pagination over (date, id), newest first
+    after = request.args.get('after')
+    if after:
+        try:
+            after_date, after_id = after.split('_')
+            after_date = datetime.fromisoformat(after_date).date()
+            query = query.filter(or_(
+                Attendance.date < after_date,
+                and_(Attendance.date == after_date, Attendance.id < int(after_id))
+            ))
+        except ValueError:
+            after = None
+
+    attendances = query.options(joinedload(Attendance.employee)).order_by(
+        Attendance.date.desc(), Attendance.id.desc()
+    ).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(attendances) > per_page:
+        attendances = attendances[:per_page]
+        last = attendances[-1]
+        next_cursor = f"{last.date.isoformat()}_{last.id}"
+
+    return render_template(
+        'admin/attendance/report.html',
+        attendances=attendances,
+        start_date=start_date,
+        end_date=end_date,
+        employees=Employee.query.order_by(Employee.firstname).all(),
+        departments=Department.query.order_by(Department.name).all(),
+        selected_employee=employee_id,
+        selected_department=department_id,
+        total=total,
+        total_capped=total > REPORT_COUNT_CAP,
+        count_cap=REPORT_COUNT_CAP,
+        per_page=per_page,
+        next_cursor=next_cursor,
+        is_first_page=not after
+    )
 
 @bp.route('/holidays')
 @login_required
@@ -501,10 +596,8 @@ def create_holiday():
         db.session.add(holiday)
         db.session.commit()
 
-        # Regenerate attendance records for this date
-        employees = Employee.query.filter_by(status='active').all()
-        for employee in employees:
-            employee.generate_attendance(date_obj, date_obj)
+        # Re-derive the existing attendance records for this date
+        rederive_attendance([date_obj])
 
         flash('Holiday added successfully', 'success')
         return redirect(url_for('attendance.holidays'))
@@ -522,6 +615,7 @@ def edit_holiday(holiday_id):
     holiday = Holiday.query.get_or_404(holiday_id)
     
     if request.method == 'POST':
+        previous_date = holiday.date
         holiday.name = request.form.get('name')
         holiday.description = request.form.get('description')
         holiday.type = request.form.get('type')
@@ -536,10 +630,8 @@ def edit_holiday(holiday_id):
 
         db.session.commit()
 
-        # Regenerate attendance records for this date
-        employees = Employee.query.filter_by(status='active').all()
-        for employee in employees:
-            employee.generate_attendance(holiday.date, holiday.date)
+        # Re-derive the existing attendance records for the old and new date
+        rederive_attendance([previous_date, holiday.date])
 
         flash('Holiday updated successfully', 'success')
         return redirect(url_for('attendance.holidays'))
@@ -560,10 +652,8 @@ def delete_holiday(holiday_id):
     db.session.delete(holiday)
     db.session.commit()
 
-    # Regenerate attendance records for this date
-    employees = Employee.query.filter_by(status='active').all()
-    for employee in employees:
-        employee.generate_attendance(date, date)
+    # Re-derive the existing attendance records for this date
+    rederive_attendance([date])
 
     flash('Holiday deleted successfully', 'success')
     return redirect(url_for('attendance.holidays'))
@@ -627,6 +717,13 @@ def toggle_working_day(weekday):
     # Toggle the status
     config.is_working_day = not config.is_working_day
     db.session.commit()
+
+    # Re-derive this weekday's existing records from the start of the current month;
+    # earlier months are left as they were recorded
+    first_of_month = datetime.now().date().replace(day=1)
+    last_date = db.session.query(db.func.max(Attendance.date)).scalar()
+    if last_date and last_date >= first_of_month:
+        rederive_attendance([day for day in daterange(first_of_month, last_date) if day.weekday() == weekday])
     
     status = 'working day' if config.is_working_day else 'non-working day (weekend)'
     flash(f'{config.day_name} is now marked as {status}', 'success')
@@ -6,8 +6,9 @@ from flask_bcrypt import Bcrypt
 import secrets
 import string
 import json
-from models import Employee, Attendance
+from models import Employee
 from datetime import datetime
+from utils.attendance import ensure_attendance, load_attendance
 
 bp = Blueprint('hr', __name__, url_prefix='/hr')
 bcrypt = Bcrypt()
@@ -55,10 +56,9 @@ def attendance_board():
 
     # Ensure attendance records exist for active employees
     employees = Employee.query.order_by(Employee.firstname).all()
-    for employee in employees:
-        employee.generate_attendance(date_obj, date_obj)
+    ensure_attendance(date_obj, date_obj, [employee.id for employee in employees])
 
-    attendances = Attendance.query.filter_by(date=date_obj).all()
+    attendances = load_attendance(date_obj, date_obj, [employee.id for employee in employees])
     attendance_map = {a.employee_id: a for a in attendances}
 
     return render_template('admin/hr/attendance.html', employees=employees, attendance_map=attendance_map, date=date_obj)
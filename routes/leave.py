@@ -3,6 +3,7 @@ from flask_login import login_required, current_user
 from database import db
 from datetime import datetime, date
 from models import Leave, Employee, Notification, User
+from utils.attendance import daterange, rederive_attendance
 
 bp = Blueprint('leave', __name__, url_prefix='/leaves')
 
@@ -164,6 +165,11 @@ def process_leave(id):
                 )
                 
     db.session.commit()
+
+    # Approved leave days become 'leave' on the already generated attendance rows
+    if leave.status == 'approved':
+        rederive_attendance(daterange(leave.start_date, leave.end_date), [leave.employee_id])
+
     flash(f'Leave {leave.status}', 'success')
     return redirect(url_for('leave.index'))
 
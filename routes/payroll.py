@@ -1,30 +1,48 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
-from flask_login import login_required
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app, Response, stream_with_context
+from flask_login import login_required, current_user
 from database import db
-from models import Payroll, Employee, Salary, Notification, User
+from models import Payroll, PayrollRun, Employee, Salary, Notification, User, normalize_month, payroll_period
 from datetime import datetime
 from decimal import Decimal
+from sqlalchemy.orm import joinedload
+from utils.payroll import recompute_stale_payroll, run_payroll
+from utils.payroll_runs import active_run_for, create_payroll_run, enqueue_payroll_run, is_run_active
+from utils.payroll_totals import month_totals
+from utils.payslips import FORMATS, pdf_available, plan_payslips, stream_payslip_archive
 
 bp = Blueprint('payroll', __name__, url_prefix='/payroll')
 
 @bp.route('/')
 @login_required
 def index():
-    payrolls = Payroll.query.all()
-    return render_template('admin/payroll/index.html', payrolls=payrolls)
+    page = request.args.get('page', 1, type=int)
+    payrolls = Payroll.query.options(joinedload(Payroll.employee)).order_by(Payroll.period.desc(), Payroll.id.desc()).paginate(
+        page=page, per_page=current_app.config['PAYROLL_PER_PAGE'], error_out=False
+    )
+    runs = PayrollRun.query.order_by(PayrollRun.id.desc()).limit(5).all()
+    stale_count = Payroll.query.filter(Payroll.status == 'pending', Payroll.stale_at.isnot(None)).count()
+    return render_template('admin/payroll/index.html', payrolls=payrolls, runs=runs, stale_count=stale_count)
 
 @bp.route('/create', methods=['GET', 'POST'])
 @login_required
 def create():
     if request.method == 'POST':
         employee_id = request.form.get('employee_id')
-        month = request.form.get('month')
         year = int(request.form.get('year'))
+        try:
+            month = normalize_month(request.form.get('month'))
+        except ValueError as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('payroll.create'))
         
         employee = Employee.query.get(employee_id)
         if not employee or not employee.salary:
             flash('Employee salary not configured!', 'warning')
             return redirect(url_for('payroll.create'))
+
+        if Payroll.query.filter_by(employee_id=employee.id, period=payroll_period(month, year)).first():
+            flash(f'A payroll for {month} {year} already exists for this employee.', 'warning')
+            return redirect(url_for('payroll.create'))
         
         basic_salary = employee.salary.basic_salary
         allowances = Decimal(request.form.get('allowances', 0))
@@ -73,62 +91,159 @@ def report():
     month = request.args.get('month')
     year = request.args.get('year')
     
-    query = Payroll.query
+    page = request.args.get('page', 1, type=int)
+
+    query = Payroll.query.options(joinedload(Payroll.employee))
+    totals = None
     if month and year:
-        query = query.filter_by(month=month, year=int(year))
-    
-    payrolls = query.all()
-    return render_template('admin/payroll/report.html', payrolls=payrolls)
+        try:
+            month = normalize_month(month)
+        except ValueError as e:
+            flash(str(e), 'warning')
+            return redirect(url_for('payroll.report'))
+        query = query.filter(Payroll.period == payroll_period(month, int(year)))
+        totals = month_totals(month, int(year))
+
+    payrolls = query.order_by(Payroll.period.desc(), Payroll.id.desc()).paginate(
+        page=page, per_page=current_app.config['PAYROLL_PER_PAGE'], error_out=False
+    )
+    return render_template('admin/payroll/report.html', payrolls=payrolls, totals=totals)
+
+@bp.route('/payslips/export')
+@login_required
+def export_payslips():
+    """Stream every payslip of a month as one ZIP of HTML or PDF files."""
+    if current_user.role.name not in ['superadmin', 'hr']:
+        flash('You do not have permission to export payslips.', 'danger')
+        return redirect(url_for('payroll.index'))
+
+    month = request.args.get('month')
+    year = request.args.get('year', type=int)
+    fmt = request.args.get('format', 'html')
+    if not month or not year or fmt not in FORMATS:
+        flash('Select a month, year and format to export payslips.', 'warning')
+        return redirect(url_for('payroll.report'))
+    try:
+        month = normalize_month(month)
+    except ValueError as e:
+        flash(str(e), 'warning')
+        return redirect(url_for('payroll.report'))
+    if fmt == 'pdf' and not pdf_available():
+        flash('PDF export requires weasyprint and its Pango system libraries. Install it with: pip install weasyprint', 'warning')
+        return redirect(url_for('payroll.report', month=month, year=year))
+
+    entries, missing = plan_payslips(month, year, fmt)
+    if not entries:
+        flash(f'No payslips found for {month} {year}.', 'info')
+        return redirect(url_for('payroll.report', month=month, year=year))
+
+    archive = stream_payslip_archive(entries, missing, fmt, max_workers=current_app.config.get('PAYROLL_WORKERS'))
+    return Response(
+        stream_with_context(archive),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename=payslips_{month}_{year}_{fmt}.zip'}
+    )
 
 @bp.route('/calculate', methods=['POST'])
 @login_required
 def calculate():
     # Calculate payroll for all employees for a given month
-    month = request.form.get('month')
     year = int(request.form.get('year'))
-    
-    employees = Employee.query.filter_by(status='active').all()
-    
-    for employee in employees:
-        if not employee.salary:
-            continue
-        
-        # Check if payroll already exists
-        existing = Payroll.query.filter_by(
-            employee_id=employee.id,
-            month=month,
-            year=year
-        ).first()
-        
-        if existing:
-            continue
-        
-        basic_salary = employee.salary.basic_salary
-        net_salary = basic_salary
-        
-        payroll = Payroll(
-            employee_id=employee.id,
-            month=month,
-            year=year,
-            basic_salary=basic_salary,
-            net_salary=net_salary
-        )
-        db.session.add(payroll)
-        
-        # Send notification to the employee
-        if employee.email:
-            user_account = User.query.filter_by(email=employee.email).first()
-            if not user_account and '@' not in employee.email:
-                user_account = User.query.filter_by(email=f"{employee.unique_id}@employee.local").first()
-                
-            if user_account:
-                notif = Notification(
-                    user_id=user_account.id,
-                    message=f"Your payslip for {month} {year} has been generated.",
-                    type='salary'
-                )
-                db.session.add(notif)
-    
-    db.session.commit()
-    flash('Payroll calculated for all employees!', 'success')
+    try:
+        month = normalize_month(request.form.get('month'))
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('payroll.index'))
+    dry_run = bool(request.form.get('dry_run'))
+
+    if not dry_run:
+        active_employees = Employee.query.filter_by(status='active').count()
+        if request.form.get('parallel') or active_employees >= current_app.config['PAYROLL_PARALLEL_THRESHOLD']:
+            # Too many employees for one request: compute in a background process pool
+            run = active_run_for(month, year)
+            if run:
+                flash(f'A payroll run for {month} {year} is already in progress.', 'warning')
+            else:
+                run = create_payroll_run(month, year, created_by=current_user.id)
+                enqueue_payroll_run(run.id)
+                flash(f'Payroll run queued for {active_employees} employee(s).', 'success')
+            return redirect(url_for('payroll.run_detail', id=run.id))
+
+    result = run_payroll(month, year, dry_run=dry_run)
+    if dry_run:
+        return render_template('admin/payroll/preview.html', month=month, year=year, **result)
+
+    skipped = result['skipped']
+    flash(f"Payroll calculated for {len(result['lines'])} employee(s) "
+          f"({skipped['existing']} already paid, {skipped['no_salary']} without salary).", 'success')
     return redirect(url_for('payroll.index'))
+
+
+@bp.route('/recompute', methods=['POST'])
+@login_required
+def recompute():
+    """Re-derive only the pending payrolls whose salary or attendance inputs changed."""
+    month = request.form.get('month')
+    year = request.form.get('year')
+    if month and year:
+        try:
+            month = normalize_month(month)
+        except ValueError as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('payroll.index'))
+    recomputed = recompute_stale_payroll(month, year)
+    flash(f'Recomputed {recomputed} stale payroll(s).', 'success')
+    return redirect(url_for('payroll.index'))
+
+
+def run_status(run):
+    return {
+        'id': run.id,
+        'month': run.month,
+        'year': run.year,
+        'status': run.status,
+        'progress': run.progress,
+        'created_count': run.created_count,
+        'error': run.error,
+        'shards': [{
+            'index': shard.index,
+            'min_employee_id': shard.min_employee_id,
+            'max_employee_id': shard.max_employee_id,
+            'status': shard.status,
+            'attempts': shard.attempts,
+            'line_count': shard.line_count,
+            'error': shard.error
+        } for shard in run.shards]
+    }
+
+
+@bp.route('/runs/<int:id>')
+@login_required
+def run_detail(id):
+    run = PayrollRun.query.get_or_404(id)
+    return render_template('admin/payroll/run.html', run=run, active=is_run_active(run.id))
+
+
+@bp.route('/runs/<int:id>/status')
+@login_required
+def run_status_json(id):
+    run = PayrollRun.query.get_or_404(id)
+    return jsonify(run_status(run))
+
+
+@bp.route('/runs/<int:id>/retry', methods=['POST'])
+@login_required
+def retry_run(id):
+    run = PayrollRun.query.get_or_404(id)
+    if is_run_active(run.id):
+        flash('This payroll run is still in progress.', 'warning')
+    elif run.status == 'completed':
+        flash('This payroll run has already completed.', 'info')
+    else:
+        # Only shards that are not completed are computed again
+        run.status = 'queued'
+        db.session.commit()
+        enqueue_payroll_run(run.id)
+        flash('Retrying the unfinished shards.', 'success')
+    return redirect(url_for('payroll.run_detail', id=run.id))
+
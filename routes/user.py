@@ -6,10 +6,12 @@ from flask_bcrypt import Bcrypt
 import json
 from functools import wraps
 from database import db
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
 from werkzeug.utils import secure_filename
 from flask import current_app
+from utils.attendance import CHECK_IN_PRESENT_FROM, load_attendance, punch_error, record_punch
+from utils.punch_journal import get_punch_journal
 
 bp = Blueprint('user', __name__, url_prefix='/user')
 bcrypt = Bcrypt()
@@ -198,7 +200,7 @@ def dashboard():
     if employee:
         attendances = Attendance.query.filter_by(employee_id=employee.id).order_by(Attendance.date.desc()).limit(7).all()
         leaves = Leave.query.filter_by(employee_id=employee.id).order_by(Leave.created_at.desc()).limit(5).all()
-        payrolls = Payroll.query.filter_by(employee_id=employee.id).order_by(Payroll.year.desc(), Payroll.month.desc()).limit(6).all()
+        payrolls = Payroll.query.filter_by(employee_id=employee.id).order_by(Payroll.period.desc()).limit(6).all()
         
         # Get today's attendance for self check-in widget
         today = datetime.now().date()
@@ -235,12 +237,11 @@ def dashboard():
             payrolls_this_year = Payroll.query.filter_by(employee_id=employee.id, year=current_year).count()
             
             # Check for missed attendance (absent on past days this month)
-            missed_attendances = Attendance.query.filter(
-                Attendance.employee_id == employee.id,
-                Attendance.date >= first_of_month,
-                Attendance.date < today,
-                Attendance.status == 'absent'
-            ).order_by(Attendance.date.desc()).all()
+            missed_attendances = [
+                att for att in load_attendance(first_of_month, today - timedelta(days=1), [employee.id])
+                if att.status == 'absent'
+            ]
+            missed_attendances.reverse()
             
         except Exception:
             present_days_month = 0
@@ -277,30 +278,24 @@ def self_check():
     current_date = now.date()
     current_time = now.time()
 
-    attendance = Attendance.query.filter_by(employee_id=employee.id, date=current_date).first()
-
-    if action == 'in':
-        if not attendance:
-            attendance = Attendance(
-                employee_id=employee.id,
-                date=current_date,
-                time_in=current_time,
-                status='present'
-            )
-            db.session.add(attendance)
-        else:
-            attendance.time_in = current_time
-            if attendance.status in ['absent', 'weekend', 'leave']:
-                attendance.status = 'present'
-        flash('Successfully Checked In!', 'success')
-    elif action == 'out':
-        if attendance:
-            attendance.time_out = current_time
-            flash('Successfully Checked Out!', 'success')
-        else:
-            flash('Cannot check out without checking in first.', 'danger')
+    if action not in ('in', 'out'):
+        return redirect(url_for('user.dashboard'))
 
-    db.session.commit()
+    journal = get_punch_journal()
+    error = punch_error(employee.id, current_date, action,
+                        last_direction=journal.last_direction(employee.id, current_date) if journal else None)
+    if error:
+        flash(error, 'danger')
+        return redirect(url_for('user.dashboard'))
+
+    if journal:
+        # Write-behind mode: acknowledge once the punch is journaled; the flusher applies it
+        journal.append(employee.id, action, now)
+    else:
+        record_punch(employee.id, current_date, current_time, action,
+                     present_from=CHECK_IN_PRESENT_FROM if action == 'in' else ())
+        db.session.commit()
+    flash('Successfully Checked In!' if action == 'in' else 'Successfully Checked Out!', 'success')
     return redirect(url_for('user.dashboard'))
 
 @bp.route('/directory')
@@ -434,7 +429,7 @@ def payrolls_list():
 
     payrolls = []
     if employee:
-        payrolls = Payroll.query.filter_by(employee_id=employee.id).order_by(Payroll.year.desc(), Payroll.month.desc()).all()
+        payrolls = Payroll.query.filter_by(employee_id=employee.id).order_by(Payroll.period.desc()).all()
 
     return render_template('admin/user/payrolls.html', payrolls=payrolls, employee=employee)
 
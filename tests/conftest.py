@@ -0,0 +1,60 @@
+import os
+import sys
+import tempfile
+from datetime import time
+
+import pytest
+
+_db_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+os.environ['CREATE_DB'] = 'false'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app as flask_app  # noqa: E402
+from database import db  # noqa: E402
+from models import Department, Employee, Role, Schedule, User  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    flask_app.config['TESTING'] = True
+    with flask_app.app_context():
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def admin(app):
+    role = Role(name='superadmin')
+    db.session.add(role)
+    db.session.flush()
+    user = User(name='Admin', email='admin@example.com', password='x', role_id=role.id)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+@pytest.fixture
+def client(app, admin):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(admin.id)
+    return client
+
+
+@pytest.fixture
+def employees(app):
+    department = Department(name='Operations')
+    schedule = Schedule(name='Day', time_in=time(9, 0), time_out=time(17, 0), grace_period_minutes=5)
+    db.session.add_all([department, schedule])
+    db.session.flush()
+    employees = [
+        Employee(firstname=f'Employee{i}', lastname='Test', unique_id=f'EMP{i}', email=f'employee{i}@example.com',
+                 department_id=department.id, schedule_id=schedule.id, status='active')
+        for i in range(2)
+    ]
+    db.session.add_all(employees)
+    db.session.commit()
+    return employees
@@ -0,0 +1,58 @@
+from datetime import date, time
+
+from database import db
+from models import Attendance
+from utils.attendance import derive_from_punch_log, record_punch
+
+
+def test_edit_onto_an_existing_day_is_rejected(client, employees):
+    employee = employees[0]
+    first = Attendance(employee_id=employee.id, date=date(2026, 10, 13), status='present')
+    second = Attendance(employee_id=employee.id, date=date(2026, 10, 14), status='present')
+    db.session.add_all([first, second])
+    db.session.commit()
+
+    response = client.post(f'/attendance/edit/{second.id}', data={'date': '2026-10-13', 'status': 'present'})
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith(f'/attendance/edit/{first.id}')
+    db.session.expire_all()
+    assert db.session.get(Attendance, second.id).date == date(2026, 10, 14)
+
+
+def test_edit_moves_a_record_to_a_free_day(client, employees):
+    attendance = Attendance(employee_id=employees[0].id, date=date(2026, 10, 14), status='present')
+    db.session.add(attendance)
+    db.session.commit()
+
+    client.post(f'/attendance/edit/{attendance.id}', data={'date': '2026-10-15', 'status': 'present'})
+    db.session.expire_all()
+    assert db.session.get(Attendance, attendance.id).date == date(2026, 10, 15)
+
+
+def test_edited_times_survive_the_next_punch(client, employees):
+    employee = employees[0]
+    day = date(2026, 10, 14)
+    attendance = record_punch(employee.id, day, time(9, 30), 'in')
+    db.session.commit()
+    assert attendance.late_minutes == 30
+
+    client.post(f'/attendance/edit/{attendance.id}', data={'date': day.isoformat(), 'time_in': '09:00', 'status': 'present'})
+    record_punch(employee.id, day, time(17, 0), 'out')
+    db.session.commit()
+    derive_from_punch_log([(employee.id, day)])
+    db.session.commit()
+
+    db.session.expire_all()
+    attendance = db.session.get(Attendance, attendance.id)
+    assert (attendance.time_in, attendance.time_out, attendance.late_minutes) == (time(9, 0), time(17, 0), 0)
+
+
+def test_report_clamps_per_page(client, employees):
+    db.session.add_all([
+        Attendance(employee_id=employee.id, date=date(2026, 10, 14), status='present') for employee in employees
+    ])
+    db.session.commit()
+
+    for per_page in (0, -5):
+        response = client.get(f'/attendance/report?start_date=2026-10-01&end_date=2026-10-31&per_page={per_page}')
+        assert response.status_code == 200
@@ -0,0 +1,39 @@
+from datetime import date, time
+
+from database import db
+from utils.attendance import daily_punctuality, department_day_stats, record_punch
+
+DAY = date(2026, 10, 14)
+
+
+def punch_in(employee, at):
+    record_punch(employee.id, DAY, at, 'in')
+    db.session.commit()
+
+
+def test_unscheduled_check_ins_are_neither_on_time_nor_late(app, employees):
+    on_time, unscheduled = employees
+    unscheduled.schedule_id = None
+    db.session.commit()
+    punch_in(on_time, time(9, 0))
+    punch_in(unscheduled, time(11, 0))
+
+    assert daily_punctuality(DAY, DAY)[DAY] == {'on_time': 1, 'late': 0, 'unscheduled': 1}
+    stats, = department_day_stats(DAY)
+    assert (stats['on_time'], stats['late'], stats['unscheduled']) == (1, 0, 1)
+
+
+def test_late_check_in_is_counted_late(app, employees):
+    punch_in(employees[0], time(9, 30))
+
+    assert daily_punctuality(DAY, DAY)[DAY] == {'on_time': 0, 'late': 1, 'unscheduled': 0}
+
+
+def test_dashboard_lists_unscheduled_check_ins_separately(client, employees):
+    employees[1].schedule_id = None
+    db.session.commit()
+    punch_in(employees[1], time(11, 0))
+
+    response = client.get(f'/attendance/?date={DAY.isoformat()}')
+    assert response.status_code == 200
+    assert b'No schedule' in response.data
@@ -0,0 +1,25 @@
+import base64
+import json
+import zlib
+
+from audit import ZDICT_V1, decode_audit_data, encode_audit_data
+
+ATTENDANCE = {'employee_id': 42, 'date': '2026-10-01', 'time_in': '09:00:00', 'time_out': '17:00:00',
+              'status': 'present', 'late_minutes': 0, 'early_out_minutes': 0, 'worked_minutes': 480}
+
+
+def test_payloads_round_trip_compressed():
+    encoded = encode_audit_data(ATTENDANCE)
+    assert encoded.startswith('z2:')
+    assert len(encoded) * 5 < len(json.dumps(ATTENDANCE))
+    assert decode_audit_data(encoded) == ATTENDANCE
+
+
+def test_z1_payloads_are_still_read():
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=ZDICT_V1)
+    packed = compressor.compress(json.dumps(ATTENDANCE).encode('utf-8')) + compressor.flush()
+    assert decode_audit_data('z1:' + base64.b64encode(packed).decode('ascii')) == ATTENDANCE
+
+
+def test_short_payloads_stay_plain_json():
+    assert decode_audit_data(encode_audit_data({'is_read': True})) == {'is_read': True}
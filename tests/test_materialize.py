@@ -0,0 +1,23 @@
+from datetime import date
+
+import utils.attendance
+from database import db
+from models import Attendance, AttendanceDailyRollup
+from utils.attendance import generate_attendance_bulk
+
+START, END = date(2026, 10, 12), date(2026, 10, 16)
+
+
+def test_counts_inserted_rows_when_the_driver_reports_no_rowcount(app, employees, monkeypatch):
+    upsert = utils.attendance.upsert
+
+    def upsert_without_rowcount(*args, **kwargs):
+        upsert(*args, **kwargs)
+        return -1
+
+    monkeypatch.setattr(utils.attendance, 'upsert', upsert_without_rowcount)
+    db.session.add(Attendance(employee_id=employees[0].id, date=START, status='present'))
+    db.session.commit()
+
+    assert generate_attendance_bulk([employee.id for employee in employees], START, END) == 9
+    assert db.session.query(db.func.sum(AttendanceDailyRollup.count)).scalar() == 10
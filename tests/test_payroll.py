@@ -0,0 +1,33 @@
+from datetime import date
+from decimal import Decimal
+
+from database import db
+from models import Attendance, Salary
+from utils.attendance import materialize_attendance
+from utils.payroll import MONTH_NAMES, compute_payroll
+
+
+def test_admin_check_in_turns_absent_day_present_and_payroll_only_counts_past_absences(client, employees):
+    today = date.today()
+    for employee in employees:
+        db.session.add(Salary(employee_id=employee.id, basic_salary=Decimal('30000')))
+    db.session.commit()
+    materialize_attendance(today.replace(day=1), today)
+    checked_in, absent = employees
+    db.session.execute(Attendance.__table__.update().where(Attendance.date == today).values(status='absent'))
+    db.session.commit()
+
+    response = client.post('/attendance/check', data={'employee_id': checked_in.id, 'action': 'in', 'time': '09:00'})
+    assert response.status_code == 302
+
+    row = Attendance.query.filter_by(employee_id=checked_in.id, date=today).populate_existing().one()
+    assert row.status == 'present'
+
+    lines = dict((line['employee_id'], line) for line in
+                 compute_payroll(MONTH_NAMES[today.month - 1], today.year)['lines'])
+    for employee in employees:
+        # Today is not final yet, so its row never counts as unpaid
+        past_absences = Attendance.query.filter(
+            Attendance.employee_id == employee.id, Attendance.status == 'absent', Attendance.date < today
+        ).count()
+        assert lines[employee.id]['unpaid_days'] == past_absences
@@ -0,0 +1,35 @@
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from database import db
+from models import Payroll, month_number, normalize_month, payroll_period
+from utils.payroll import month_bounds
+
+
+@pytest.mark.parametrize('month', ['October', 'october', 'OCT', 'Oct', ' oct '])
+def test_month_names_are_case_insensitive_and_accept_abbreviations(month):
+    assert month_number(month) == 10
+    assert normalize_month(month) == 'October'
+    assert payroll_period(month, 2026) == 202610
+    assert month_bounds(month, 2026) == (date(2026, 10, 1), date(2026, 10, 31))
+
+
+@pytest.mark.parametrize('month', ['Octember', '', None, '13'])
+def test_unknown_month_raises_a_clear_error(month):
+    with pytest.raises(ValueError, match='Unknown month'):
+        payroll_period(month, 2026)
+
+
+def test_payroll_period_default_accepts_abbreviated_month(app, employees):
+    payroll = Payroll(employee_id=employees[0].id, month='sep', year=2026, basic_salary=Decimal('100'),
+                      net_salary=Decimal('100'))
+    db.session.add(payroll)
+    db.session.commit()
+    assert payroll.period == 202609
+
+
+def test_calculate_rejects_unknown_month(client):
+    response = client.post('/payroll/calculate', data={'month': 'Octember', 'year': '2026'})
+    assert response.status_code == 302
@@ -0,0 +1,35 @@
+from datetime import datetime, timedelta
+
+from database import db
+from models import PayrollRun
+from utils.payroll_runs import active_run_for, claim_payroll_run, is_run_active
+
+
+def make_run(status='queued', heartbeat_at=None):
+    run = PayrollRun(month='September', year=2026, status=status, heartbeat_at=heartbeat_at)
+    db.session.add(run)
+    db.session.commit()
+    return run.id
+
+
+def test_run_can_only_be_claimed_once(app):
+    run_id = make_run()
+    assert claim_payroll_run(run_id)
+    assert not claim_payroll_run(run_id)
+    assert is_run_active(run_id)
+    assert active_run_for('September', 2026).id == run_id
+
+
+def test_stale_running_run_can_be_taken_over(app):
+    stale = datetime.utcnow() - timedelta(seconds=app.config['PAYROLL_RUN_STALE_AFTER'] + 60)
+    run_id = make_run(status='running', heartbeat_at=stale)
+    db.session.execute(PayrollRun.__table__.update().values(updated_at=stale))
+    db.session.commit()
+    assert not is_run_active(run_id)
+    assert active_run_for('September', 2026) is None
+    assert claim_payroll_run(run_id)
+    assert is_run_active(run_id)
+
+
+def test_completed_run_is_not_claimed(app):
+    assert not claim_payroll_run(make_run(status='completed'))
@@ -0,0 +1,17 @@
+import builtins
+import sys
+
+from utils.payslips import pdf_available
+
+
+def test_pdf_unavailable_when_system_libraries_are_missing(monkeypatch):
+    real_import = builtins.__import__
+
+    def import_without_pango(name, *args, **kwargs):
+        if name == 'weasyprint':
+            raise OSError("cannot load library 'libgobject-2.0-0'")
+        return real_import(name, *args, **kwargs)
+
+    monkeypatch.delitem(sys.modules, 'weasyprint', raising=False)
+    monkeypatch.setattr(builtins, '__import__', import_without_pango)
+    assert pdf_available() is False
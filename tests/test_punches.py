@@ -0,0 +1,66 @@
+import json
+import os
+from datetime import date, datetime, time
+
+import pytest
+
+from database import db
+from models import Attendance, Role, User
+from utils.punch_journal import PunchJournal
+from utils.punches import ingest_punches
+
+
+@pytest.fixture
+def employee_client(app, employees):
+    role = Role(name='employee')
+    db.session.add(role)
+    db.session.flush()
+    user = User(name='Employee', email=employees[0].email, password='x', role_id=role.id)
+    db.session.add(user)
+    db.session.commit()
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+    return client
+
+
+@pytest.fixture
+def journal(app, tmp_path):
+    journal = PunchJournal(str(tmp_path))
+    app.extensions['punch_journal'] = journal
+    yield journal
+    app.extensions.pop('punch_journal', None)
+
+
+def journaled_directions(journal):
+    if not os.path.exists(journal.journal_path):
+        return []
+    with open(journal.journal_path, encoding='utf-8') as f:
+        return [json.loads(line)['direction'] for line in f]
+
+
+def test_journaled_check_out_without_check_in_is_rejected(employee_client, journal):
+    response = employee_client.post('/user/self-check', data={'action': 'out'})
+    assert response.status_code == 302
+    assert journaled_directions(journal) == []
+
+
+def test_journaled_check_in_twice_is_rejected(employee_client, journal, employees):
+    employee_client.post('/user/self-check', data={'action': 'in'})
+    employee_client.post('/user/self-check', data={'action': 'in'})
+    employee_client.post('/user/self-check', data={'action': 'out'})
+    assert journaled_directions(journal) == ['in', 'out']
+
+
+def test_ingested_punch_keeps_holiday_status(app, employees):
+    day = date(2026, 10, 2)
+    db.session.add(Attendance(employee_id=employees[0].id, date=day, status='holiday'))
+    db.session.add(Attendance(employee_id=employees[1].id, date=day, status='absent'))
+    db.session.commit()
+    ingest_punches([
+        {'event_id': f'e{employee.id}', 'employee_id': employee.id, 'direction': 'in',
+         'timestamp': datetime.combine(day, time(9, 0)).isoformat()}
+        for employee in employees
+    ])
+    statuses = dict(db.session.query(Attendance.employee_id, Attendance.status).filter(Attendance.date == day))
+    assert statuses == {employees[0].id: 'holiday', employees[1].id: 'present'}
@@ -0,0 +1,717 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from itertools import groupby
+from flask import current_app
+from sqlalchemy import and_, bindparam, case, exists, func, select, tuple_
+from audit import AuditSummary, record_bulk_audit
+from database import db
+from utils.db import chunked, upsert
+from utils.payroll_stale import mark_payroll_stale
+from utils.rollups import add_rollup_change, apply_rollup_changes, rebuild_rollups, record_rollup_change
+from models import Attendance, AttendanceDailyRollup, Check, Department, Employee, Holiday, Leave, Schedule, WorkingDayConfig
+
+
+# Statuses written by the generator; anything else was entered by a person
+PLACEHOLDER_STATUSES = ('absent', 'weekend', 'holiday', 'leave')
+# Placeholder statuses a check-in turns into 'present' (a holiday stays a holiday)
+CHECK_IN_PRESENT_FROM = ('absent', 'weekend', 'leave')
+
+
+def is_virtual_calendar():
+    """True when only real punches are stored and placeholder days are computed on read."""
+    return current_app.config.get('ATTENDANCE_MATERIALIZATION') == 'virtual'
+
+
+def daterange(start_date, end_date):
+    """Yield every date between start_date and end_date (inclusive)."""
+    current_date = start_date
+    while current_date <= end_date:
+        yield current_date
+        current_date += timedelta(days=1)
+
+
+class AttendanceCalendar:
+    """Holidays, working-week config and approved leaves for a date range.
+
+    Everything is loaded once up front so that the status of any
+    (employee, date) pair can be derived in memory without further queries.
+    """
+
+    def __init__(self, start_date, end_date, employee_ids=None):
+        self.start_date = start_date
+        self.end_date = end_date
+
+        self.holidays = {}
+        for holiday in Holiday.query.filter(Holiday.date.between(start_date, end_date)).all():
+            # Keep the first holiday found for a date, as generate_attendance did
+            self.holidays.setdefault(holiday.date, holiday.name)
+
+        self.working_days = {config.weekday: config.is_working_day for config in WorkingDayConfig.query.all()}
+
+        leave_query = db.session.query(Leave.employee_id, Leave.start_date, Leave.end_date, Leave.leave_type).filter(
+            Leave.status == 'approved',
+            Leave.start_date <= end_date,
+            Leave.end_date >= start_date
+        )
+        if employee_ids is not None:
+            leave_query = leave_query.filter(Leave.employee_id.in_(list(employee_ids)))
+
+        self.leaves = defaultdict(list)
+        for employee_id, leave_start, leave_end, leave_type in leave_query.all():
+            self.leaves[employee_id].append((leave_start, leave_end, leave_type))
+
+    def is_working_day(self, day):
+        weekday = day.weekday()  # 0=Monday, 6=Sunday
+        # Default: Mon-Fri (0-4) are working, Sat-Sun (5-6) are weekends
+        return self.working_days.get(weekday, weekday < 5)
+
+    def leave_for(self, employee_id, day):
+        """Return the (start, end, leave_type) of an approved leave covering day, if any."""
+        for leave in self.leaves.get(employee_id, ()):
+            if leave[0] <= day <= leave[1]:
+                return leave
+        return None
+
+    def day_status(self, day):
+        """Status and description of a date before leaves are taken into account."""
+        if day in self.holidays:
+            return 'holiday', self.holidays[day]
+        if not self.is_working_day(day):
+            return 'weekend', 'Weekend'
+        return 'absent', None  # Default to absent, will be updated when employee checks in
+
+    def status_for(self, employee_id, day):
+        """Status and description of a placeholder row for employee_id on day."""
+        status, description = self.day_status(day)
+        # Approved leave takes precedence over holidays and weekends
+        leave = self.leave_for(employee_id, day)
+        if leave:
+            return 'leave', f"{leave[2]} leave"
+        return status, description
+
+
+def generate_attendance_bulk(employee_ids, start_date, end_date, commit=True):
+    """Create the missing attendance rows for employee_ids between start_date and end_date.
+
+    Holidays, working days and leaves are loaded once, existing rows are
+    fetched with a single query and the missing rows are written in one
+    batched (executemany) insert. Returns the number of rows created.
+    """
+    employee_ids = sorted(set(int(employee_id) for employee_id in employee_ids))
+    if not employee_ids or start_date > end_date or is_virtual_calendar():
+        return 0
+
+    calendar = AttendanceCalendar(start_date, end_date, employee_ids)
+
+    existing = set(
+        (employee_id, day) for employee_id, day in db.session.query(Attendance.employee_id, Attendance.date).filter(
+            Attendance.employee_id.in_(employee_ids),
+            Attendance.date.between(start_date, end_date)
+        )
+    )
+
+    rows = []
+    for day in daterange(start_date, end_date):
+        for employee_id in employee_ids:
+            if (employee_id, day) in existing:
+                continue
+            status, description = calendar.status_for(employee_id, day)
+            rows.append({
+                'employee_id': employee_id,
+                'date': day,
+                'status': status,
+                'description': description
+            })
+
+    # Rows created concurrently by another worker are skipped by the unique (employee_id, date) index
+    created = upsert(Attendance.__table__, rows, ['employee_id', 'date'])
+    rowcount_known = created >= 0
+    if not rowcount_known:
+        # The driver did not report a rowcount; count what the range holds now
+        created = db.session.query(func.count(Attendance.id)).filter(
+            Attendance.employee_id.in_(employee_ids),
+            Attendance.date.between(start_date, end_date)
+        ).scalar() - len(existing)
+    record_bulk_audit('Attendance', 'CREATE', created)
+    if rowcount_known and created == len(rows):
+        changes = defaultdict(lambda: [0, 0, 0])
+        for row in rows:
+            changes[(row['employee_id'], row['date'], row['status'])][0] += 1
+        apply_rollup_changes(changes)
+    elif rows:
+        # Some rows already existed after all (or the count is uncertain); recount the range instead of guessing
+        rebuild_rollups(start_date=start_date, end_date=end_date, commit=False)
+    if commit:
+        db.session.commit()
+    return created
+
+
+def active_employee_ids():
+    return [employee_id for (employee_id,) in db.session.query(Employee.id).filter_by(status='active')]
+
+
+@AuditSummary('materialize-attendance')
+def materialize_attendance(start_date, end_date, employee_ids=None):
+    """Pre-create attendance rows for the given (default: active) employees."""
+    if employee_ids is None:
+        employee_ids = active_employee_ids()
+    return generate_attendance_bulk(employee_ids, start_date, end_date)
+
+
+def ensure_attendance(start_date, end_date, employee_ids=None):
+    """Read-path fallback: only run the bulk generator when rows are actually missing.
+
+    A single COUNT decides whether the range is fully materialized, so a
+    dashboard GET does no writes once the background job has run. Does
+    nothing when ATTENDANCE_MATERIALIZATION is 'background' or 'virtual'.
+    """
+    if current_app.config.get('ATTENDANCE_MATERIALIZATION') in ('background', 'virtual'):
+        return 0
+
+    if employee_ids is None:
+        employee_ids = active_employee_ids()
+    employee_ids = set(int(employee_id) for employee_id in employee_ids)
+    if not employee_ids or start_date > end_date:
+        return 0
+
+    expected = len(employee_ids) * ((end_date - start_date).days + 1)
+    existing = db.session.query(db.func.count(Attendance.id)).filter(
+        Attendance.employee_id.in_(employee_ids),
+        Attendance.date.between(start_date, end_date)
+    ).scalar()
+    if existing >= expected:
+        return 0
+    return generate_attendance_bulk(employee_ids, start_date, end_date)
+
+
+def empty_attendance_stats():
+    return {
+        'present': 0,
+        'absent': 0,
+        'late': 0,
+        'early_out': 0,
+        'leave': 0,
+        'holiday': 0,
+        'working_hours': timedelta(),
+        'attendance_percentage': 0
+    }
+
+
+def add_attendance_to_stats(emp_stats, attendance):
+    """Count one attendance record (row, VirtualAttendance or result row) into emp_stats."""
+    if attendance.status == 'present':
+        emp_stats['present'] += 1
+
+        # Punctuality is classified when the punch is recorded (Attendance.classify)
+        emp_stats['working_hours'] += timedelta(minutes=attendance.worked_minutes or 0)
+        if attendance.late_minutes:
+            emp_stats['late'] += 1
+        if attendance.early_out_minutes:
+            emp_stats['early_out'] += 1
+    elif attendance.status == 'absent':
+        emp_stats['absent'] += 1
+    elif attendance.status == 'leave':
+        emp_stats['leave'] += 1
+    elif attendance.status == 'holiday':
+        emp_stats['holiday'] += 1
+
+    # Calculate attendance percentage (Present / (Present + Absent))
+    # Usually leaves and holidays don't count against attendance rate
+    total_relevant_days = emp_stats['present'] + emp_stats['absent']
+    if total_relevant_days > 0:
+        emp_stats['attendance_percentage'] = (emp_stats['present'] / total_relevant_days) * 100
+
+
+class VirtualAttendance:
+    """An unsaved, read-only stand-in for an Attendance placeholder row."""
+
+    id = None
+    time_in = None
+    time_out = None
+    late_minutes = 0
+    early_out_minutes = 0
+    worked_minutes = 0
+
+    def __init__(self, employee_id, day, status, description, employee=None):
+        self.employee = employee
+        self.employee_id = employee_id
+        self.date = day
+        self.status = status
+        self.description = description
+
+
+def load_attendance(start_date, end_date, employee_ids=None):
+    """Attendance records between start_date and end_date, ordered by employee and date.
+
+    In 'virtual' mode the stored punches are merged in memory with a computed
+    calendar, so days without a punch come back as VirtualAttendance records
+    (absent / weekend / holiday / leave). Otherwise the stored rows are
+    returned as-is.
+    """
+    query = Attendance.query.filter(Attendance.date.between(start_date, end_date))
+    if employee_ids is not None:
+        employee_ids = set(int(employee_id) for employee_id in employee_ids)
+        query = query.filter(Attendance.employee_id.in_(employee_ids))
+    records = query.order_by(Attendance.employee_id, Attendance.date).all()
+
+    if not is_virtual_calendar():
+        return records
+
+    if employee_ids is None:
+        employee_ids = set(active_employee_ids())
+    employees = Employee.query.filter(Employee.id.in_(employee_ids)).all() if employee_ids else []
+    calendar = AttendanceCalendar(start_date, end_date, employee_ids)
+
+    punched = set((record.employee_id, record.date) for record in records)
+    for employee in employees:
+        for day in daterange(start_date, end_date):
+            if (employee.id, day) not in punched:
+                status, description = calendar.status_for(employee.id, day)
+                records.append(VirtualAttendance(employee.id, day, status, description, employee))
+
+    records.sort(key=lambda record: (record.employee_id, record.date))
+    return records
+
+
+@AuditSummary('rederive-attendance')
+def rederive_attendance(dates, employee_ids=None, commit=True):
+    """Recompute status/description of the existing non-punched rows on the given dates.
+
+    Used when a holiday, an approved leave or the working week changes.
+    Rows with a check-in or a manually entered status are left alone. Dates
+    sharing the same calendar status are updated with one UPDATE for all
+    employees, and rows covered by an approved leave with one more.
+    Returns the number of rows updated.
+    """
+    dates = sorted(set(dates))
+    if not dates:
+        return 0
+    # Working days / unpaid days changed for these months, in every materialization mode
+    if employee_ids is not None:
+        mark_payroll_stale(employee_days=[(employee_id, day) for employee_id in employee_ids for day in dates])
+    else:
+        mark_payroll_stale(days=dates)
+    if is_virtual_calendar():
+        return 0
+
+    calendar = AttendanceCalendar(dates[0], dates[-1], employee_ids=())
+    table = Attendance.__table__
+
+    covering_leave = and_(
+        Leave.employee_id == table.c.employee_id,
+        Leave.status == 'approved',
+        Leave.start_date <= table.c.date,
+        Leave.end_date >= table.c.date
+    )
+    scope = [table.c.time_in.is_(None), table.c.status.in_(PLACEHOLDER_STATUSES)]
+    if employee_ids is not None:
+        scope.append(table.c.employee_id.in_([int(employee_id) for employee_id in employee_ids]))
+
+    dates_by_status = defaultdict(list)
+    for day in dates:
+        dates_by_status[calendar.day_status(day)].append(day)
+
+    updated = 0
+    for (status, description), status_dates in dates_by_status.items():
+        result = db.session.execute(
+            table.update()
+            .where(table.c.date.in_(status_dates), ~exists().where(covering_leave), *scope)
+            .values(status=status, description=description)
+        )
+        updated += result.rowcount
+
+    leave_type = select(Leave.leave_type).where(covering_leave).limit(1).scalar_subquery()
+    result = db.session.execute(
+        table.update()
+        .where(table.c.date.in_(dates), exists().where(covering_leave), *scope)
+        .values(status='leave', description=leave_type + ' leave')
+    )
+    updated += result.rowcount
+    record_bulk_audit('Attendance', 'UPDATE', updated)
+
+    rebuild_rollups(dates, commit=False)
+    if commit:
+        db.session.commit()
+    return updated
+
+
+def upsert_check_in(employee_id, day, time_in, present_from=()):
+    """Record a check-in with a single dialect-aware upsert and return the Attendance row.
+
+    A new row is created as 'present'; an existing one gets the new time_in
+    and switches to 'present' only if its status is in present_from.
+    """
+    table = Attendance.__table__
+    previous = db.session.execute(
+        select(Attendance.date, Attendance.status, Attendance.late_minutes)
+        .where(Attendance.employee_id == int(employee_id), Attendance.date == day)
+    ).first()
+    upsert(table, [{
+        'employee_id': int(employee_id),
+        'date': day,
+        'time_in': time_in,
+        'status': 'present'
+    }], ['employee_id', 'date'], update=lambda new: {
+        'time_in': new.time_in,
+        'status': case((table.c.status.in_(present_from), 'present'), else_=table.c.status) if present_from else table.c.status,
+        'updated_at': datetime.utcnow()
+    })
+    attendance = Attendance.query.filter_by(employee_id=employee_id, date=day).populate_existing().first()
+    record_rollup_change(db.session, employee_id, old=tuple(previous) if previous else None,
+                         new=(attendance.date, attendance.status, attendance.late_minutes))
+    return attendance
+
+
+def classify_attendance(attendance, worked_minutes=None):
+    """Store late / early-out / worked minutes on a row after one of its punches changed."""
+    schedule = Schedule.query.join(Employee, Employee.schedule_id == Schedule.id).filter(
+        Employee.id == attendance.employee_id
+    ).first()
+    attendance.classify(schedule, worked_minutes=worked_minutes)
+
+
+def punch_from_check(time_in, time_out):
+    """(time, direction) for a checks row; 'in' punches store time_in, 'out' punches time_out."""
+    return (time_in, 'in') if time_in is not None else (time_out, 'out')
+
+
+def summarize_punches(punches):
+    """Return (first_in, last_out, worked_minutes) for (time, direction) punches sorted by time.
+
+    Single pass: an 'in' opens a session (repeated 'in's keep the earliest)
+    and an 'out' closes the open one, so breaks between sessions are not
+    counted. worked_minutes is None when there is no complete in/out pair.
+    """
+    first_in = last_out = opened = None
+    worked_seconds = 0
+    paired = False
+    for at, direction in punches:
+        if direction == 'in':
+            if first_in is None:
+                first_in = at
+            if opened is None:
+                opened = at
+        else:
+            last_out = at
+            if opened is not None:
+                session = datetime.combine(datetime.min, at) - datetime.combine(datetime.min, opened)
+                worked_seconds += max(0, int(session.total_seconds()))
+                opened = None
+                paired = True
+    return first_in, last_out, (worked_seconds // 60 if paired else None)
+
+
+def check_ordering():
+    return (Check.employee_id, Check.date, func.coalesce(Check.time_in, Check.time_out), Check.id)
+
+
+def last_punch_direction(employee_id, day):
+    """'in' or 'out' for the employee's latest punch of the day, None when there is none."""
+    punch = db.session.execute(
+        select(Check.time_in, Check.time_out)
+        .where(Check.employee_id == int(employee_id), Check.date == day)
+        .order_by(func.coalesce(Check.time_in, Check.time_out).desc(), Check.id.desc())
+        .limit(1)
+    ).first()
+    if punch is not None:
+        return punch_from_check(punch.time_in, punch.time_out)[1]
+    # Days that predate the checks log only have the stored times
+    attendance = db.session.execute(
+        select(Attendance.time_in, Attendance.time_out)
+        .where(Attendance.employee_id == int(employee_id), Attendance.date == day)
+    ).first()
+    if attendance is None or attendance.time_in is None:
+        return None
+    return 'out' if attendance.time_out is not None else 'in'
+
+
+def punch_error(employee_id, day, direction, last_direction=None):
+    """Why a self check-in / check-out cannot be recorded, or None when it can.
+
+    last_direction, when given, is a newer punch than the stored ones (a
+    journaled punch that has not been flushed yet).
+    """
+    last_direction = last_direction or last_punch_direction(employee_id, day)
+    if direction == 'out' and last_direction is None:
+        return 'Cannot check out without checking in first.'
+    if direction == 'in' and last_direction == 'in':
+        return 'You are already checked in.'
+    return None
+
+
+def record_punch(employee_id, day, at, direction, present_from=()):
+    """Append a punch to the checks log and re-derive that day's Attendance summary.
+
+    An 'in' punch creates the row if needed (see upsert_check_in); an 'out'
+    punch needs an existing row and returns None without logging otherwise.
+    Days that predate the log keep their stored time_in / time_out until a
+    punch of the same direction arrives.
+    """
+    if direction == 'in':
+        attendance = upsert_check_in(employee_id, day, at, present_from=present_from)
+    else:
+        attendance = Attendance.query.filter_by(employee_id=employee_id, date=day).first()
+        if attendance is None:
+            return None
+
+    db.session.add(Check(
+        employee_id=int(employee_id),
+        date=day,
+        time_in=at if direction == 'in' else None,
+        time_out=at if direction == 'out' else None
+    ))
+    punches = db.session.query(Check.time_in, Check.time_out).filter(
+        Check.employee_id == int(employee_id), Check.date == day
+    ).order_by(*check_ordering())
+    first_in, last_out, worked_minutes = summarize_punches(
+        punch_from_check(time_in, time_out) for time_in, time_out in punches
+    )
+    if first_in is not None:
+        attendance.time_in = first_in
+    if last_out is not None:
+        attendance.time_out = last_out
+    classify_attendance(attendance, worked_minutes=worked_minutes)
+    return attendance
+
+
+def replace_punches(attendance, previous_date=None):
+    """Rewrite the checks log of a manually edited row to its time_in / time_out.
+
+    Punches and `flask backfill-punctuality` re-derive the row from the log,
+    so a correction stored only on the row would be overwritten by the next
+    punch. The day's punches (and those of previous_date when the edit moved
+    the row) are replaced by one in / out pair.
+    """
+    days = {attendance.date, previous_date or attendance.date}
+    Check.query.filter(
+        Check.employee_id == int(attendance.employee_id), Check.date.in_(days)
+    ).delete(synchronize_session=False)
+    if attendance.time_in is not None:
+        db.session.add(Check(employee_id=int(attendance.employee_id), date=attendance.date, time_in=attendance.time_in))
+    if attendance.time_out is not None:
+        db.session.add(Check(employee_id=int(attendance.employee_id), date=attendance.date, time_out=attendance.time_out))
+
+
+def derive_from_punch_log(keys, previous=None):
+    """Re-derive the Attendance summary of (employee_id, date) keys from their checks.
+
+    Per chunk of keys the punches, attendance rows and schedules are loaded
+    with one query each, every day is summarised in one pass over its sorted
+    punches and the rows are written back with a single executemany.
+    Rollup deltas are measured against `previous`
+    ({key: (date, status, late_minutes)}) when given, otherwise against the
+    rows as read. Returns the number of rows updated.
+    """
+    table = Attendance.__table__
+    update = table.update().where(table.c.id == bindparam('row_id')).values(
+        time_in=bindparam('time_in'),
+        time_out=bindparam('time_out'),
+        late_minutes=bindparam('late_minutes'),
+        early_out_minutes=bindparam('early_out_minutes'),
+        worked_minutes=bindparam('worked_minutes')
+    )
+    schedules = {}
+    changes = defaultdict(lambda: [0, 0, 0])
+    updated = 0
+    for chunk in chunked(keys):
+        punches = defaultdict(list)
+        for employee_id, day, time_in, time_out in db.session.execute(
+            select(Check.employee_id, Check.date, Check.time_in, Check.time_out)
+            .where(tuple_(Check.employee_id, Check.date).in_(chunk))
+            .order_by(*check_ordering())
+        ):
+            punches[(employee_id, day)].append(punch_from_check(time_in, time_out))
+
+        rows = db.session.execute(
+            select(table.c.id, table.c.employee_id, table.c.date, table.c.time_in, table.c.time_out,
+                   table.c.status, table.c.late_minutes, Employee.schedule_id)
+            .join(Employee, Employee.id == table.c.employee_id)
+            .where(tuple_(table.c.employee_id, table.c.date).in_(chunk))
+        ).all()
+        missing = set(row.schedule_id for row in rows if row.schedule_id) - set(schedules)
+        if missing:
+            schedules.update((schedule.id, schedule) for schedule in Schedule.query.filter(Schedule.id.in_(missing)))
+
+        updates = []
+        for row in rows:
+            key = (row.employee_id, row.date)
+            first_in, last_out, worked_minutes = summarize_punches(punches.get(key, ()))
+            attendance = Attendance(
+                date=row.date,
+                time_in=first_in if first_in is not None else row.time_in,
+                time_out=last_out if last_out is not None else row.time_out
+            )
+            attendance.classify(schedules.get(row.schedule_id), worked_minutes=worked_minutes)
+            updates.append({
+                'row_id': row.id,
+                'time_in': attendance.time_in,
+                'time_out': attendance.time_out,
+                'late_minutes': attendance.late_minutes,
+                'early_out_minutes': attendance.early_out_minutes,
+                'worked_minutes': attendance.worked_minutes
+            })
+            old = previous.get(key) if previous is not None else (row.date, row.status, row.late_minutes)
+            add_rollup_change(changes, row.employee_id, old=old, new=(row.date, row.status, attendance.late_minutes))
+        if updates:
+            db.session.execute(update, updates)
+        updated += len(updates)
+
+    apply_rollup_changes(changes)
+    return updated
+
+
+def late_clause():
+    """SQL condition that is true for check-ins classified as late (see Attendance.classify)."""
+    return Attendance.late_minutes > 0
+
+
+def _unscheduled_present(start_date, end_date):
+    """{(date, department_id): n} of check-ins by employees without a schedule.
+
+    Their rows carry late_minutes = 0, so the rollups count them as present
+    but not late; they are neither on time nor late.
+    """
+    rows = db.session.query(
+        Attendance.date, Employee.department_id, func.count(Attendance.id)
+    ).join(Employee, Employee.id == Attendance.employee_id).filter(
+        Employee.schedule_id.is_(None),
+        Attendance.date.between(start_date, end_date),
+        Attendance.status == 'present'
+    ).group_by(Attendance.date, Employee.department_id).all()
+    return {(day, department_id): count for day, department_id, count in rows}
+
+
+def daily_punctuality(start_date, end_date):
+    """Return {date: {'on_time': n, 'late': n, 'unscheduled': n}} for check-ins, read from the daily rollups.
+
+    Check-ins of employees without a schedule are counted as 'unscheduled'
+    only. Check-ins are stored in every materialization mode, so the
+    rollups are complete for this even when ATTENDANCE_MATERIALIZATION=virtual.
+    """
+    rows = db.session.query(
+        AttendanceDailyRollup.date,
+        func.sum(AttendanceDailyRollup.count),
+        func.sum(AttendanceDailyRollup.late_count)
+    ).filter(
+        AttendanceDailyRollup.date.between(start_date, end_date),
+        AttendanceDailyRollup.status == 'present'
+    ).group_by(AttendanceDailyRollup.date).all()
+
+    unscheduled = defaultdict(int)
+    for (day, department_id), count in _unscheduled_present(start_date, end_date).items():
+        unscheduled[day] += count
+
+    stats = defaultdict(lambda: {'on_time': 0, 'late': 0, 'unscheduled': 0})
+    for day, present, late in rows:
+        stats[day] = {
+            'on_time': int(present or 0) - int(late or 0) - unscheduled[day],
+            'late': int(late or 0),
+            'unscheduled': unscheduled[day]
+        }
+    return stats
+
+
+def department_day_stats(day):
+    """Per-department headcount and on-time / late / unscheduled / leave counts for one date.
+
+    Counts come from the daily rollups; check-ins of employees without a
+    schedule are reported as 'unscheduled' rather than on time. Leave days
+    are not stored in virtual mode, so they are counted from approved
+    leaves instead. Returns a list of dicts ordered like Department.query.all().
+    """
+    totals = dict(db.session.query(Employee.department_id, func.count(Employee.id)).group_by(Employee.department_id).all())
+
+    counts = {}
+    for department_id, status, count, late in db.session.query(
+        AttendanceDailyRollup.department_id,
+        AttendanceDailyRollup.status,
+        AttendanceDailyRollup.count,
+        AttendanceDailyRollup.late_count
+    ).filter(
+        AttendanceDailyRollup.date == day,
+        AttendanceDailyRollup.status.in_(['present', 'leave'])
+    ).all():
+        dept_counts = counts.setdefault(department_id, [0, 0, 0, 0])
+        if status == 'present':
+            dept_counts[0] += count - late
+            dept_counts[1] += late
+        else:
+            dept_counts[3] += count
+
+    for (_, department_id), count in _unscheduled_present(day, day).items():
+        dept_counts = counts.setdefault(department_id, [0, 0, 0, 0])
+        dept_counts[0] -= count
+        dept_counts[2] += count
+
+    if is_virtual_calendar():
+        # Leave days are not stored in virtual mode; count approved leaves without a punch
+        for department_id, on_leave in db.session.query(
+            Employee.department_id, func.count(func.distinct(Leave.employee_id))
+        ).join(Employee, Employee.id == Leave.employee_id).filter(
+            Employee.status == 'active',
+            Leave.status == 'approved',
+            Leave.start_date <= day,
+            Leave.end_date >= day,
+            ~exists().where(Attendance.employee_id == Leave.employee_id, Attendance.date == day)
+        ).group_by(Employee.department_id).all():
+            counts.setdefault(department_id, [0, 0, 0, 0])[3] += on_leave
+
+    dept_stats = []
+    for dept in Department.query.all():
+        on_time, late, unscheduled, leave = counts.get(dept.id, (0, 0, 0, 0))
+        dept_stats.append({
+            'name': dept.name,
+            'total': totals.get(dept.id, 0),
+            'on_time': on_time,
+            'late': late,
+            'unscheduled': unscheduled,
+            'leave': leave
+        })
+    return dept_stats
+
+
+def iter_attendance_summaries(start_date, end_date, employee_id=None, batch_size=1000):
+    """Stream (employee, stats) pairs for every active employee over an arbitrary date range.
+
+    One outer-joined query ordered by employee is read through a
+    server-side cursor (yield_per) and folded one employee at a time, so
+    memory stays flat regardless of headcount. In virtual mode the days
+    without a stored row are filled in from the calendar.
+    """
+    stmt = select(
+        Employee.id.label('employee_id'),
+        Employee.unique_id,
+        Employee.firstname,
+        Employee.lastname,
+        Department.name.label('department'),
+        Attendance.date,
+        Attendance.status,
+        Attendance.worked_minutes,
+        Attendance.late_minutes,
+        Attendance.early_out_minutes
+    ).outerjoin(Department, Department.id == Employee.department_id).outerjoin(
+        Attendance, and_(Attendance.employee_id == Employee.id, Attendance.date.between(start_date, end_date))
+    ).order_by(Employee.id, Attendance.date)
+    if employee_id:
+        stmt = stmt.where(Employee.id == int(employee_id))
+    else:
+        stmt = stmt.where(Employee.status == 'active')
+
+    calendar = AttendanceCalendar(start_date, end_date) if is_virtual_calendar() else None
+
+    rows = db.session.execute(stmt.execution_options(yield_per=batch_size))
+    for _, employee_rows in groupby(rows, key=lambda row: row.employee_id):
+        employee_rows = list(employee_rows)
+        employee = employee_rows[0]
+        emp_stats = empty_attendance_stats()
+        stored_dates = set()
+        for row in employee_rows:
+            if row.date is not None:
+                stored_dates.add(row.date)
+                add_attendance_to_stats(emp_stats, row)
+        if calendar:
+            for day in daterange(start_date, end_date):
+                if day not in stored_dates:
+                    status, description = calendar.status_for(employee.employee_id, day)
+                    add_attendance_to_stats(emp_stats, VirtualAttendance(employee.employee_id, day, status, description))
+        yield employee, emp_stats
@@ -0,0 +1,201 @@
+import glob
+import gzip
+import json
+import os
+import re
+from datetime import date, datetime
+from flask import current_app
+from sqlalchemy import func, select, text
+from database import db
+from audit import AuditJSONEncoder, decode_audit_data
+from models import AuditLog
+
+# Rows read per batch while archiving a month
+ARCHIVE_BATCH_SIZE = 5000
+
+ARCHIVE_NAME = re.compile(r'audit-(\d{4})-(\d{2})(?:-\d+)?\.ndjson\.gz$')
+
+
+def month_start(day, offset=0):
+    """First day of the month `offset` months after day's month."""
+    months = day.year * 12 + day.month - 1 + offset
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def partition_name(start):
+    return f'audit_logs_y{start.year}m{start.month:02d}'
+
+
+def is_partitioned():
+    """True when audit_logs is a native PostgreSQL partitioned table (see the add_audit_log_partitions migration)."""
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    return db.session.execute(text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'audit_logs'::regclass"
+    )).first() is not None
+
+
+def ensure_partitions(months_ahead=2, today=None):
+    """Create the monthly partitions from this month to months_ahead; no-op unless partitioned.
+
+    Must run before a month starts: rows of a month without its partition
+    land in audit_logs_default, and that month's partition can then only be
+    created after those rows are archived.
+    """
+    if not is_partitioned():
+        return []
+    created = []
+    first = month_start(today or date.today())
+    for offset in range(months_ahead + 1):
+        start = month_start(first, offset)
+        name = partition_name(start)
+        if db.session.execute(text('SELECT to_regclass(:name)'), {'name': name}).scalar() is None:
+            db.session.execute(text(
+                f"CREATE TABLE {name} PARTITION OF audit_logs "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{month_start(start, 1).isoformat()}')"
+            ))
+            created.append(name)
+    db.session.commit()
+    return created
+
+
+def archive_directory():
+    directory = current_app.config.get('AUDIT_ARCHIVE_DIR') or os.path.join(current_app.instance_path, 'audit-archive')
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def _archive_path(directory, start):
+    base = os.path.join(directory, f'audit-{start.year}-{start.month:02d}')
+    path = f'{base}.ndjson.gz'
+    part = 1
+    # A month archived in several runs (late rows) gets numbered files instead of being overwritten
+    while os.path.exists(path):
+        part += 1
+        path = f'{base}-{part}.ndjson.gz'
+    return path
+
+
+def _record(row):
+    return {
+        'id': row.id,
+        'actor_id': row.actor_id,
+        'action': row.action,
+        'model': row.model,
+        'record_id': row.record_id,
+        'old_data': decode_audit_data(row.old_data) if row.old_data else None,
+        'new_data': decode_audit_data(row.new_data) if row.new_data else None,
+        'ip_address': row.ip_address,
+        'created_at': row.created_at
+    }
+
+
+def archive_month(start, directory):
+    """Write one month of audit rows to a gzipped NDJSON file, then remove them. Returns the row count.
+
+    The file is written under a temporary name and renamed once complete,
+    so rows are only deleted after their archive is safely on disk.
+    """
+    end = month_start(start, 1)
+    table = AuditLog.__table__
+    in_month = (table.c.created_at >= start, table.c.created_at < end)
+    path = _archive_path(directory, start)
+    tmp_path = f'{path}.tmp'
+    archived = 0
+    last_id = 0
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        while True:
+            rows = db.session.execute(
+                select(table).where(*in_month, table.c.id > last_id).order_by(table.c.id).limit(ARCHIVE_BATCH_SIZE)
+            ).all()
+            if not rows:
+                break
+            for row in rows:
+                f.write(json.dumps(_record(row), cls=AuditJSONEncoder, separators=(',', ':')) + '\n')
+            archived += len(rows)
+            last_id = rows[-1].id
+    if not archived:
+        os.remove(tmp_path)
+        return 0
+    os.replace(tmp_path, path)
+
+    name = partition_name(start)
+    if is_partitioned() and db.session.execute(text('SELECT to_regclass(:name)'), {'name': name}).scalar():
+        db.session.execute(text(f'DROP TABLE {name}'))
+        # Rows of the month that fell into the default partition
+        db.session.execute(table.delete().where(*in_month))
+    else:
+        db.session.execute(table.delete().where(*in_month, table.c.id <= last_id))
+    db.session.commit()
+    return archived
+
+
+def archive_audit_logs(keep_months=None, today=None):
+    """Archive every month older than the last keep_months months. Returns {'YYYY-MM': rows}."""
+    keep_months = keep_months or current_app.config.get('AUDIT_RETENTION_MONTHS', 12)
+    cutoff = month_start(today or date.today(), -keep_months)
+    oldest = db.session.execute(select(func.min(AuditLog.created_at)).where(AuditLog.created_at < cutoff)).scalar()
+    archived = {}
+    if oldest is None:
+        return archived
+    directory = archive_directory()
+    start = month_start(oldest)
+    while start < cutoff:
+        count = archive_month(start, directory)
+        if count:
+            archived[start.strftime('%Y-%m')] = count
+        start = month_start(start, 1)
+    return archived
+
+
+def search_audit_archive(model=None, action=None, actor_id=None, record_id=None, start_date=None, end_date=None,
+                         text_query=None, limit=200):
+    """Scan the archive files (newest month first) for matching entries; slow but needs no database.
+
+    Only files whose month overlaps start_date..end_date are opened.
+    Returns up to limit records as dicts with created_at parsed back to a
+    datetime and old_data / new_data decoded.
+    """
+    directory = current_app.config.get('AUDIT_ARCHIVE_DIR') or os.path.join(current_app.instance_path, 'audit-archive')
+    files = []
+    for path in glob.glob(os.path.join(directory, 'audit-*.ndjson.gz')):
+        match = ARCHIVE_NAME.search(os.path.basename(path))
+        if not match:
+            continue
+        start = date(int(match.group(1)), int(match.group(2)), 1)
+        if (start_date and month_start(start, 1) <= start_date) or (end_date and start > end_date):
+            continue
+        files.append((start, path))
+
+    text_query = (text_query or '').lower()
+    results = []
+    for start, path in sorted(files, reverse=True):
+        matches = []
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if text_query and text_query not in line.lower():
+                    continue
+                record = json.loads(line)
+                # The raw line also holds the field names of the record itself
+                if text_query and text_query not in json.dumps(
+                    [record['model'], record['ip_address'], record['old_data'], record['new_data']], ensure_ascii=False
+                ).lower():
+                    continue
+                if model and record['model'] != model:
+                    continue
+                if action and (record['action'] or '').lower() != action.lower():
+                    continue
+                if actor_id and record['actor_id'] != actor_id:
+                    continue
+                if record_id and record['record_id'] != record_id:
+                    continue
+                record['created_at'] = datetime.fromisoformat(record['created_at']) if record['created_at'] else None
+                day = record['created_at'].date() if record['created_at'] else None
+                if day and ((start_date and day < start_date) or (end_date and day > end_date)):
+                    continue
+                matches.append(record)
+        matches.sort(key=lambda record: (record['created_at'] or datetime.min, record['id']), reverse=True)
+        results.extend(matches[:limit - len(results)])
+        if len(results) >= limit:
+            break
+    return results
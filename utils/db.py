@@ -0,0 +1,52 @@
+from database import db
+
+# Keeps IN lists well below the bind-parameter limits of every backend
+QUERY_CHUNK_SIZE = 500
+
+
+def chunked(items, size=QUERY_CHUNK_SIZE):
+    """Split items into lists of at most size elements."""
+    items = list(items)
+    for index in range(0, len(items), size):
+        yield items[index:index + size]
+
+
+def upsert(table, rows, index_elements, update=None, connection=None):
+    """INSERT rows into table, resolving conflicts on index_elements in the database.
+
+    `update` is a callable receiving the proposed row (``excluded`` on
+    PostgreSQL/SQLite, ``inserted`` on MySQL) and returning the columns to
+    set on conflict; without it conflicting rows are skipped. Uses
+    INSERT ... ON CONFLICT or INSERT ... ON DUPLICATE KEY UPDATE depending
+    on the dialect, so concurrent workers cannot create duplicates. Pass
+    `connection` to execute outside the session (e.g. inside flush events).
+
+    All rows are sent with a single executemany call. Returns the driver's
+    rowcount: the number of rows written, or -1 if the driver does not
+    report it.
+    """
+    if not rows:
+        return 0
+
+    execute = connection.execute if connection is not None else db.session.execute
+    dialect = (connection if connection is not None else db.session.get_bind()).dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect in ('mysql', 'mariadb'):
+        from sqlalchemy.dialects.mysql import insert
+    else:
+        return execute(table.insert(), rows).rowcount
+
+    stmt = insert(table)
+    if dialect in ('mysql', 'mariadb'):
+        # MySQL has no DO NOTHING; assigning the primary key to itself is the usual no-op
+        values = update(stmt.inserted) if update else {'id': table.c.id}
+        stmt = stmt.on_duplicate_key_update(values)
+    elif update:
+        stmt = stmt.on_conflict_do_update(index_elements=index_elements, set_=update(stmt.excluded))
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=index_elements)
+
+    return execute(stmt, rows).rowcount
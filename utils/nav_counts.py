@@ -0,0 +1,136 @@
+import threading
+import time
+from types import SimpleNamespace
+from flask import current_app, g, has_app_context
+from sqlalchemy import event, func, inspect, select
+from database import db
+from models import Leave, Notification
+
+# session.info key holding the cache keys touched by the current transaction
+PENDING_KEY = 'nav_counts_pending'
+# flask.g attribute memoizing nav_context for the current request
+G_KEY = '_nav_context'
+# Cache key of the pending-leave count, shared by every HR / superadmin user
+PENDING_LEAVES = 'pending_leaves'
+RECENT_LIMIT = 5
+
+# key -> (expires_at, value); keys are PENDING_LEAVES or ('user', user_id)
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _user_key(user_id):
+    return ('user', user_id)
+
+
+def _cached(key, compute):
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache.get(key)
+    if cached and cached[0] > now:
+        return cached[1]
+    value = compute()
+    with _cache_lock:
+        _cache[key] = (now + current_app.config.get('NAV_CACHE_TTL', 30), value)
+    return value
+
+
+def _user_notifications(user_id):
+    unread = db.session.execute(
+        select(func.count(Notification.id)).where(Notification.user_id == user_id, Notification.is_read.is_(False))
+    ).scalar()
+    # Plain copies: ORM instances must not outlive the request's session
+    recent = [SimpleNamespace(id=row.id, message=row.message, type=row.type, is_read=row.is_read,
+                              created_at=row.created_at)
+              for row in db.session.execute(
+                  select(Notification.id, Notification.message, Notification.type, Notification.is_read,
+                         Notification.created_at)
+                  .where(Notification.user_id == user_id)
+                  .order_by(Notification.created_at.desc())
+                  .limit(RECENT_LIMIT)
+              )]
+    return {'unread': unread, 'recent': recent}
+
+
+def _pending_leaves():
+    return db.session.execute(select(func.count(Leave.id)).where(Leave.status == 'pending')).scalar()
+
+
+def nav_context(user):
+    """Header counts of user: pending leaves (HR / superadmin only), unread count and latest notifications.
+
+    Memoized on flask.g for the rest of the request and cached per user for
+    NAV_CACHE_TTL seconds. Entries are dropped when a transaction that
+    creates or reads one of the user's notifications (or changes a leave's
+    status) commits; the TTL bounds what other worker processes can miss.
+    """
+    memo = g.get(G_KEY)
+    if memo is not None and memo[0] == user.id:
+        return memo[1]
+    notifications = _cached(_user_key(user.id), lambda: _user_notifications(user.id))
+    context = {
+        'pending_leaves': 0,
+        'unread_notifications_count': notifications['unread'],
+        'recent_notifications': notifications['recent']
+    }
+    if getattr(user, 'role', None) and user.role.name in ['superadmin', 'hr']:
+        context['pending_leaves'] = _cached(PENDING_LEAVES, _pending_leaves)
+    setattr(g, G_KEY, (user.id, context))
+    return context
+
+
+def invalidate_nav_counts(session, user_ids=(), pending_leaves=False):
+    """Drop the cached counts of user_ids (and the pending-leave count) once the session's transaction commits."""
+    keys = session.info.setdefault(PENDING_KEY, set())
+    keys.update(_user_key(user_id) for user_id in user_ids if user_id)
+    if pending_leaves:
+        keys.add(PENDING_LEAVES)
+
+
+def _committed_and_current(target, key):
+    history = inspect(target).attrs[key].history
+    return set(history.added or ()) | set(history.deleted or ()) | set(history.unchanged or ())
+
+
+def before_flush_listener(session, flush_context, instances):
+    user_ids = set()
+    pending_leaves = False
+    for target in list(session.new) + list(session.deleted):
+        if isinstance(target, Notification):
+            user_ids.add(target.user_id)
+        elif isinstance(target, Leave):
+            pending_leaves = True
+    for target in session.dirty:
+        if isinstance(target, Notification) and session.is_modified(target):
+            # Covers the old owner too when a notification is reassigned
+            user_ids.update(_committed_and_current(target, 'user_id'))
+        elif isinstance(target, Leave) and inspect(target).attrs.status.history.has_changes():
+            pending_leaves = True
+    if user_ids or pending_leaves:
+        invalidate_nav_counts(session, user_ids, pending_leaves)
+
+
+def after_commit_listener(session):
+    keys = session.info.pop(PENDING_KEY, None)
+    if keys:
+        with _cache_lock:
+            for key in keys:
+                _cache.pop(key, None)
+        if has_app_context():
+            # Later renders in this request see the change too
+            g.pop(G_KEY, None)
+
+
+def after_rollback_listener(session, previous_transaction):
+    session.info.pop(PENDING_KEY, None)
+
+
+def register_nav_counts_listeners():
+    """Invalidate cached header counts when notifications or leave statuses change.
+
+    ORM changes are picked up at flush; bulk writers (save_payroll) call
+    invalidate_nav_counts themselves.
+    """
+    event.listen(db.session, 'before_flush', before_flush_listener)
+    event.listen(db.session, 'after_commit', after_commit_listener)
+    event.listen(db.session, 'after_soft_rollback', after_rollback_listener)
@@ -0,0 +1,296 @@
+import calendar
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from sqlalchemy import bindparam, case, func, insert, select
+from flask import current_app
+from audit import AuditSummary, record_bulk_audit
+from database import db
+from utils.attendance import AttendanceCalendar, daterange, is_virtual_calendar
+from utils.db import chunked
+from utils.nav_counts import invalidate_nav_counts
+from utils.payroll_totals import invalidate_month_totals
+from models import (
+    Attendance, Employee, LateTime, Notification, OverTime, Payroll, Salary, User, month_number, payroll_period
+)
+
+MONTH_NAMES = list(calendar.month_name)[1:]
+CENT = Decimal('0.01')
+
+
+def to_decimal(value):
+    """Decimal from a DB value; SQLite hands SUM() of Numeric columns back as float."""
+    if value is None:
+        return Decimal('0')
+    if isinstance(value, Decimal):
+        return value
+    return Decimal(str(value))
+
+
+def money(value):
+    return value.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def month_bounds(month, year):
+    """First and last date of a payroll month given by name (e.g. 'October' or 'oct')."""
+    number = month_number(month)
+    return date(year, number, 1), date(year, number, calendar.monthrange(year, number)[1])
+
+
+def is_unpaid_leave(leave_type):
+    return 'unpaid' in (leave_type or '').lower()
+
+
+def _sum_by_employee(query):
+    return dict((employee_id, to_decimal(total)) for employee_id, total in db.session.execute(query))
+
+
+def compute_payroll(month, year, employee_ids=None, id_range=None, include_existing=False):
+    """Compute payslips for every active salaried employee without one for the month.
+
+    Salaries, existing payrolls, late deductions, overtime, absences and
+    unpaid leave are each loaded for the whole month with one grouped query
+    (plus the attendance calendar), then every payslip is computed in memory
+    with Decimal arithmetic. Unpaid days (absences up to yesterday and unpaid
+    leave on working days) are deducted pro rata from basic + allowances.
+
+    id_range limits the run to employee ids min..max (inclusive), which is
+    how parallel payroll runs shard the work. include_existing also computes
+    employees that already have a payroll for the month (recomputation).
+
+    Returns {'lines': [...], 'skipped': {'existing': n, 'no_salary': n}}.
+    """
+    start_date, end_date = month_bounds(month, year)
+
+    employee_query = select(
+        Employee.id, Employee.firstname, Employee.lastname, Employee.email, Employee.unique_id,
+        Salary.basic_salary, Salary.house_rent, Salary.medical, Salary.transport
+    ).outerjoin(Salary, Salary.employee_id == Employee.id).where(Employee.status == 'active')
+    if employee_ids is not None:
+        employee_query = employee_query.where(Employee.id.in_(list(employee_ids)))
+    if id_range is not None:
+        employee_query = employee_query.where(Employee.id.between(*id_range))
+    employees = db.session.execute(employee_query.order_by(Employee.id)).all()
+
+    existing = set(db.session.execute(
+        select(Payroll.employee_id).where(Payroll.period == payroll_period(month, year))
+    ).scalars())
+
+    skipped = {'existing': 0, 'no_salary': 0}
+    salaried = []
+    for employee in employees:
+        if employee.id in existing and not include_existing:
+            skipped['existing'] += 1
+        elif employee.basic_salary is None:
+            skipped['no_salary'] += 1
+        else:
+            salaried.append(employee)
+    if not salaried:
+        return {'lines': [], 'skipped': skipped}
+    ids = [employee.id for employee in salaried]
+
+    late_deductions = _sum_by_employee(
+        select(LateTime.employee_id, func.sum(LateTime.deduction))
+        .where(LateTime.employee_id.in_(ids), LateTime.date.between(start_date, end_date))
+        .group_by(LateTime.employee_id)
+    )
+    overtime = _sum_by_employee(
+        select(OverTime.employee_id, func.sum(case(
+            (OverTime.amount > 0, OverTime.amount), else_=OverTime.hours * OverTime.rate
+        )))
+        .where(OverTime.employee_id.in_(ids), OverTime.date.between(start_date, end_date))
+        .group_by(OverTime.employee_id)
+    )
+
+    month_calendar = AttendanceCalendar(start_date, end_date, ids)
+    working_days = [
+        day for day in daterange(start_date, end_date)
+        if month_calendar.is_working_day(day) and day not in month_calendar.holidays
+    ]
+    # Absences are only final for days that have passed; today can still get a check-in
+    absence_end = min(end_date, datetime.now().date() - timedelta(days=1))
+    absences = defaultdict(int)
+    if is_virtual_calendar():
+        stored = set(db.session.execute(
+            select(Attendance.employee_id, Attendance.date)
+            .where(Attendance.employee_id.in_(ids), Attendance.date.between(start_date, absence_end))
+        ).all())
+        for day in working_days:
+            if day > absence_end:
+                break
+            for employee_id in ids:
+                if (employee_id, day) not in stored and not month_calendar.leave_for(employee_id, day):
+                    absences[employee_id] += 1
+    else:
+        absences.update(db.session.execute(
+            select(Attendance.employee_id, func.count(Attendance.id))
+            .where(Attendance.employee_id.in_(ids), Attendance.date.between(start_date, absence_end),
+                   Attendance.status == 'absent')
+            .group_by(Attendance.employee_id)
+        ).all())
+
+    lines = []
+    for employee in salaried:
+        unpaid_leave_days = 0
+        for day in working_days:
+            leave = month_calendar.leave_for(employee.id, day)
+            if leave and is_unpaid_leave(leave[2]):
+                unpaid_leave_days += 1
+        unpaid_days = absences[employee.id] + unpaid_leave_days
+
+        basic_salary = to_decimal(employee.basic_salary)
+        allowances = to_decimal(employee.house_rent) + to_decimal(employee.medical) + to_decimal(employee.transport)
+        daily_rate = (basic_salary + allowances) / len(working_days) if working_days else Decimal('0')
+        absence_deduction = daily_rate * min(unpaid_days, len(working_days))
+        late_deduction = late_deductions.get(employee.id, Decimal('0'))
+        overtime_amount = overtime.get(employee.id, Decimal('0'))
+
+        deductions = money(absence_deduction + late_deduction)
+        net_salary = max(Decimal('0'), money(basic_salary + allowances + overtime_amount) - deductions)
+        lines.append({
+            'employee_id': employee.id,
+            'employee_name': f'{employee.firstname} {employee.lastname}',
+            'email': employee.email,
+            'unique_id': employee.unique_id,
+            'basic_salary': money(basic_salary),
+            'allowances': money(allowances),
+            'overtime_amount': money(overtime_amount),
+            'deductions': deductions,
+            'net_salary': net_salary,
+            'working_days': len(working_days),
+            'unpaid_days': unpaid_days,
+            'late_deduction': money(late_deduction),
+            'absence_deduction': money(absence_deduction)
+        })
+    return {'lines': lines, 'skipped': skipped}
+
+
+@AuditSummary('run-payroll')
+def run_payroll(month, year, dry_run=False, employee_ids=None):
+    """Compute the month's payroll and, unless dry_run, bulk insert it with notifications.
+
+    Returns the compute_payroll result; with dry_run nothing is written.
+    """
+    result = compute_payroll(month, year, employee_ids)
+    if not dry_run:
+        save_payroll(month, year, result['lines'])
+    return result
+
+
+def save_payroll(month, year, lines, commit=True):
+    """Bulk insert computed payslip lines and notify the employees' user accounts."""
+    if not lines:
+        return 0
+
+    now = datetime.utcnow()
+    db.session.execute(insert(Payroll), [{
+        'employee_id': line['employee_id'],
+        'month': month,
+        'year': year,
+        'basic_salary': line['basic_salary'],
+        'allowances': line['allowances'],
+        'overtime_amount': line['overtime_amount'],
+        'deductions': line['deductions'],
+        'net_salary': line['net_salary'],
+        'status': 'pending',
+        'created_at': now,
+        'updated_at': now
+    } for line in lines])
+    invalidate_month_totals(db.session, [(month, year)])
+    record_bulk_audit('Payroll', 'CREATE', len(lines))
+
+    # Resolve the employees' user accounts with one query (email, or the unique_id login alias)
+    candidates = {}
+    for line in lines:
+        if line['email']:
+            candidates.setdefault(line['email'], line['employee_id'])
+            if '@' not in line['email']:
+                candidates.setdefault(f"{line['unique_id']}@employee.local", line['employee_id'])
+    users = {}
+    for user_id, email in db.session.execute(select(User.id, User.email).where(User.email.in_(list(candidates)))):
+        employee_id = candidates[email]
+        # A direct email match wins over the alias
+        if employee_id not in users or not email.endswith('@employee.local'):
+            users[employee_id] = user_id
+    if users:
+        db.session.execute(insert(Notification), [{
+            'user_id': user_id,
+            'message': f"Your payslip for {month} {year} has been generated.",
+            'type': 'salary',
+            'created_at': now
+        } for user_id in users.values()])
+        record_bulk_audit('Notification', 'CREATE', len(users))
+        invalidate_nav_counts(db.session, users.values())
+
+    if commit:
+        db.session.commit()
+    return len(lines)
+
+
+@AuditSummary('recompute-payroll')
+def recompute_stale_payroll(month=None, year=None, batch_size=1000):
+    """Re-derive pending payrolls flagged stale by utils.payroll_stale, in bulk per month.
+
+    Only the stale employees are computed and their rows are updated with
+    one executemany per batch. A row that was flagged again while it was
+    being recomputed keeps its flag. Rows that cannot be computed any more
+    (employee inactive or without a salary) keep their figures, lose the
+    flag so later runs do not pick them up again, and are logged. Returns
+    the number of rows recomputed.
+    """
+    query = select(Payroll.id, Payroll.employee_id, Payroll.month, Payroll.year, Payroll.stale_at).where(
+        Payroll.status == 'pending', Payroll.stale_at.isnot(None)
+    )
+    if month and year:
+        query = query.where(Payroll.period == payroll_period(month, year))
+    by_month = defaultdict(list)
+    for row in db.session.execute(query.order_by(Payroll.period, Payroll.employee_id)):
+        by_month[(row.month, row.year)].append(row)
+
+    table = Payroll.__table__
+    update = table.update().where(
+        table.c.id == bindparam('row_id'), table.c.stale_at == bindparam('seen_stale_at')
+    ).values(
+        basic_salary=bindparam('basic_salary'),
+        allowances=bindparam('allowances'),
+        overtime_amount=bindparam('overtime_amount'),
+        deductions=bindparam('deductions'),
+        net_salary=bindparam('net_salary'),
+        stale_at=None,
+        updated_at=bindparam('updated_at')
+    )
+    unflag = table.update().where(
+        table.c.id == bindparam('row_id'), table.c.stale_at == bindparam('seen_stale_at')
+    ).values(stale_at=None)
+    now = datetime.utcnow()
+    recomputed = 0
+    for (payroll_month, payroll_year), rows in by_month.items():
+        for batch in chunked(rows, batch_size):
+            lines = compute_payroll(payroll_month, payroll_year, employee_ids=[row.employee_id for row in batch],
+                                    include_existing=True)['lines']
+            lines = dict((line['employee_id'], line) for line in lines)
+            updates = [{
+                'row_id': row.id,
+                'seen_stale_at': row.stale_at,
+                'basic_salary': lines[row.employee_id]['basic_salary'],
+                'allowances': lines[row.employee_id]['allowances'],
+                'overtime_amount': lines[row.employee_id]['overtime_amount'],
+                'deductions': lines[row.employee_id]['deductions'],
+                'net_salary': lines[row.employee_id]['net_salary'],
+                'updated_at': now
+            } for row in batch if row.employee_id in lines]
+            uncomputable = [row for row in batch if row.employee_id not in lines]
+            if uncomputable:
+                db.session.execute(unflag, [{'row_id': row.id, 'seen_stale_at': row.stale_at} for row in uncomputable])
+                current_app.logger.warning(
+                    f'Stale payrolls for {payroll_month} {payroll_year} left unchanged (employee inactive or '
+                    f'without salary): ids {[row.id for row in uncomputable]}'
+                )
+            if updates:
+                db.session.execute(update, updates)
+                record_bulk_audit('Payroll', 'UPDATE', len(updates), ids=[row['row_id'] for row in updates])
+                invalidate_month_totals(db.session, [(payroll_month, payroll_year)])
+            recomputed += len(updates)
+        db.session.commit()
+    return recomputed
+
@@ -0,0 +1,252 @@
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import and_, func, or_, select, text
+from audit import AuditSummary
+from database import db
+from utils.db import chunked
+from utils.payroll import compute_payroll, save_payroll
+from models import Employee, PayrollRun, PayrollRunShard
+
+# Statuses a coordinator may claim a run from; a 'running' run is only claimable once stale
+CLAIMABLE_STATUSES = ('queued', 'failed', 'partial')
+
+# Flask app imported by each pool worker (see _init_worker)
+_worker_app = None
+
+
+def _init_worker():
+    global _worker_app
+    # Workers only read; keep them from starting the punch journal flusher
+    os.environ['PUNCH_WRITE_BEHIND'] = 'false'
+    from app import app
+    _worker_app = app
+
+
+def compute_shard(month, year, min_employee_id, max_employee_id, snapshot=None):
+    """Pool worker: compute the payslips of one employee id range.
+
+    On PostgreSQL the worker joins the coordinator's exported snapshot in a
+    read-only transaction, so every shard sees the same data.
+    """
+    with _worker_app.app_context():
+        try:
+            if snapshot:
+                db.session.connection(execution_options={'isolation_level': 'REPEATABLE READ'})
+                db.session.execute(text(f"SET TRANSACTION SNAPSHOT '{snapshot}'"))
+                db.session.execute(text('SET TRANSACTION READ ONLY'))
+            return compute_payroll(month, year, id_range=(min_employee_id, max_employee_id))['lines']
+        finally:
+            db.session.rollback()
+
+
+def export_snapshot():
+    """Open a REPEATABLE READ transaction on PostgreSQL and export its snapshot for the workers.
+
+    Returns (connection, snapshot_id); the connection must stay open until
+    the workers have started their transactions. Other databases return
+    (None, None) and each shard reads the latest committed data.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return None, None
+    connection = db.engine.connect().execution_options(isolation_level='REPEATABLE READ')
+    connection.begin()
+    snapshot = connection.execute(text('SELECT pg_export_snapshot()')).scalar()
+    if not re.fullmatch(r'[0-9A-Fa-f-]+', snapshot or ''):
+        connection.close()
+        return None, None
+    return connection, snapshot
+
+
+def create_payroll_run(month, year, shard_size=None, created_by=None):
+    """Create a queued run with one shard per shard_size active employees (by id range)."""
+    shard_size = shard_size or current_app.config.get('PAYROLL_SHARD_SIZE', 2000)
+    run = PayrollRun(month=month, year=year, status='queued', created_by=created_by)
+    employee_ids = db.session.execute(
+        select(Employee.id).where(Employee.status == 'active').order_by(Employee.id)
+    ).scalars().all()
+    for index, ids in enumerate(chunked(employee_ids, shard_size)):
+        run.shards.append(PayrollRunShard(index=index, min_employee_id=ids[0], max_employee_id=ids[-1]))
+    db.session.add(run)
+    db.session.commit()
+    return run
+
+
+def _stale_after():
+    return current_app.config.get('PAYROLL_RUN_STALE_AFTER', 600)
+
+
+def _is_fresh():
+    """Condition: the run was queued or heartbeat within PAYROLL_RUN_STALE_AFTER seconds."""
+    cutoff = datetime.utcnow() - timedelta(seconds=_stale_after())
+    return func.coalesce(PayrollRun.heartbeat_at, PayrollRun.updated_at) >= cutoff
+
+
+def active_run_for(month, year):
+    """The month's queued or running run, ignoring runs whose coordinator stopped sending heartbeats."""
+    return PayrollRun.query.filter(
+        PayrollRun.month == month, PayrollRun.year == year, PayrollRun.status.in_(['queued', 'running']),
+        _is_fresh()
+    ).first()
+
+
+def is_run_active(run_id):
+    """True while a coordinator (in any process) holds the run and keeps its heartbeat fresh."""
+    return db.session.execute(
+        select(PayrollRun.id).where(PayrollRun.id == run_id, PayrollRun.status == 'running', _is_fresh())
+    ).first() is not None
+
+
+def claim_payroll_run(run_id):
+    """Atomically mark a run 'running' for this coordinator; False when another one holds it.
+
+    A conditional UPDATE decides, so only one process across all workers
+    wins. A 'running' run whose heartbeat is older than
+    PAYROLL_RUN_STALE_AFTER (its coordinator died) can be taken over.
+    """
+    now = datetime.utcnow()
+    table = PayrollRun.__table__
+    heartbeat = func.coalesce(table.c.heartbeat_at, table.c.updated_at)
+    result = db.session.execute(
+        table.update()
+        .where(table.c.id == run_id, or_(
+            table.c.status.in_(CLAIMABLE_STATUSES),
+            and_(table.c.status == 'running', heartbeat < now - timedelta(seconds=_stale_after()))
+        ))
+        .values(status='running', error=None, heartbeat_at=now, updated_at=now)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+class _Heartbeat:
+    """Refresh a claimed run's heartbeat_at from a background thread until the block exits."""
+
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self.interval = max(1, _stale_after() / 3)
+        self.engine = db.engine
+        self.logger = current_app.logger
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name=f'payroll-run-{self.run_id}-heartbeat', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        table = PayrollRun.__table__
+        while not self._stop.wait(self.interval):
+            try:
+                with self.engine.begin() as connection:
+                    connection.execute(
+                        table.update().where(table.c.id == self.run_id, table.c.status == 'running')
+                        .values(heartbeat_at=datetime.utcnow())
+                    )
+            except Exception as e:
+                self.logger.error(f'Payroll run {self.run_id} heartbeat failed: {str(e)}')
+
+    def __exit__(self, exc_type, exc, traceback):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+
+def execute_payroll_run(run_id, max_workers=None):
+    """Compute every unfinished shard of a run in a process pool, then merge and bulk insert.
+
+    The run is claimed in the database first (see claim_payroll_run), so it
+    executes at most once at a time across processes; returns None when
+    another coordinator holds it. Shard outcomes are committed as they
+    arrive so progress can be polled. Payslips of successful shards are
+    saved even when others fail; failed shards stay 'failed' and can be
+    retried by calling this again.
+    """
+    if not claim_payroll_run(run_id):
+        return None
+    created_by = db.session.get(PayrollRun, run_id).created_by
+    with _Heartbeat(run_id):
+        with AuditSummary(f'payroll-run-{run_id}', actor_id=created_by):
+            return _execute(run_id, max_workers or current_app.config.get('PAYROLL_WORKERS'))
+
+
+def _execute(run_id, max_workers):
+    run = db.session.get(PayrollRun, run_id)
+    shards = [shard for shard in run.shards if shard.status != 'completed']
+    for shard in shards:
+        shard.status = 'running'
+        shard.error = None
+        shard.attempts = (shard.attempts or 0) + 1
+    db.session.commit()
+
+    computed = {}
+    connection, snapshot = export_snapshot()
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker) as pool:
+            futures = dict(
+                (pool.submit(compute_shard, run.month, run.year, shard.min_employee_id, shard.max_employee_id,
+                             snapshot), shard)
+                for shard in shards
+            )
+            for future in as_completed(futures):
+                shard = futures[future]
+                try:
+                    lines = future.result()
+                except Exception as e:
+                    shard.status = 'failed'
+                    shard.error = str(e)[:1000]
+                else:
+                    shard.status = 'computed'
+                    shard.line_count = len(lines)
+                    computed[shard.id] = lines
+                db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        for shard in shards:
+            if shard.id not in computed:
+                shard.status = 'failed'
+                shard.error = str(e)[:1000]
+        current_app.logger.error(f'Payroll run {run_id} pool failed: {str(e)}')
+    finally:
+        if connection is not None:
+            connection.close()
+
+    # Merge the shards and write them in one bulk insert
+    lines = [line for shard in shards for line in computed.get(shard.id, ())]
+    try:
+        save_payroll(run.month, run.year, lines, commit=False)
+        for shard in shards:
+            if shard.id in computed:
+                shard.status = 'completed'
+        run.created_count = (run.created_count or 0) + len(lines)
+        run.status = 'completed' if all(shard.status == 'completed' for shard in run.shards) else 'partial'
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        for shard in shards:
+            if shard.id in computed:
+                shard.status = 'failed'
+                shard.error = f'Saving payslips failed: {str(e)}'[:1000]
+        run.status = 'failed'
+        run.error = str(e)[:1000]
+        db.session.commit()
+    return run
+
+
+def enqueue_payroll_run(run_id):
+    """Execute a run on a background coordinator thread of this process."""
+    app = current_app._get_current_object()
+
+    def coordinate():
+        with app.app_context():
+            execute_payroll_run(run_id)
+
+    thread = threading.Thread(target=coordinate, name=f'payroll-run-{run_id}', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,111 @@
+from datetime import datetime, timedelta
+from sqlalchemy import event, inspect, tuple_
+from database import db
+from models import Leave, LateTime, OverTime, Payroll, Salary
+
+# session.info key holding what the current flush made stale
+PENDING_KEY = 'payroll_stale_pending'
+
+
+def _period(day):
+    return day.year * 100 + day.month
+
+
+def _periods_between(start_date, end_date):
+    """Payroll period (YYYYMM) of every month overlapping start_date..end_date."""
+    periods = []
+    current = start_date.replace(day=1)
+    while current <= end_date:
+        periods.append(_period(current))
+        current = (current + timedelta(days=32)).replace(day=1)
+    return periods
+
+
+def mark_payroll_stale(employee_days=(), employee_ids=(), days=(), employee_periods=(), connection=None):
+    """Flag pending payrolls whose inputs changed so they can be recomputed.
+
+    employee_days: (employee_id, date) pairs, affecting that employee's month.
+    employee_ids: employees whose every pending payroll is affected (salary).
+    days: dates affecting every employee's payroll for that month (holidays).
+    employee_periods: (employee_id, period) keys, period being YYYYMM.
+    """
+    execute = connection.execute if connection is not None else db.session.execute
+    table = Payroll.__table__
+    stale = table.update().where(table.c.status == 'pending').values(stale_at=datetime.utcnow())
+
+    employee_periods = set((int(employee_id), period) for employee_id, period in employee_periods)
+    employee_periods.update(
+        (int(employee_id), _period(day)) for employee_id, day in employee_days if employee_id and day
+    )
+    employee_periods = sorted(employee_periods)
+    # Keeps IN lists well below the bind-parameter limits of every backend
+    for index in range(0, len(employee_periods), 300):
+        execute(stale.where(tuple_(table.c.employee_id, table.c.period).in_(
+            employee_periods[index:index + 300]
+        )))
+
+    employee_ids = sorted(set(int(employee_id) for employee_id in employee_ids))
+    if employee_ids:
+        execute(stale.where(table.c.employee_id.in_(employee_ids)))
+
+    periods = sorted(set(_period(day) for day in days))
+    if periods:
+        execute(stale.where(table.c.period.in_(periods)))
+
+
+def _committed(target, key):
+    history = inspect(target).attrs[key].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return None
+
+
+def before_flush_listener(session, flush_context, instances):
+    pending = session.info.setdefault(PENDING_KEY, {'employee_days': set(), 'employee_periods': set(),
+                                                    'employee_ids': set()})
+    changed = [(target, False) for target in session.new]
+    changed += [(target, True) for target in session.dirty if session.is_modified(target)]
+    changed += [(target, True) for target in session.deleted]
+
+    for target, persisted in changed:
+        if isinstance(target, Salary):
+            pending['employee_ids'].add(target.employee_id)
+            if persisted and _committed(target, 'employee_id'):
+                pending['employee_ids'].add(_committed(target, 'employee_id'))
+        elif isinstance(target, (LateTime, OverTime)):
+            pending['employee_days'].add((target.employee_id, target.date))
+            if persisted:
+                pending['employee_days'].add((_committed(target, 'employee_id'), _committed(target, 'date')))
+        elif isinstance(target, Leave):
+            ranges = [(target.employee_id, target.start_date, target.end_date)]
+            if persisted:
+                ranges.append((_committed(target, 'employee_id'), _committed(target, 'start_date'),
+                               _committed(target, 'end_date')))
+            for employee_id, start_date, end_date in ranges:
+                if employee_id and start_date and end_date:
+                    for period in _periods_between(start_date, end_date):
+                        pending['employee_periods'].add((employee_id, period))
+
+
+def after_flush_listener(session, flush_context):
+    pending = session.info.pop(PENDING_KEY, None)
+    if pending and any(pending.values()):
+        mark_payroll_stale(pending['employee_days'], pending['employee_ids'],
+                           employee_periods=pending['employee_periods'], connection=session.connection())
+
+
+def after_rollback_listener(session, previous_transaction):
+    session.info.pop(PENDING_KEY, None)
+
+
+def register_payroll_stale_listeners():
+    """Flag pending payrolls as stale when Salary, LateTime, OverTime or Leave rows change.
+
+    Attendance status changes reach mark_payroll_stale through the
+    attendance rollup deltas (see utils.rollups.apply_rollup_changes).
+    """
+    event.listen(db.session, 'before_flush', before_flush_listener)
+    event.listen(db.session, 'after_flush', after_flush_listener)
+    event.listen(db.session, 'after_soft_rollback', after_rollback_listener)
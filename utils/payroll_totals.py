@@ -0,0 +1,118 @@
+import threading
+import time
+from decimal import Decimal, ROUND_HALF_UP
+from flask import current_app
+from sqlalchemy import event, func, inspect, select
+from database import db
+from models import Department, Employee, Payroll, payroll_period
+
+# session.info key holding the (month, year) keys touched by the current transaction
+PENDING_KEY = 'payroll_totals_pending'
+
+# (month, year) -> (expires_at, totals)
+_cache = {}
+_cache_lock = threading.Lock()
+
+AMOUNT_COLUMNS = ('basic_salary', 'allowances', 'overtime_amount', 'deductions', 'net_salary')
+
+
+def _aggregates():
+    return [func.count(Payroll.id).label('payslips')] + [
+        func.coalesce(func.sum(getattr(Payroll, column)), 0).label(column) for column in AMOUNT_COLUMNS
+    ]
+
+
+def _amount(value):
+    # SQLite returns SUM() of Numeric columns as float
+    return Decimal(str(value or 0)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def _totals(row):
+    totals = dict((column, _amount(getattr(row, column))) for column in AMOUNT_COLUMNS)
+    totals['gross'] = totals['basic_salary'] + totals['allowances'] + totals['overtime_amount']
+    totals['payslips'] = row.payslips
+    return totals
+
+
+def compute_month_totals(month, year):
+    """Month totals (overall and per department) with two aggregate queries."""
+    period = payroll_period(month, year)
+    overall = db.session.execute(select(*_aggregates()).where(Payroll.period == period)).one()
+    departments = []
+    for row in db.session.execute(
+        select(Department.name.label('department'), *_aggregates())
+        .join(Employee, Employee.id == Payroll.employee_id)
+        .outerjoin(Department, Department.id == Employee.department_id)
+        .where(Payroll.period == period)
+        .group_by(Department.name)
+        .order_by(Department.name)
+    ):
+        departments.append(dict(_totals(row), department=row.department or 'Unassigned'))
+    return dict(_totals(overall), departments=departments)
+
+
+def month_totals(month, year):
+    """Cached compute_month_totals.
+
+    Entries are dropped when a transaction that changed a payroll of the
+    month commits; PAYROLL_TOTALS_CACHE_TTL bounds how long another worker
+    process can keep serving totals it did not see change.
+    """
+    key = (month, int(year))
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache.get(key)
+    if cached and cached[0] > now:
+        return cached[1]
+    totals = compute_month_totals(month, int(year))
+    with _cache_lock:
+        _cache[key] = (now + current_app.config.get('PAYROLL_TOTALS_CACHE_TTL', 300), totals)
+    return totals
+
+
+def invalidate_month_totals(session, months):
+    """Drop the cached totals of (month, year) keys once the session's transaction commits."""
+    session.info.setdefault(PENDING_KEY, set()).update((month, int(year)) for month, year in months)
+
+
+def before_flush_listener(session, flush_context, instances):
+    months = set()
+    for target in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(target, Payroll):
+            continue
+        months.add((target.month, target.year))
+        if target in session.new:
+            continue
+        # Moving a payroll to another month changes the old month's totals too
+        attrs = inspect(target).attrs
+        for month in attrs.month.history.deleted or ():
+            for year in attrs.year.history.deleted or attrs.year.history.unchanged or ():
+                months.add((month, year))
+        for year in attrs.year.history.deleted or ():
+            months.add((target.month, year))
+    months = set((month, year) for month, year in months if month and year)
+    if months:
+        invalidate_month_totals(session, months)
+
+
+def after_commit_listener(session):
+    months = session.info.pop(PENDING_KEY, None)
+    if months:
+        with _cache_lock:
+            for key in months:
+                _cache.pop(key, None)
+
+
+def after_rollback_listener(session, previous_transaction):
+    session.info.pop(PENDING_KEY, None)
+
+
+def register_payroll_totals_listeners():
+    """Invalidate cached month totals when Payroll rows change.
+
+    ORM changes are picked up at flush; bulk writers (save_payroll,
+    recompute_stale_payroll) call invalidate_month_totals themselves.
+    """
+    event.listen(db.session, 'before_flush', before_flush_listener)
+    event.listen(db.session, 'after_commit', after_commit_listener)
+    event.listen(db.session, 'after_soft_rollback', after_rollback_listener)
@@ -0,0 +1,195 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from flask import current_app
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from sqlalchemy import select
+from database import db
+from models import Department, Designation, Employee, Payroll, payroll_period
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'templates')
+TEMPLATE_NAME = 'admin/payroll/payslip_file.html'
+FORMATS = ('html', 'pdf')
+
+# Below this many uncached payslips the pool start-up costs more than it saves
+POOL_THRESHOLD = 50
+
+# Jinja environment of the current process (pool workers build their own)
+_environment = None
+
+
+def _template():
+    global _environment
+    if _environment is None:
+        _environment = Environment(loader=FileSystemLoader(TEMPLATE_DIR), autoescape=select_autoescape(['html']))
+    return _environment.get_template(TEMPLATE_NAME)
+
+
+def template_version():
+    """Digest of the payslip template, so editing it invalidates every cached file."""
+    with open(os.path.join(TEMPLATE_DIR, TEMPLATE_NAME), 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def pdf_available():
+    try:
+        import weasyprint  # noqa: F401
+    except (ImportError, OSError):
+        # OSError: installed, but the Pango / GObject system libraries are missing
+        return False
+    return True
+
+
+def payslip_contexts(month, year):
+    """Template context of every payslip for the month, loaded with one joined query."""
+    rows = db.session.execute(
+        select(
+            Payroll.id, Payroll.employee_id, Payroll.month, Payroll.year, Payroll.status, Payroll.updated_at,
+            Payroll.basic_salary, Payroll.allowances, Payroll.overtime_amount, Payroll.deductions,
+            Payroll.net_salary, Employee.firstname, Employee.lastname, Employee.unique_id,
+            Designation.name.label('designation'), Department.name.label('department')
+        )
+        .join(Employee, Employee.id == Payroll.employee_id)
+        .outerjoin(Designation, Designation.id == Employee.designation_id)
+        .outerjoin(Department, Department.id == Employee.department_id)
+        .where(Payroll.period == payroll_period(month, year))
+        .order_by(Employee.id)
+    ).all()
+    return [{
+        'payroll_id': row.id,
+        'employee_id': row.employee_id,
+        'employee_name': f'{row.firstname} {row.lastname}',
+        'lastname': row.lastname or '',
+        'unique_id': row.unique_id,
+        'designation': row.designation,
+        'department': row.department,
+        'month': row.month,
+        'year': row.year,
+        'status': row.status or 'pending',
+        'pay_date': row.updated_at.strftime('%B %d, %Y') if row.status == 'paid' and row.updated_at else None,
+        'basic_salary': str(row.basic_salary or 0),
+        'allowances': str(row.allowances or 0),
+        'overtime_amount': str(row.overtime_amount or 0),
+        'deductions': str(row.deductions or 0),
+        'gross': str((row.basic_salary or 0) + (row.allowances or 0) + (row.overtime_amount or 0)),
+        'net_salary': str(row.net_salary or 0)
+    } for row in rows]
+
+
+def content_hash(context, fmt, version):
+    """Key of a rendered payslip: changes whenever its data, format or the template change."""
+    payload = json.dumps(context, sort_keys=True, default=str)
+    return hashlib.sha256(f'{version}:{fmt}:{payload}'.encode('utf-8')).hexdigest()
+
+
+def archive_name(context, fmt):
+    name = f"{context['unique_id'] or context['employee_id']}_{context['lastname']}_{context['month']}_{context['year']}"
+    return re.sub(r'[^A-Za-z0-9_.-]+', '-', name) + f'.{fmt}'
+
+
+def render_payslip(context, fmt):
+    """Render one payslip to bytes (PDF through the optional weasyprint library)."""
+    html = _template().render(**context)
+    if fmt == 'pdf':
+        from weasyprint import HTML
+        return HTML(string=html, base_url=TEMPLATE_DIR).write_pdf()
+    return html.encode('utf-8')
+
+
+def render_to_cache(context, fmt, path):
+    """Pool worker: render a payslip and atomically store it in the cache. Returns the path."""
+    data = render_payslip(context, fmt)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+def cache_directory():
+    directory = current_app.config.get('PAYSLIP_CACHE_DIR') or os.path.join(current_app.instance_path, 'payslip-cache')
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def plan_payslips(month, year, fmt):
+    """List (archive name, cache path, context) for the month's payslips and which ones need rendering.
+
+    Cached files are addressed by content hash, so a payroll whose figures,
+    employee details and template are unchanged is never rendered again.
+    """
+    directory = cache_directory()
+    version = template_version()
+    entries = []
+    for context in payslip_contexts(month, year):
+        path = os.path.join(directory, f'{content_hash(context, fmt, version)}.{fmt}')
+        entries.append((archive_name(context, fmt), path, context))
+    missing = [entry for entry in entries if not os.path.exists(entry[1])]
+    return entries, missing
+
+
+def _rendered(missing, fmt, max_workers):
+    """Yield the cache path of each missing payslip as soon as it is rendered."""
+    if len(missing) < POOL_THRESHOLD:
+        for name, path, context in missing:
+            yield render_to_cache(context, fmt, path)
+        return
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = [pool.submit(render_to_cache, context, fmt, path) for name, path, context in missing]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+class _ZipStream:
+    """Write-only file object collecting what zipfile writes until the response takes it."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_payslip_archive(entries, missing, fmt, max_workers=None):
+    """Yield a ZIP of the planned payslips chunk by chunk.
+
+    Cached payslips are streamed first, then the missing ones are rendered
+    (in a process pool for large months) and added as they complete, so
+    memory stays bounded by a single payslip however large the month is.
+    """
+    stream = _ZipStream()
+    pending = set(path for name, path, context in missing)
+    names = dict((path, name) for name, path, context in entries)
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, path, context in entries:
+            if path not in pending:
+                archive.write(path, name)
+                yield stream.take()
+        for path in _rendered(missing, fmt, max_workers):
+            archive.write(path, names[path])
+            yield stream.take()
+    yield stream.take()
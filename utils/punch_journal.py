@@ -0,0 +1,196 @@
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from flask import current_app
+from database import db
+from utils.punches import ingest_punches
+
+
+class PunchJournal:
+    """Durable local write-behind buffer for check-in / check-out punches.
+
+    Each process appends punches as NDJSON lines to its own journal file and
+    fsyncs before returning, so an acknowledged punch survives a crash. A
+    daemon thread periodically rotates the journal into a segment and drains
+    segments into the database through ingest_punches; a segment is only
+    deleted after its batch is committed. Segments and journals left behind
+    by dead processes are claimed and replayed when the flusher starts.
+    Replays are safe because ingestion is idempotent on event_id.
+    """
+
+    def __init__(self, directory, flush_interval=2.0, batch_size=5000):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._file = None
+        self._pid = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._app = None
+        # employee_id -> (date, direction) of the last punch journaled by this process
+        self._last_punch = {}
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def journal_path(self):
+        return os.path.join(self.directory, f'journal-{os.getpid()}.ndjson')
+
+    def append(self, employee_id, direction, timestamp=None):
+        """Durably record one punch and return its event id."""
+        self._ensure_flusher()
+        event_id = uuid.uuid4().hex
+        timestamp = timestamp or datetime.now()
+        line = json.dumps({
+            'event_id': event_id,
+            'employee_id': int(employee_id),
+            'timestamp': timestamp.isoformat(),
+            'direction': direction
+        }) + '\n'
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.journal_path, 'a', encoding='utf-8')
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._last_punch[int(employee_id)] = (timestamp.date(), direction)
+        return event_id
+
+    def last_direction(self, employee_id, day):
+        """Direction of the employee's last punch on day journaled by this process, or None.
+
+        Lets check-in validation see punches the flusher has not applied yet;
+        punches journaled by other worker processes are only seen once flushed.
+        """
+        with self._lock:
+            last = self._last_punch.get(int(employee_id))
+        return last[1] if last and last[0] == day else None
+
+    def start(self, app):
+        """Start the background flusher for this process (recovering leftovers first)."""
+        self._app = app
+        self._pid = os.getpid()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='punch-journal-flusher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the flusher and drain whatever is still journaled."""
+        self._stop.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout=self.flush_interval * 5)
+        if self._app is not None and self._pid == os.getpid():
+            with self._app.app_context():
+                self.drain()
+
+    def _ensure_flusher(self):
+        # Threads do not survive fork, so a forked worker starts its own flusher
+        if self._app is not None and self._pid != os.getpid():
+            with self._lock:
+                self._file = None
+                if self._pid != os.getpid():
+                    self.start(self._app)
+
+    def _run(self):
+        with self._app.app_context():
+            self.recover()
+        while not self._stop.wait(self.flush_interval):
+            with self._app.app_context():
+                self.drain()
+
+    def _claim(self, path):
+        """Atomically take ownership of a file by renaming it into one of our segments."""
+        segment = os.path.join(self.directory, f'segment-{os.getpid()}-{time.time_ns()}.ndjson')
+        try:
+            os.rename(path, segment)
+        except FileNotFoundError:
+            # Another process claimed it first
+            return None
+        return segment
+
+    def recover(self):
+        """Claim journals and segments of processes that are no longer running, then drain."""
+        for path in glob.glob(os.path.join(self.directory, '*.ndjson')):
+            name = os.path.basename(path)
+            try:
+                pid = int(name.split('-')[1].split('.')[0])
+            except (IndexError, ValueError):
+                continue
+            if pid != os.getpid() and not _pid_alive(pid):
+                self._claim(path)
+        self.drain()
+
+    def rotate(self):
+        """Move the active journal into a new segment so appends continue in a fresh file."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if os.path.exists(self.journal_path) and os.path.getsize(self.journal_path):
+                return self._claim(self.journal_path)
+        return None
+
+    def drain(self):
+        """Flush every segment owned by this process into the database. Returns the punch count."""
+        self.rotate()
+        flushed = 0
+        pattern = os.path.join(self.directory, f'segment-{os.getpid()}-*.ndjson')
+        for segment in sorted(glob.glob(pattern)):
+            try:
+                events = _read_segment(segment)
+                for index in range(0, len(events), self.batch_size):
+                    ingest_punches(events[index:index + self.batch_size])
+            except Exception as e:
+                db.session.rollback()
+                current_app.logger.error(f'Punch journal flush failed for {segment}: {str(e)}')
+                # Keep the segment (and everything after it) for the next round
+                break
+            os.remove(segment)
+            flushed += len(events)
+        return flushed
+
+
+def _read_segment(path):
+    events = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                # A torn last line from a crash mid-write was never acknowledged
+                continue
+    return events
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def init_punch_journal(app):
+    """Create and start the write-behind journal when PUNCH_WRITE_BEHIND is enabled."""
+    if not app.config.get('PUNCH_WRITE_BEHIND'):
+        return None
+    journal = PunchJournal(
+        app.config.get('PUNCH_JOURNAL_DIR') or os.path.join(app.instance_path, 'punch-journal'),
+        flush_interval=float(app.config.get('PUNCH_FLUSH_INTERVAL', 2))
+    )
+    app.extensions['punch_journal'] = journal
+    journal.start(app)
+    atexit.register(journal.stop)
+    return journal
+
+
+def get_punch_journal():
+    """The current app's journal, or None when punches are written synchronously."""
+    return current_app.extensions.get('punch_journal')
@@ -0,0 +1,165 @@
+from datetime import datetime
+from sqlalchemy import case, select, tuple_
+from database import db
+from utils.attendance import CHECK_IN_PRESENT_FROM, derive_from_punch_log
+from utils.db import chunked, upsert
+from models import Attendance, Check, Employee
+
+def parse_timestamp(value):
+    """Parse an ISO-8601 punch timestamp into a naive local datetime."""
+    timestamp = datetime.fromisoformat(str(value))
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone().replace(tzinfo=None)
+    return timestamp
+
+
+def parse_punches(events):
+    """Validate raw punch events.
+
+    Employees are identified by unique_id or, for punches recorded inside
+    the app, by employee_id. Returns (punches, rejected) where punches is a
+    list of dicts with index, event_id, employee (a (field, value) key),
+    timestamp and direction and rejected is a list of
+    {'index', 'event_id', 'error'} entries.
+    """
+    punches = []
+    rejected = []
+    for index, event in enumerate(events):
+        if not isinstance(event, dict):
+            rejected.append({'index': index, 'event_id': None, 'error': 'Punch must be an object'})
+            continue
+        event_id = event.get('event_id')
+        unique_id = event.get('unique_id')
+        employee_id = event.get('employee_id')
+        direction = event.get('direction')
+        if not event_id or len(str(event_id)) > 64:
+            error = 'event_id is required (max 64 characters)'
+        elif not unique_id and not isinstance(employee_id, int):
+            error = 'unique_id is required'
+        elif direction not in ('in', 'out'):
+            error = "direction must be 'in' or 'out'"
+        else:
+            try:
+                timestamp = parse_timestamp(event.get('timestamp'))
+            except (TypeError, ValueError):
+                error = 'timestamp must be ISO-8601'
+            else:
+                punches.append({
+                    'index': index,
+                    'event_id': str(event_id),
+                    'employee': ('unique_id', str(unique_id)) if unique_id else ('id', employee_id),
+                    'timestamp': timestamp,
+                    'direction': direction
+                })
+                continue
+        rejected.append({'index': index, 'event_id': event_id, 'error': error})
+    return punches, rejected
+
+
+def ingest_punches(events):
+    """Apply a batch of device punches to the checks log and attendances.
+
+    Duplicate event ids (within the batch or already stored) are skipped,
+    employees are resolved with one query into an in-memory map, and each
+    table is written with a single multi-row upsert. Attendance times are
+    merged in the database (earliest in, latest out) so replays and
+    concurrent batches converge, then every touched day is re-derived from
+    its punch log. Everything is committed in one transaction. Returns a
+    summary dict.
+    """
+    punches, rejected = parse_punches(events)
+    summary = {'received': len(events), 'accepted': 0, 'duplicates': 0, 'rejected': rejected}
+
+    unique_punches = {}
+    for punch in punches:
+        if punch['event_id'] in unique_punches:
+            summary['duplicates'] += 1
+        else:
+            unique_punches[punch['event_id']] = punch
+
+    stored = set()
+    for event_ids in chunked(unique_punches):
+        stored.update(db.session.execute(select(Check.event_id).where(Check.event_id.in_(event_ids))).scalars())
+    summary['duplicates'] += len(stored)
+
+    employees = {}
+    keys = set(punch['employee'] for event_id, punch in unique_punches.items() if event_id not in stored)
+    for field, column in (('unique_id', Employee.unique_id), ('id', Employee.id)):
+        for chunk in chunked(value for kind, value in keys if kind == field):
+            for value, employee_id in db.session.execute(
+                select(column, Employee.id).where(column.in_(chunk))
+            ):
+                employees[(field, value)] = employee_id
+
+    checks = []
+    days = {}
+    now = datetime.utcnow()
+    for event_id, punch in unique_punches.items():
+        if event_id in stored:
+            continue
+        if punch['employee'] not in employees:
+            rejected.append({'index': punch['index'], 'event_id': event_id, 'error': 'Unknown employee'})
+            continue
+
+        employee_id = employees[punch['employee']]
+        day = punch['timestamp'].date()
+        time = punch['timestamp'].time().replace(microsecond=0)
+        checks.append({
+            'employee_id': employee_id,
+            'date': day,
+            'time_in': time if punch['direction'] == 'in' else None,
+            'time_out': time if punch['direction'] == 'out' else None,
+            'event_id': event_id,
+            'created_at': now,
+            'updated_at': now
+        })
+
+        merged = days.setdefault((employee_id, day), {
+            'employee_id': employee_id,
+            'date': day,
+            'time_in': None,
+            'time_out': None,
+            'status': 'present',
+            'updated_at': now
+        })
+        if punch['direction'] == 'in' and (merged['time_in'] is None or time < merged['time_in']):
+            merged['time_in'] = time
+        if punch['direction'] == 'out' and (merged['time_out'] is None or time > merged['time_out']):
+            merged['time_out'] = time
+
+    if not checks:
+        return summary
+
+    table = Attendance.__table__
+    previous = {}
+    for keys in chunked(days):
+        for row in db.session.execute(
+            select(table.c.employee_id, table.c.date, table.c.status, table.c.late_minutes)
+            .where(tuple_(table.c.employee_id, table.c.date).in_(keys))
+        ):
+            previous[(row.employee_id, row.date)] = (row.date, row.status, row.late_minutes)
+
+    upsert(Check.__table__, checks, ['event_id'])
+    upsert(table, list(days.values()), ['employee_id', 'date'], update=lambda new: {
+        'time_in': case(
+            (table.c.time_in.is_(None), new.time_in),
+            (new.time_in < table.c.time_in, new.time_in),
+            else_=table.c.time_in
+        ),
+        'time_out': case(
+            (table.c.time_out.is_(None), new.time_out),
+            (new.time_out > table.c.time_out, new.time_out),
+            else_=table.c.time_out
+        ),
+        # A mapping case instead of IN (...): expanding parameters are not allowed with executemany
+        'status': case(dict((status, 'present') for status in CHECK_IN_PRESENT_FROM), value=table.c.status,
+                       else_=table.c.status),
+        'updated_at': new.updated_at
+    })
+
+    # Derive first in / last out / worked minutes from the full punch log of each touched day
+    derive_from_punch_log(list(days), previous=previous)
+    db.session.commit()
+
+    summary['accepted'] = len(checks)
+    return summary
@@ -0,0 +1,168 @@
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import case, event, func, inspect, select
+from database import db
+from models import Attendance, AttendanceDailyRollup, Employee
+from utils.db import upsert
+from utils.payroll_stale import mark_payroll_stale
+
+# session.info key holding per-flush changes: (employee_id, date, status) -> [count, late_count, late_minutes]
+PENDING_KEY = 'attendance_rollup_pending'
+
+
+def _late_values(late_minutes):
+    late_minutes = late_minutes or 0
+    return (1 if late_minutes > 0 else 0), late_minutes
+
+
+def record_rollup_change(session, employee_id, old=None, new=None):
+    """Queue a rollup change for one attendance row.
+
+    old and new are (date, status, late_minutes) tuples or None for an
+    inserted / deleted row. Queued changes are applied after the next flush.
+    """
+    pending = session.info.setdefault(PENDING_KEY, defaultdict(lambda: [0, 0, 0]))
+    add_rollup_change(pending, employee_id, old=old, new=new)
+
+
+def add_rollup_change(changes, employee_id, old=None, new=None):
+    """Add one row's old/new values to a changes dict for apply_rollup_changes."""
+    for values, sign in ((old, -1), (new, 1)):
+        if values is None or values[0] is None or values[1] is None:
+            continue
+        day, status, late_minutes = values
+        late_count, late_minutes = _late_values(late_minutes)
+        key = (int(employee_id), day, status)
+        changes[key][0] += sign
+        changes[key][1] += sign * late_count
+        changes[key][2] += sign * late_minutes
+
+
+def apply_rollup_changes(changes, connection=None):
+    """Fold {(employee_id, date, status): [count, late_count, late_minutes]} into the rollup table.
+
+    Employees are resolved to departments with one query and the result is
+    written with a single incrementing upsert.
+    """
+    execute = connection.execute if connection is not None else db.session.execute
+    employee_ids = set(employee_id for employee_id, _, _ in changes)
+    if not employee_ids:
+        return
+    departments = dict(execute(
+        select(Employee.id, Employee.department_id).where(Employee.id.in_(employee_ids))
+    ).all())
+
+    totals = defaultdict(lambda: [0, 0, 0])
+    for (employee_id, day, status), (count, late_count, late_minutes) in changes.items():
+        total = totals[(day, departments.get(employee_id) or 0, status)]
+        total[0] += count
+        total[1] += late_count
+        total[2] += late_minutes
+
+    table = AttendanceDailyRollup.__table__
+    now = datetime.utcnow()
+    rows = [{
+        'date': day,
+        'department_id': department_id,
+        'status': status,
+        'count': count,
+        'late_count': late_count,
+        'late_minutes': late_minutes,
+        'updated_at': now
+    } for (day, department_id, status), (count, late_count, late_minutes) in totals.items()
+        if count or late_count or late_minutes]
+
+    # Status changes feed payroll absences; flag the affected pending payrolls
+    mark_payroll_stale(
+        set((employee_id, day) for (employee_id, day, _), (count, _, _) in changes.items() if count),
+        connection=connection
+    )
+
+    upsert(table, rows, ['date', 'department_id', 'status'], update=lambda new: {
+        'count': table.c.count + new.count,
+        'late_count': table.c.late_count + new.late_count,
+        'late_minutes': table.c.late_minutes + new.late_minutes,
+        'updated_at': new.updated_at
+    }, connection=connection)
+
+
+def rebuild_rollups(dates=None, start_date=None, end_date=None, commit=True):
+    """Recompute the rollup rows for the given dates (or date range) from the attendance table."""
+    table = AttendanceDailyRollup.__table__
+    if dates is not None:
+        dates = sorted(set(dates))
+        if not dates:
+            return 0
+        rollup_scope = table.c.date.in_(dates)
+        attendance_scope = Attendance.date.in_(dates)
+    else:
+        rollup_scope = table.c.date.between(start_date, end_date)
+        attendance_scope = Attendance.date.between(start_date, end_date)
+
+    db.session.execute(table.delete().where(rollup_scope))
+    grouped = select(
+        Attendance.date,
+        func.coalesce(Employee.department_id, 0),
+        Attendance.status,
+        func.count(Attendance.id),
+        func.sum(case((Attendance.late_minutes > 0, 1), else_=0)),
+        func.coalesce(func.sum(Attendance.late_minutes), 0),
+        func.now()
+    ).join(Employee, Employee.id == Attendance.employee_id).where(
+        attendance_scope, Attendance.status.isnot(None)
+    ).group_by(Attendance.date, func.coalesce(Employee.department_id, 0), Attendance.status)
+    result = db.session.execute(table.insert().from_select(
+        ['date', 'department_id', 'status', 'count', 'late_count', 'late_minutes', 'updated_at'], grouped
+    ))
+    if commit:
+        db.session.commit()
+    return result.rowcount
+
+
+def _attendance_values(target, committed=False):
+    state = inspect(target)
+    values = []
+    for key in ('date', 'status', 'late_minutes'):
+        if committed:
+            history = state.attrs[key].history
+            if history.deleted:
+                values.append(history.deleted[0])
+            elif history.unchanged:
+                values.append(history.unchanged[0])
+            else:
+                values.append(None if history.added else getattr(target, key))
+        else:
+            values.append(getattr(target, key))
+    return tuple(values)
+
+
+def before_flush_listener(session, flush_context, instances):
+    for target in session.new:
+        if isinstance(target, Attendance):
+            record_rollup_change(session, target.employee_id, new=_attendance_values(target))
+    for target in session.dirty:
+        if isinstance(target, Attendance) and session.is_modified(target):
+            old = _attendance_values(target, committed=True)
+            new = _attendance_values(target)
+            if old != new:
+                record_rollup_change(session, target.employee_id, old=old, new=new)
+    for target in session.deleted:
+        if isinstance(target, Attendance):
+            record_rollup_change(session, target.employee_id, old=_attendance_values(target, committed=True))
+
+
+def after_flush_listener(session, flush_context):
+    changes = session.info.pop(PENDING_KEY, None)
+    if changes:
+        apply_rollup_changes(changes, connection=session.connection())
+
+
+def after_rollback_listener(session, previous_transaction):
+    session.info.pop(PENDING_KEY, None)
+
+
+def register_rollup_listeners():
+    """Keep attendance_daily_rollups in step with ORM changes to Attendance"""
+    event.listen(db.session, 'before_flush', before_flush_listener)
+    event.listen(db.session, 'after_flush', after_flush_listener)
+    event.listen(db.session, 'after_soft_rollback', after_rollback_listener)